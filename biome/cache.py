@@ -0,0 +1,533 @@
+#!/usr/bin/env python3
+
+# binary sidecar files for parsed data files, stored next to the uploaded file
+# (in app.config['UPLOAD_FOLDER']) and memory-mapped read-only, so all uWSGI
+# processes share the same pages instead of each keeping its own parsed copy
+import os
+import json
+import mmap
+import shutil
+import struct
+import threading
+import numpy as np
+from collections import OrderedDict
+from tempfile import mkstemp
+from biome import ( app,
+                    bgzf,
+                    ms1,
+                    ms2,
+                    parsers,
+                    sidecar,
+                    )
+
+# name suffix of the offsets array of a parsers.StringColumn (stored as its UTF-8 data array + offsets)
+STRING_OFFSETS_SUFFIX = '@offsets'
+
+DTASELECT_SUFFIX = '.dtacache'
+DTASELECT_INDEX_SUFFIX = '.dtaidx'
+MS2_INDEX_SUFFIX = ms2.INDEX_SUFFIX
+MS1_CHROMATOGRAM_SUFFIX = '.ms1tic'
+MS1_XIC_INDEX_SUFFIX = '.ms1xic'
+# data files each process keeps open (memory maps and bgzf.BlockFiles, see mapped_file and file_reader)
+MAX_OPEN_FILES = 64
+
+# columns of the XIC index sidecar (see build_ms1_sidecars)
+MS1_XIC_INDEX_COLUMNS = [   ('scans/scan', np.int32),
+                            ('scans/retention_time', np.float64),
+                            ('mz', np.float64),
+                            ('intensity', np.float32),
+                            ('peak_offsets', np.int64),
+                            ]
+
+# sidecar path -> (sidecar stat signature, tables), so each process maps a sidecar once
+_mapped_tables = {}
+class OpenFiles():
+
+    ''' Least recently used open files of a process (path -> (stat signature, open file)),
+        at most max_size of them. Files that are evicted, or replaced by a newer
+        signature, are closed
+    '''
+
+    def __init__(self, max_size=MAX_OPEN_FILES):
+        self.max_size = max_size
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, path, signature):
+        # the open file of path if it was opened with signature, otherwise None
+        with self._lock:
+            cached = self._entries.get(path)
+            if cached is None or cached[0] != signature:
+                return None
+            self._entries.move_to_end(path)
+            return cached[1]
+
+    def put(self, path, signature, opened):
+        with self._lock:
+            closing = [self._entries.pop(path, (None, None))[1]]
+            self._entries[path] = (signature, opened)
+            while len(self._entries) > self.max_size:
+                closing.append(self._entries.popitem(last=False)[1][1])
+        for old in closing:
+            _close(old)
+
+    def clear(self):
+        with self._lock:
+            closing = [opened for _, opened in self._entries.values()]
+            self._entries.clear()
+        for old in closing:
+            _close(old)
+
+def _close(opened):
+    # (empty files are b'' instead of a memory map)
+    if hasattr(opened, 'close'):
+        try:
+            opened.close()
+        except BufferError:
+            pass # (still exported, e.g. to a numpy array: unmapped when that's freed)
+
+# data file path -> (stat signature, mmap), see mapped_file
+_mapped_files = OpenFiles()
+# compressed data file path -> (stat signature, bgzf.BlockFile), see file_reader
+_block_files = OpenFiles()
+# data file path -> (size, mtime_ns, sha224) of contents hashed by this process, see _is_current
+_verified_hashes = {}
+
+def _stat_signature(stat_result):
+    return [stat_result.st_ino, stat_result.st_size, stat_result.st_mtime_ns]
+
+def write_tables(path, tables, source):
+
+    ''' Writes a dict of arrays (values may also be dicts of arrays, one level deep) to path
+
+        File layout (see biome.sidecar): MAGIC, header length (uint64), JSON header, then
+        each array's raw data (aligned to 64 bytes). The header lists name/dtype/shape/offset of each array,
+        plus the 'source' dict that is used to check that the sidecar is still valid.
+        String columns (parsers.StringColumn) are stored as their UTF-8 data and offsets arrays.
+
+        The file is written to a temporary file and renamed, so readers in other processes
+        never see a partially written sidecar.
+    '''
+
+    arrays = []
+    for name, value in sorted(tables.items()):
+        columns = sorted(('{}/{}'.format(name, column), array) for column, array in value.items()) if isinstance(value, dict) else [(name, value)]
+        for column, array in columns:
+            if isinstance(array, parsers.StringColumn):
+                # (offsets of a slice don't start at 0)
+                arrays.append((column, np.ascontiguousarray(array.data[array.offsets[0]:array.offsets[-1]])))
+                arrays.append((column+STRING_OFFSETS_SUFFIX, np.ascontiguousarray(array.offsets - array.offsets[0])))
+            else:
+                arrays.append((column, np.ascontiguousarray(array)))
+
+    def write_data(f):
+        for name, array in arrays:
+            f.write(array.tobytes())
+            f.write(b'\0' * sidecar.padding(array.nbytes))
+
+    _write_sidecar(path, [(name, array.dtype, array.shape) for name, array in arrays], source, write_data)
+
+def _write_sidecar(path, arrays, source, write_data):
+    # writes the header for arrays (name, dtype, shape) to a temporary file, then
+    # write_data(f) writes the arrays' data (each padded to sidecar.ALIGNMENT) and the file is renamed to path
+
+    # offsets are relative to the start of the data section
+    entries = []
+    data_size = 0
+    for name, dtype, shape in arrays:
+        nbytes = int(np.prod(shape)) * np.dtype(dtype).itemsize
+        entries.append({'name': name, 'dtype': np.dtype(dtype).str, 'shape': list(shape), 'offset': data_size})
+        data_size += nbytes + sidecar.padding(nbytes)
+
+    header = json.dumps({'version': sidecar.VERSION, 'source': source, 'arrays': entries}).encode('utf-8')
+    data_start = len(sidecar.MAGIC) + 8 + len(header)
+    data_start += sidecar.padding(data_start)
+
+    tmp_fd, tmp_path = mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+    try:
+        with os.fdopen(tmp_fd, 'wb') as f:
+            f.write(sidecar.MAGIC)
+            f.write(struct.pack('<Q', len(header)))
+            f.write(header)
+            f.write(b'\0' * (data_start - f.tell()))
+            write_data(f)
+        os.chmod(tmp_path, 0o644)
+        os.replace(tmp_path, path)
+    except:
+        os.remove(tmp_path)
+        raise
+
+class TableWriter():
+
+    ''' Writes a sidecar (same format as write_tables) from 1-dimensional arrays that are
+        appended in parts (e.g. one batch of scans at a time), so only one part has to be
+        in memory
+
+        columns: list of (name, dtype), with 'table/column' names for tables of arrays.
+        Each array is written to its own temporary file (next to path) until close()
+        writes the sidecar
+    '''
+
+    def __init__(self, path, columns):
+
+        self.path = path
+        self._columns = []
+        try:
+            for name, dtype in columns:
+                tmp_fd, tmp_path = mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+                self._columns.append({  'name': name,
+                                        'dtype': np.dtype(dtype),
+                                        'file': os.fdopen(tmp_fd, 'w+b'),
+                                        'path': tmp_path,
+                                        'length': 0,
+                                        })
+        except:
+            self.discard()
+            raise
+
+    def append(self, name, array):
+
+        ''' Appends array (converted to the column's dtype) to column name
+        '''
+
+        column = next(column for column in self._columns if column['name'] == name)
+        array = np.ascontiguousarray(array, dtype=column['dtype'])
+        column['file'].write(array.tobytes())
+        column['length'] += len(array)
+
+    def close(self, source):
+
+        ''' Writes the sidecar (with the 'source' dict, see write_tables) and removes the temporary files
+        '''
+
+        def write_data(f):
+            for column in self._columns:
+                column['file'].seek(0)
+                shutil.copyfileobj(column['file'], f, sidecar.HASH_BLOCK_SIZE)
+                f.write(b'\0' * sidecar.padding(column['length'] * column['dtype'].itemsize))
+
+        try:
+            _write_sidecar(self.path, [(column['name'], column['dtype'], (column['length'],)) for column in self._columns], source, write_data)
+        finally:
+            self.discard()
+
+    def discard(self):
+
+        ''' Removes the temporary files (without writing the sidecar)
+        '''
+
+        for column in self._columns:
+            column['file'].close()
+            if os.path.exists(column['path']):
+                os.remove(column['path'])
+        self._columns = []
+
+def read_tables(path):
+
+    ''' Memory-maps a sidecar written by write_tables() (see sidecar.read_arrays)
+
+        Returns (source, tables). Arrays in tables (and the arrays of string columns) are
+        read-only views of the mapped file.
+    '''
+
+    source, arrays = sidecar.read_arrays(path)
+
+    tables = dict()
+    for name, array in arrays.items():
+        if '/' in name:
+            table, column = name.split('/', 1)
+            tables.setdefault(table, dict())[column] = array
+        else:
+            tables[name] = array
+
+    # UTF-8 data + offsets arrays -> StringColumn
+    for table in [tables] + [value for value in tables.values() if isinstance(value, dict)]:
+        for name in [name for name in table if name.endswith(STRING_OFFSETS_SUFFIX)]:
+            offsets = table.pop(name)
+            column = name[:-len(STRING_OFFSETS_SUFFIX)]
+            table[column] = parsers.StringColumn(table[column], offsets)
+
+    return source, tables
+
+def source_signature(file_path):
+
+    ''' Returns a dict describing the current contents of file_path
+        (stat size/mtime to cheaply detect changes, and the SHA224 content hash)
+    '''
+
+    stat_result = os.stat(file_path)
+
+    return {'size': stat_result.st_size,
+            'mtime_ns': stat_result.st_mtime_ns,
+            'sha224': sidecar.content_hash(file_path),
+            }
+
+def _is_current(source, file_path):
+
+    ''' True if the sidecar (described by source) was made from the current contents of file_path
+
+        Only rehashes the file if size/mtime changed (e.g. file was touched or rewritten),
+        and then only once per process for each mtime (the hash is kept in _verified_hashes)
+    '''
+
+    stat_result = os.stat(file_path)
+    if source['size'] != stat_result.st_size:
+        return False
+    if source['mtime_ns'] == stat_result.st_mtime_ns:
+        return True
+
+    current = (stat_result.st_size, stat_result.st_mtime_ns)
+    verified = _verified_hashes.get(file_path)
+    if verified is None or verified[:2] != current:
+        verified = current + (sidecar.content_hash(file_path),)
+        _verified_hashes[file_path] = verified
+
+    return source['sha224'] == verified[2]
+
+def load_tables(file_path, suffix):
+
+    ''' Returns memory-mapped tables from the sidecar of file_path (file_path+suffix),
+        or None if the sidecar doesn't exist or was made from different file contents
+    '''
+
+    path = file_path+suffix
+
+    try:
+        signature = _stat_signature(os.stat(path))
+    except FileNotFoundError:
+        _mapped_tables.pop(path, None)
+        return None
+
+    cached = _mapped_tables.get(path)
+    if cached and cached[0] == signature:
+        source, tables = cached[1]
+    else:
+        try:
+            source, tables = read_tables(path)
+        except ValueError:
+            app.logger.error('Ignoring invalid sidecar file {}'.format(path))
+            return None
+        _mapped_tables[path] = (signature, (source, tables))
+
+    if not _is_current(source, file_path):
+        _mapped_tables.pop(path, None)
+        return None
+
+    return tables
+
+def _load_or_build(file_path, suffix, build):
+
+    ''' Returns memory-mapped tables from the sidecar of file_path (file_path+suffix)
+
+        (Re)builds the sidecar with build(file_path) if it doesn't exist, or if the file
+        has changed since it was built
+    '''
+
+    tables = load_tables(file_path, suffix)
+    if tables is not None:
+        return tables
+
+    source = source_signature(file_path)
+    write_tables(file_path+suffix, build(file_path), source)
+
+    app.logger.info('Wrote {} sidecar for {}'.format(suffix, file_path))
+
+    return load_tables(file_path, suffix)
+
+def dtaselect_tables(file_path):
+
+    ''' Returns parsers.dtaselect_columnar() output for a DTASelect-filter.txt file,
+        memory-mapped from its sidecar (file_path+'.dtacache').
+    '''
+
+    return _load_or_build(file_path, DTASELECT_SUFFIX, parsers.dtaselect_columnar)
+
+def dtaselect_index(file_path):
+
+    ''' Returns the byte offset of each protein group in a DTASelect-filter.txt file
+        (parsers.dtaselect_group_offsets), memory-mapped from its sidecar (file_path+'.dtaidx').
+
+        Used to parse one page of protein groups without reading the whole file
+    '''
+
+    return _load_or_build(file_path, DTASELECT_INDEX_SUFFIX, lambda path: {'group_offsets': parsers.dtaselect_group_offsets(path)})['group_offsets']
+
+def ms2_scan_index(file_path):
+
+    ''' Returns ms2.scan_index() output for an MS2 file (scan numbers, precursors,
+        charges, retention times, peak counts and byte ranges), memory-mapped from its
+        sidecar (file_path+'.ms2idx').
+
+        Built once when the file is uploaded, so scans can be counted, looked up and split
+        without reading the MS2 file again
+    '''
+
+    return _load_or_build(file_path, MS2_INDEX_SUFFIX, ms2.scan_index)
+
+def ms1_xic_index(file_path):
+
+    ''' Returns the XIC index of an MS1 file (all peaks, sorted by retention time and m/z),
+        memory-mapped from its sidecar (file_path+'.ms1xic'), or None if it hasn't been built
+        (see build_ms1_sidecars)
+
+        Extracted ion chromatograms only read the pages of the scans in their retention time range
+    '''
+
+    return load_tables(file_path, MS1_XIC_INDEX_SUFFIX)
+
+def ms1_chromatograms(file_path):
+
+    ''' Returns ms1.chromatograms() output for an MS1 file (TIC and base peak per scan),
+        memory-mapped from its sidecar (file_path+'.ms1tic').
+
+        Built once when the file is uploaded (see build_ms1_sidecars), so chromatograms are
+        served without reading the MS1 file (views only load the sidecar, see views_helpers.load_sidecar)
+    '''
+
+    return _load_or_build(file_path, MS1_CHROMATOGRAM_SUFFIX, ms1.chromatograms)
+
+def _append_xic_batch(writer, batch, peak_count):
+    # appends a batch of scans (see ms1.scan_batch) to an XIC index sidecar, after peak_count peaks
+    writer.append('scans/scan', batch['scans']['scan'])
+    writer.append('scans/retention_time', batch['scans']['retention_time'])
+    writer.append('mz', batch['mz'])
+    writer.append('intensity', batch['intensity'])
+    writer.append('peak_offsets', batch['peak_offsets'][:-1] + peak_count)
+
+def _reorder_xic_index(path, scan_order, batch_size, source):
+    # rewrites an XIC index sidecar with its scans in scan_order, batch_size scans at a time
+    # (the peaks of each batch are read from the memory-mapped sidecar that's being replaced)
+    index = read_tables(path)[1]
+    writer = TableWriter(path, MS1_XIC_INDEX_COLUMNS)
+    try:
+        peak_count = 0
+        for start in range(0, len(scan_order), batch_size):
+            scans = scan_order[start:start+batch_size]
+            peaks, peak_offsets = ms1.segment_positions(index['peak_offsets'], scans)
+            _append_xic_batch(writer, { 'scans': {column: values[scans] for column, values in index['scans'].items()},
+                                        'mz': index['mz'][peaks],
+                                        'intensity': index['intensity'][peaks],
+                                        'peak_offsets': peak_offsets,
+                                        }, peak_count)
+            peak_count += int(peak_offsets[-1])
+        writer.append('peak_offsets', [peak_count])
+    except:
+        writer.discard()
+        raise
+
+    writer.close(source)
+
+def build_ms1_sidecars(file_path, batch_size=ms1.BATCH_SIZE):
+
+    ''' Builds the XIC index (file_path+'.ms1xic') and chromatogram (file_path+'.ms1tic')
+        sidecars of an MS1 file in one pass over the file, one batch of scans at a time
+        (see ms1.read_batches), so only one batch of peaks is in memory
+
+        The XIC index has the layout of one batch of the whole file (see ms1.scan_batch),
+        with scans sorted by retention time and each scan's peaks sorted by m/z. Batches are
+        written to the sidecar as they're read; if the scans aren't in retention time order
+        (MS1 files usually are), the sidecar is then rewritten in order, a batch at a time
+
+        Reads the whole file, so it's only called from ingest jobs (see
+        views_helpers.precompute_ms1_chromatograms), never while serving a request
+    '''
+
+    source = source_signature(file_path)
+    path = file_path+MS1_XIC_INDEX_SUFFIX
+
+    writer = TableWriter(path, MS1_XIC_INDEX_COLUMNS)
+    parts = []
+    try:
+        peak_count = 0
+        for batch in ms1.read_batches(file_path, batch_size=batch_size):
+            parts.append(ms1.batch_chromatograms(batch))
+            _append_xic_batch(writer, ms1.sort_scan_peaks(batch), peak_count)
+            peak_count += len(batch['mz'])
+        writer.append('peak_offsets', [peak_count])
+    except:
+        writer.discard()
+        raise
+    writer.close(source)
+
+    if not parts:
+        parts = [ms1.batch_chromatograms(ms1.scan_batch([]))]
+    chromatograms = {name: np.concatenate([part[name] for part in parts]) for name in parts[0]}
+
+    scan_order = np.argsort(chromatograms['retention_time'], kind='mergesort')
+    if (scan_order != np.arange(len(scan_order))).any():
+        _reorder_xic_index(path, scan_order, batch_size, source)
+
+    write_tables(file_path+MS1_CHROMATOGRAM_SUFFIX, chromatograms, source)
+
+    app.logger.info('Wrote {} and {} sidecars for {}'.format(MS1_XIC_INDEX_SUFFIX, MS1_CHROMATOGRAM_SUFFIX, file_path))
+
+def mapped_file(file_path):
+
+    ''' Returns a read-only memory map of a (stored) data file, mapped once per process
+        (the MAX_OPEN_FILES most recently used files stay mapped, see OpenFiles)
+
+        All uWSGI processes share the file's pages in the OS page cache, so random access
+        (e.g. single scans of an MS2 file) only reads the pages that are used
+    '''
+
+    signature = _stat_signature(os.stat(file_path))
+
+    mapped = _mapped_files.get(file_path, signature)
+    if mapped is not None:
+        return mapped
+
+    with open(file_path, 'rb') as f:
+        # (empty files can't be mapped)
+        mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) if signature[1] else b''
+    _mapped_files.put(file_path, signature, mapped)
+
+    return mapped
+
+def file_reader(file_path):
+
+    ''' Returns a function read(offset, length) that reads bytes of the (uncompressed)
+        contents of a stored data file
+
+        Plain files are read from their memory map (see mapped_file). Block-compressed
+        files (see bgzf) are read with a bgzf.BlockFile that's opened once per process,
+        which only decompresses the blocks that overlap the bytes that are read
+    '''
+
+    signature = _stat_signature(os.stat(file_path))
+
+    block_file = _block_files.get(file_path, signature)
+    if block_file is not None:
+        return block_file.pread
+
+    if bgzf.file_format(file_path) == 'bgzf':
+        block_file = bgzf.BlockFile(file_path)
+        _block_files.put(file_path, signature, block_file)
+        return block_file.pread
+
+    mapped = mapped_file(file_path)
+
+    return lambda offset, length: mapped[offset:offset+length]
+
+def ms2_scans(file_path, scans, index=None):
+
+    ''' Parses scans (see ms2.parse_scan) of an MS2 file by scan number, read from
+        the file at the offsets in its scan index (see file_reader) (generator function)
+
+        index: the file's scan index, e.g. from load_tables (built if not given, see ms2_scan_index)
+
+        Yields one parsed scan per scan number (None for scans that aren't in the file)
+    '''
+
+    if index is None:
+        index = ms2_scan_index(file_path)
+    read = file_reader(file_path)
+    offsets, lengths = index['scans']['offset'], index['scans']['length']
+
+    for row in ms2.scan_rows(index, scans):
+        if row is None:
+            yield None
+        else:
+            yield ms2.parse_scan(read(int(offsets[row]), int(lengths[row])))
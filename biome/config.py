@@ -27,6 +27,26 @@ class BaseConfig(object):
 
     SQLALCHEMY_DATABASE_URI = 'postgresql+psycopg2://'
 
+    # number of worker processes used to parse several DTASelect files at once (see parsers.dtaselect_files)
+    DTASELECT_POOL_SIZE = os.cpu_count() or 1
+
+    # number of uploaded files saved (hashed/written) at the same time (see views_documents.save_new_files)
+    UPLOAD_WORKERS = 4
+
+    # chunked uploads (see biome.uploads): default and largest chunk size (bytes)
+    UPLOAD_CHUNK_SIZE = 8*1024*1024
+    UPLOAD_MAX_CHUNK_SIZE = 64*1024*1024
+    # upload sessions without new chunks for this many days are removed (see uploads.expire_sessions)
+    UPLOAD_EXPIRY_DAYS = 7
+
+    # background ingest jobs (see biome.ingest): worker threads per process, and the number of
+    # queued jobs (all processes) at which new uploads are turned away until workers catch up
+    INGEST_WORKERS = 2
+    INGEST_MAX_QUEUED = 200
+
+    # file types stored block-compressed in UPLOAD_FOLDER (see datastore.put_stream and biome/bgzf.py)
+    COMPRESSED_FILE_TYPES = ('ms1', 'ms2', 'sqt')
+
 class ProdConfig(BaseConfig):
 
     ''' Production configuration class (TSRI)
@@ -75,6 +95,9 @@ class TestConfig(BaseConfig):
     DEBUG = False
     TESTING = True
 
+    # run ingest jobs right away, in the request (so tests can check their results)
+    INGEST_WORKERS = 0
+
     # might change this to SQLite in the future... (doesn't have JSON support)
     SQLALCHEMY_DATABASE_URI = 'postgresql+psycopg2://sandip@localhost:5432/biometesting'
     # SQLALCHEMY_DATABASE_URI = 'sqlite:///:memory:'
@@ -0,0 +1,401 @@
+#!/usr/bin/env python3
+
+# content-addressed data store for uploaded files (in app.config['UPLOAD_FOLDER'])
+#
+# Files are stored once per content, as <UPLOAD_FOLDER>/ab/cd/<sha224><ext>
+# (two levels of directories from the first hex digits of the hash, so no directory
+# gets too large). A Blob row per stored file counts the file records
+# (MS1File/MS2File/SQTFile/DTAFile) that use it and aren't deleted.
+# compact() removes files (and their sidecar files) that are no longer used.
+# Records saved before the store existed are moved into it by backfill_blobs().
+#
+# MS1/MS2/SQT files (app.config['COMPRESSED_FILE_TYPES']) are stored block-compressed,
+# as <sha224><ext>.gz with a block index (see biome/bgzf.py). Hashes are of the
+# uncompressed contents, and all readers open files with bgzf.open.
+import os
+import re
+import glob
+from hashlib import sha224
+from tempfile import mkstemp
+from collections import Counter
+from sqlalchemy.exc import IntegrityError
+from biome import ( app,
+                    bgzf,
+                    db,
+                    models,
+                    sidecar,
+                    )
+
+BLOCK_SIZE = 4*1024*1024
+SHARD_LEVELS = 2
+SHARD_WIDTH = 2
+COMPRESSED_SUFFIX = '.gz'
+
+HASH_PATTERN = re.compile('^[0-9a-f]{56}$')
+
+def file_models():
+    # all models that reference a Blob
+    return (models.MS1File, models.MS2File, models.SQTFile, models.DTAFile)
+
+def blob_path(hash_val, extension):
+
+    ''' Returns the path of a stored file, e.g. <UPLOAD_FOLDER>/ab/cd/abcd...<ext>
+    '''
+
+    shards = [hash_val[i*SHARD_WIDTH:(i+1)*SHARD_WIDTH] for i in range(SHARD_LEVELS)]
+
+    return os.path.join(app.config['UPLOAD_FOLDER'], *shards, hash_val+extension)
+
+def hash_from_path(file_path):
+
+    ''' '/path/to/<sha224>.ms2' -> '<sha224>' (also works for unsharded files)
+    '''
+
+    return os.path.basename(file_path).split('.', 1)[0]
+
+def is_compressed_type(extension):
+
+    ''' True if files with extension (e.g. '.ms2') are stored compressed (app.config['COMPRESSED_FILE_TYPES'])
+    '''
+
+    return extension.lstrip('.').lower() in app.config['COMPRESSED_FILE_TYPES']
+
+def stored_path(hash_val, extension):
+
+    ''' Returns the path of the stored file with this hash and extension (compressed or not),
+        or None if it isn't stored
+    '''
+
+    for file_path in (blob_path(hash_val, extension), blob_path(hash_val, extension+COMPRESSED_SUFFIX)):
+        if os.path.exists(file_path):
+            return file_path
+
+    return None
+
+def store_file(tmp_file_path, hash_val, extension, block_index=None):
+
+    ''' Moves a file that's already hashed (hash_val: SHA224 of its uncompressed contents)
+        into the store, e.g. a temporary file in UPLOAD_FOLDER written by put_stream or
+        by a chunked upload (see biome.uploads). Renamed, not copied.
+
+        block_index is the block index of a block-compressed file (see bgzf.BlockWriter),
+        which is stored as <sha224><extension>.gz. If the same contents are already
+        stored (compressed or not), tmp_file_path is removed instead.
+
+        Returns (file_path, True if the file is new)
+    '''
+
+    file_path = stored_path(hash_val, extension)
+    if file_path is not None:
+        os.remove(tmp_file_path)
+        return file_path, False
+
+    compressed = block_index is not None
+    file_path = blob_path(hash_val, extension+COMPRESSED_SUFFIX if compressed else extension)
+    os.makedirs(os.path.dirname(file_path), exist_ok=True)
+    if compressed:
+        bgzf.write_index(file_path, block_index)
+    os.replace(tmp_file_path, file_path)
+
+    return file_path, True
+
+def put_stream(stream, extension, block_size=BLOCK_SIZE, compress=False):
+
+    ''' Stores the contents of a binary stream (read once, in blocks of block_size bytes)
+
+        Each block is hashed and written to a temporary file in UPLOAD_FOLDER (same
+        filesystem as the store, so it's renamed into place instead of copied).
+        If the same contents are already stored (compressed or not), the temporary
+        file is discarded and the stored file is left untouched.
+
+        With compress, the file is written block-compressed (see bgzf.BlockWriter) and
+        stored as <sha224><extension>.gz, with its block index. The hash and size are
+        of the uncompressed contents either way.
+
+        Returns (file_path, sha224 hex digest, size in bytes, True if the file is new)
+    '''
+
+    tmp_fd, tmp_file_path = mkstemp(dir=app.config['UPLOAD_FOLDER'], suffix='.part')
+    hasher = sha224()
+    size = 0
+    try:
+        with os.fdopen(tmp_fd, 'wb') as f:
+            writer = bgzf.BlockWriter(f) if compress else f
+            while True:
+                block = stream.read(block_size)
+                if not block:
+                    break
+                hasher.update(block)
+                writer.write(block)
+                size += len(block)
+            if compress:
+                writer.close()
+
+        hash_val = hasher.hexdigest()
+        file_path, is_new = store_file(tmp_file_path, hash_val, extension, writer.index if compress else None)
+    except:
+        if os.path.exists(tmp_file_path):
+            os.remove(tmp_file_path)
+        raise
+
+    return file_path, hash_val, size, is_new
+
+def _change_refcount(blob_id, change):
+    # single UPDATE statement, so concurrent requests (uWSGI processes) don't lose counts
+    models.Blob.query.filter_by(id=blob_id).update({models.Blob.refcount: models.Blob.refcount + change}, synchronize_session=False)
+
+def get_or_create_blob(file_path):
+
+    ''' Returns the Blob row for a stored file (creates it if it doesn't exist yet)
+
+        Files that weren't saved by put_stream (not named by their hash) are hashed
+    '''
+
+    hash_val = hash_from_path(file_path)
+    if not HASH_PATTERN.match(hash_val):
+        hash_val = sidecar.content_hash(file_path)
+
+    blob = models.Blob.query.filter_by(sha224=hash_val).first()
+    if blob is None:
+        try:
+            with db.session.begin_nested():
+                blob = models.Blob(hash_val, file_path, os.path.getsize(file_path))
+                db.session.add(blob)
+        except IntegrityError:
+            # created by another request in the meantime
+            blob = models.Blob.query.filter_by(sha224=hash_val).first()
+
+    return blob
+
+def add_reference(file_record):
+
+    ''' Links a new file record (MS1File/MS2File/SQTFile/DTAFile) to the Blob for
+        its file_path, and counts the reference. Committed with the record
+    '''
+
+    blob = get_or_create_blob(file_record.file_path)
+    file_record.blob_id = blob.id
+    if not file_record.deleted:
+        _change_refcount(blob.id, 1)
+
+def set_deleted(file_record, deleted):
+
+    ''' Sets file_record.deleted ("deletes" or "recovers" a file record),
+        and updates the refcount of its Blob. Committed with the record
+    '''
+
+    if bool(file_record.deleted) != bool(deleted) and file_record.blob_id is not None:
+        _change_refcount(file_record.blob_id, -1 if deleted else 1)
+
+    file_record.deleted = deleted
+
+def open_blob(hash_val):
+
+    ''' Opens a stored file (binary, read-only, uncompressed contents) by its SHA224 hex digest
+    '''
+
+    blob = models.Blob.query.filter_by(sha224=hash_val).first()
+    if blob is None:
+        raise FileNotFoundError('No stored file with SHA224 {}'.format(hash_val))
+
+    return bgzf.open(blob.file_path, 'rb')
+
+def iter_blob(file_path, start=0, stop=None, block_size=BLOCK_SIZE):
+
+    ''' Reads bytes start:stop of a stored file (of its uncompressed contents), one block
+        at a time (generator function)
+
+        Used to stream (part of) a stored file into a response without holding it in memory
+    '''
+
+    with bgzf.open(file_path, 'rb') as f:
+        f.seek(start)
+        remaining = None if stop is None else max(stop-start, 0)
+        while remaining is None or remaining > 0:
+            block = f.read(block_size if remaining is None else min(block_size, remaining))
+            if not block:
+                break
+            if remaining is not None:
+                remaining -= len(block)
+            yield block
+
+def _sidecar_paths(file_path):
+    # sidecar files of a stored file (e.g. '.ms2idx', or '.gzi' of a compressed file)
+    return glob.glob(glob.escape(file_path)+'.*')
+
+def _legacy_store_path(file_path):
+    # where a file saved before the data store existed (<UPLOAD_FOLDER>/<sha224><ext>) belongs:
+    # its stored copy with the same contents if there is one, otherwise its sharded path
+    file_name = os.path.basename(file_path)
+    hash_val = hash_from_path(file_path)
+    if HASH_PATTERN.match(hash_val):
+        extension = file_name[len(hash_val):]
+    else:
+        hash_val, extension = sidecar.content_hash(file_path), os.path.splitext(file_name)[1]
+
+    for candidate in (blob_path(hash_val, extension), blob_path(hash_val, extension+COMPRESSED_SUFFIX)):
+        if os.path.exists(candidate):
+            return candidate
+    return blob_path(hash_val, extension)
+
+def backfill_blobs():
+
+    ''' Registers file records saved before the data store existed (blob_id is NULL)
+
+        Their files in UPLOAD_FOLDER (flat <UPLOAD_FOLDER>/<sha224><ext> paths) are moved to
+        their sharded path with their sidecar files, or removed if the same contents are already
+        stored; records are pointed to the stored file and linked to its Blob. Files outside
+        UPLOAD_FOLDER are registered where they are. Records whose file is missing are skipped.
+        Refcounts are recomputed afterwards (see recount), so compact() and compress_blobs()
+        cover all records.
+
+        Run from manage.py (python manage.py backfill_store), not while files are being uploaded.
+        compact() and compress_blobs() run it first.
+
+        Returns a list of (old file path, new file path)
+    '''
+
+    upload_folder = os.path.realpath(app.config['UPLOAD_FOLDER'])+os.sep
+
+    legacy_paths = set()
+    for model in file_models():
+        query = db.session.query(model.file_path).filter(model.blob_id.is_(None), model.file_path.isnot(None))
+        legacy_paths.update(file_path for file_path, in query.distinct().all())
+
+    moved = []
+    for old_path in sorted(legacy_paths):
+        if not os.path.exists(old_path):
+            app.logger.error('Can\'t register missing file {} in the data store'.format(old_path))
+            continue
+
+        new_path = old_path
+        if os.path.dirname(os.path.realpath(old_path))+os.sep == upload_folder:
+            new_path = _legacy_store_path(old_path)
+            os.makedirs(os.path.dirname(new_path), exist_ok=True)
+            old_sidecars = _sidecar_paths(old_path)
+            if os.path.exists(new_path):
+                # (same contents already stored)
+                for path in [old_path] + old_sidecars:
+                    os.remove(path)
+            else:
+                for path in old_sidecars:
+                    os.replace(path, new_path+path[len(old_path):])
+                os.replace(old_path, new_path)
+
+        blob = get_or_create_blob(new_path)
+        for model in file_models():
+            model.query.filter(model.file_path == old_path, model.blob_id.is_(None)).update({model.file_path: new_path, model.blob_id: blob.id}, synchronize_session=False)
+        db.session.commit()
+        moved.append((old_path, new_path))
+
+    recount()
+
+    if moved:
+        app.logger.info('Registered {} files saved before the data store existed'.format(len(moved)))
+
+    return moved
+
+def recount():
+
+    ''' Recomputes all Blob refcounts from the file tables (number of referencing rows
+        that aren't deleted). Fixes counts if rows were changed without set_deleted()
+    '''
+
+    counts = Counter()
+    for model in file_models():
+        query = db.session.query(model.blob_id, db.func.count(model.id))
+        query = query.filter(model.blob_id.isnot(None), model.deleted.isnot(True)).group_by(model.blob_id)
+        counts.update(dict(query.all()))
+
+    for blob in models.Blob.query.all():
+        blob.refcount = counts[blob.id]
+
+    db.session.commit()
+
+def compact():
+
+    ''' Reclaims stored files that are only referenced by deleted records
+
+        Removes the file and its sidecar files (e.g. '.dtacache') if it's in UPLOAD_FOLDER,
+        unlinks the deleted records from the Blob, and removes the Blob row. Deleted records that are
+        recovered after this don't have a file anymore.
+
+        Run from manage.py (python manage.py compact), not while files are being uploaded.
+
+        Returns a list of (sha224, bytes reclaimed)
+    '''
+
+    backfill_blobs()
+
+    upload_folder = os.path.realpath(app.config['UPLOAD_FOLDER'])+os.sep
+
+    reclaimed = []
+    for blob in models.Blob.query.filter(models.Blob.refcount <= 0).all():
+        size = 0
+        # only remove files in the data store (never e.g. files that were registered from other directories)
+        if os.path.realpath(blob.file_path).startswith(upload_folder):
+            for path in [blob.file_path] + _sidecar_paths(blob.file_path):
+                if os.path.exists(path):
+                    size += os.path.getsize(path)
+                    os.remove(path)
+
+        for model in file_models():
+            model.query.filter_by(blob_id=blob.id).update({model.blob_id: None}, synchronize_session=False)
+        db.session.delete(blob)
+        reclaimed.append((blob.sha224, size))
+
+    db.session.commit()
+
+    app.logger.info('Compacted data store: reclaimed {} files ({} bytes)'.format(len(reclaimed), sum(size for _, size in reclaimed)))
+
+    return reclaimed
+
+def compress_blobs():
+
+    ''' Compresses stored MS1/MS2/SQT files (app.config['COMPRESSED_FILE_TYPES']) that
+        were stored before they were stored compressed (see put_stream)
+
+        Each file is compressed to <file_path>.gz, the Blob and its file records are
+        pointed to the new file, then the old file and its sidecar files are removed
+        (sidecars are rebuilt from the compressed file when they're used).
+        Only files in UPLOAD_FOLDER are compressed.
+
+        Run from manage.py (python manage.py compress_store), not while files are being uploaded.
+
+        Returns a list of (sha224, bytes before, bytes after)
+    '''
+
+    backfill_blobs()
+
+    upload_folder = os.path.realpath(app.config['UPLOAD_FOLDER'])+os.sep
+
+    compressed = []
+    for blob in models.Blob.query.order_by(models.Blob.id).all():
+        extension = os.path.splitext(blob.file_path)[1]
+        if (not is_compressed_type(extension) or not os.path.realpath(blob.file_path).startswith(upload_folder)
+                or not os.path.exists(blob.file_path) or bgzf.file_format(blob.file_path) != 'plain'):
+            continue
+
+        old_path = blob.file_path
+        old_size = os.path.getsize(old_path)
+        new_path = old_path+COMPRESSED_SUFFIX
+        # (before the compressed file exists: it would match too)
+        old_sidecars = _sidecar_paths(old_path)
+        bgzf.compress_file(old_path, new_path)
+
+        blob.file_path = new_path
+        blob.size = os.path.getsize(new_path)
+        for model in file_models():
+            model.query.filter_by(blob_id=blob.id).update({model.file_path: new_path}, synchronize_session=False)
+        db.session.commit()
+
+        for path in [old_path] + old_sidecars:
+            if os.path.exists(path):
+                os.remove(path)
+        compressed.append((blob.sha224, old_size, blob.size))
+
+    app.logger.info('Compressed {} stored files ({} bytes -> {} bytes)'.format(len(compressed),
+                                                                             sum(before for _, before, _ in compressed),
+                                                                             sum(after for _, _, after in compressed)))
+
+    return compressed
@@ -0,0 +1,262 @@
+#!/usr/bin/env python3
+
+# bounded background executor for ingest work on uploaded files (scan counting, indexing,
+# sidecar files, storing chunked uploads)
+#
+# Functions decorated with @ingest.job don't run when they're called: a queued IngestJob
+# row (function name and arguments) is saved, and the ID of the job is returned. Each
+# process runs up to app.config['INGEST_WORKERS'] worker threads (started when the
+# process starts, see start) that take queued jobs from the table, oldest first, so
+# uploads never start more than INGEST_WORKERS jobs per process at once, and jobs
+# that can't run yet wait in the table instead of in memory. Jobs submitted by other
+# processes (or left queued when a process exits) are picked up too.
+# Job status and progress are served by /api/job/<job_id> and /api/jobs.
+import os
+import socket
+import threading
+import functools
+from datetime import datetime
+from biome import ( app,
+                    db,
+                    models,
+                    )
+
+# seconds a worker waits for new jobs before checking the table again
+# (for jobs submitted by other processes)
+POLL_INTERVAL = 5
+MESSAGE_LENGTH = 500
+
+# job name -> function
+_functions = {}
+# worker threads of this process (started again after a fork, see start)
+_workers = []
+_workers_pid = None
+_workers_lock = threading.Lock()
+_submitted = threading.Semaphore(0)
+# job that the current thread is running (for report_progress)
+_current = threading.local()
+
+def job(f):
+
+    ''' Decorator that makes calls to f() submit an ingest job (see submit)
+        instead of running f. Returns the job ID. f's arguments must be JSON-serializable.
+
+        The undecorated function is f.run (e.g. to run it in the current thread)
+    '''
+
+    _functions[f.__name__] = f
+
+    @functools.wraps(f)
+    def wrapper(*args):
+        return submit(f.__name__, *args)
+
+    wrapper.run = f
+
+    return wrapper
+
+def _worker_name():
+    return '{}:{}'.format(socket.gethostname(), os.getpid())
+
+def submit(name, *args):
+
+    ''' Saves a queued IngestJob for the job function name (see job) and wakes up a worker
+
+        With app.config['INGEST_WORKERS'] = 0, the job runs right away, in the calling thread
+        (e.g. for tests). Returns the job ID
+    '''
+
+    new_job = models.IngestJob(name, list(args))
+    db.session.add(new_job)
+    db.session.commit()
+
+    app.logger.info('Submitted ingest job {} ({}{})'.format(new_job.id, name, tuple(args)))
+
+    if app.config['INGEST_WORKERS'] <= 0:
+        if _claim(new_job.id):
+            _run(models.IngestJob.query.get(new_job.id))
+        return new_job.id
+
+    _submitted.release()
+
+    return new_job.id
+
+def pending_job(name, *args):
+
+    ''' ID of a queued or running job of the job function name with these arguments
+        (e.g. to not submit the same job twice), or None
+    '''
+
+    for ingest_job in models.IngestJob.query.filter(models.IngestJob.name == name, models.IngestJob.status.in_(['queued', 'running'])):
+        if ingest_job.args == list(args):
+            return ingest_job.id
+
+    return None
+
+def queued_jobs():
+
+    ''' Number of jobs waiting for a worker (in all processes)
+    '''
+
+    return models.IngestJob.query.filter_by(status='queued').count()
+
+def queue_full():
+
+    ''' True if there are app.config['INGEST_MAX_QUEUED'] or more queued jobs. New uploads
+        are turned away until workers catch up (backpressure, see views_documents.document_index)
+    '''
+
+    return queued_jobs() >= app.config['INGEST_MAX_QUEUED']
+
+def report_progress(fraction, message=None):
+
+    ''' Records the progress (0 to 1) of the job that the current thread is running
+        (does nothing if a job function runs outside a worker, e.g. with f.run())
+    '''
+
+    job_id = getattr(_current, 'job_id', None)
+    if job_id is None:
+        return
+
+    values = {models.IngestJob.progress: min(max(float(fraction), 0.0), 1.0)}
+    if message is not None:
+        values[models.IngestJob.message] = message[:MESSAGE_LENGTH]
+    models.IngestJob.query.filter_by(id=job_id).update(values, synchronize_session=False)
+    db.session.commit()
+
+def _claim(job_id):
+    # marks a queued job as running; False if another worker got it first
+    # (single conditional UPDATE, so each job runs once even with several processes)
+    claimed = models.IngestJob.query.filter_by(id=job_id, status='queued').update({   models.IngestJob.status: 'running',
+                                                                                        models.IngestJob.started_time: datetime.now(),
+                                                                                        models.IngestJob.worker: _worker_name(),
+                                                                                        }, synchronize_session=False)
+    db.session.commit()
+
+    return bool(claimed)
+
+def _next_job():
+    # claims the oldest queued job, or returns None if there are none
+    candidates = db.session.query(models.IngestJob.id).filter_by(status='queued').order_by(models.IngestJob.id).limit(app.config['INGEST_WORKERS']+1).all()
+    for job_id, in candidates:
+        if _claim(job_id):
+            return models.IngestJob.query.get(job_id)
+
+    return None
+
+def _run(ingest_job):
+    # runs a claimed job and records how it ended (errors are logged, not raised)
+    _current.job_id = ingest_job.id
+    try:
+        _functions[ingest_job.name](*ingest_job.args)
+    except Exception as exc:
+        db.session.rollback()
+        app.logger.exception('Ingest job {} ({}) failed'.format(ingest_job.id, ingest_job.name))
+        ingest_job.status = 'failed'
+        ingest_job.message = '{}: {}'.format(type(exc).__name__, exc)[:MESSAGE_LENGTH]
+    else:
+        ingest_job.status = 'done'
+        ingest_job.progress = 1.0
+    finally:
+        _current.job_id = None
+
+    ingest_job.finished_time = datetime.now()
+    db.session.commit()
+
+def _worker_loop():
+    while True:
+        with app.app_context():
+            try:
+                ingest_job = _next_job()
+                if ingest_job is not None:
+                    _run(ingest_job)
+            except:
+                app.logger.exception('Ingest worker error')
+                ingest_job = None
+            finally:
+                db.session.remove()
+
+        if ingest_job is None:
+            _submitted.acquire(timeout=POLL_INTERVAL)
+
+def start():
+
+    ''' Queues stale jobs again (see requeue_stale_jobs) and starts this process's worker
+        threads, so queued jobs are run even if nothing is submitted (e.g. after a restart,
+        while uploads are turned away because the queue is full)
+
+        Called when each process starts: after uWSGI forks it, or before its first request
+        otherwise (threads don't survive a fork, so not when the app is imported). Does
+        nothing if the workers of this process are running, or with INGEST_WORKERS = 0
+    '''
+
+    global _workers, _workers_pid
+
+    if app.config['INGEST_WORKERS'] <= 0:
+        return
+
+    with _workers_lock:
+        if _workers_pid == os.getpid():
+            return
+        with app.app_context():
+            try:
+                requeue_stale_jobs()
+            except:
+                app.logger.exception('Could not queue stale ingest jobs again')
+        _workers = [threading.Thread(target=_worker_loop, name='ingest-{}'.format(i), daemon=True) for i in range(app.config['INGEST_WORKERS'])]
+        for worker in _workers:
+            worker.start()
+        _workers_pid = os.getpid()
+
+def requeue_stale_jobs():
+
+    ''' Queues running jobs again whose worker process (on this host) doesn't exist anymore,
+        e.g. after a restart. Returns the number of jobs that were queued again
+    '''
+
+    hostname = socket.gethostname()
+    stale = []
+    for ingest_job in models.IngestJob.query.filter_by(status='running').all():
+        job_hostname, _, pid = (ingest_job.worker or '').rpartition(':')
+        if job_hostname != hostname or not pid.isdigit():
+            continue
+        try:
+            os.kill(int(pid), 0)
+        except ProcessLookupError:
+            stale.append(ingest_job)
+        except PermissionError:
+            pass # (process exists)
+
+    for ingest_job in stale:
+        ingest_job.status = 'queued'
+        ingest_job.worker = None
+    db.session.commit()
+
+    if stale:
+        app.logger.info('Queued {} stale ingest jobs again'.format(len(stale)))
+
+    return len(stale)
+
+def job_status(ingest_job):
+
+    ''' Dict describing an IngestJob (for the jobs API)
+    '''
+
+    return {'id': ingest_job.id,
+            'name': ingest_job.name,
+            'args': ingest_job.args,
+            'status': ingest_job.status,
+            'progress': ingest_job.progress,
+            'message': ingest_job.message,
+            'created_time': str(ingest_job.created_time),
+            'started_time': str(ingest_job.started_time) if ingest_job.started_time else None,
+            'finished_time': str(ingest_job.finished_time) if ingest_job.finished_time else None,
+            }
+
+app.before_first_request(start)
+try:
+    from uwsgidecorators import postfork
+except ImportError:
+    pass # (not running under uWSGI, e.g. manage.py runserver)
+else:
+    # (without waiting for a request)
+    postfork(start)
@@ -64,6 +64,159 @@ class DBSearch(db.Model):
     def __repr__(self):
         return '<Search ID: {} // Dataset: {}>'.format(self.id, self.dataset_id)
 
+class Blob(db.Model):
+
+    ''' Represents one stored file in the content-addressed data store (see biome.datastore).
+        Shared by all MS1File/MS2File/SQTFile/DTAFile rows with the same contents.
+
+        refcount is the number of referencing rows that aren't deleted. The blob
+        can be reclaimed (file removed from disk) when it reaches 0.
+    '''
+
+    __tablename__ = 'blob'
+
+    id = db.Column(db.Integer, primary_key=True)
+    sha224 = db.Column(db.String(56), unique=True, index=True)
+    file_path = db.Column(db.String(500))
+    size = db.Column(db.BigInteger)
+    refcount = db.Column(db.Integer)
+    created_time = db.Column(db.DateTime)
+    ms1files = db.relationship('MS1File', backref='blob', lazy='dynamic')
+    ms2files = db.relationship('MS2File', backref='blob', lazy='dynamic')
+    sqtfiles = db.relationship('SQTFile', backref='blob', lazy='dynamic')
+    dtafiles = db.relationship('DTAFile', backref='blob', lazy='dynamic')
+
+    def __init__(self, sha224, file_path, size):
+        self.sha224 = sha224
+        self.file_path = file_path
+        self.size = size
+        self.refcount = 0
+        self.created_time = datetime.now()
+
+    def __repr__(self):
+        return '<Blob ID: {} // SHA224: {} // References: {}>'.format(self.id, self.sha224, self.refcount)
+
+class IngestJob(db.Model):
+
+    ''' Represents one background ingest job (see biome.ingest): a job function
+        (name) and its arguments (args), run by a worker thread of one process (worker).
+
+        status: 'queued', 'running', 'done' or 'failed' (message has the error)
+        progress: fraction done (0 to 1), reported by the job function
+    '''
+
+    __tablename__ = 'ingest_job'
+
+    id = db.Column(db.Integer, primary_key=True)
+    name = db.Column(db.String(100))
+    args = db.Column(postgresql.JSON)
+    status = db.Column(db.String(25), index=True)
+    progress = db.Column(db.Float)
+    message = db.Column(db.String(500))
+    worker = db.Column(db.String(100)) # 'hostname:pid' of the process running the job
+    created_time = db.Column(db.DateTime)
+    started_time = db.Column(db.DateTime)
+    finished_time = db.Column(db.DateTime)
+
+    def __init__(self, name, args):
+        self.name = name
+        self.args = args
+        self.status = 'queued'
+        self.progress = 0.0
+        self.created_time = datetime.now()
+
+    def __repr__(self):
+        return '<IngestJob ID: {} // Name: {} // Status: {}>'.format(self.id, self.name, self.status)
+
+class UploadSession(db.Model):
+
+    ''' Represents a chunked upload of the files of one new Dataset (see biome.uploads).
+        The Dataset is only created once all files are uploaded and stored.
+
+        status: 'uploading', 'complete' (dataset_id is set), 'failed' or 'expired'
+        (no chunks received for app.config['UPLOAD_EXPIRY_DAYS'], see uploads.expire_sessions)
+    '''
+
+    __tablename__ = 'upload_session'
+
+    id = db.Column(db.Integer, primary_key=True)
+    dataset_name = db.Column(db.String(60))
+    dataset_description = db.Column(db.String(500))
+    status = db.Column(db.String(25))
+    dataset_id = db.Column(db.Integer, db.ForeignKey('dataset.id'))
+    created_time = db.Column(db.DateTime)
+    last_activity = db.Column(db.DateTime) # last chunk received (or finalized file)
+    files = db.relationship('UploadFile', backref='upload_session', lazy='dynamic')
+
+    def __init__(self, dataset_name, dataset_description):
+        self.dataset_name = dataset_name
+        self.dataset_description = dataset_description
+        self.status = 'uploading'
+        self.created_time = datetime.now()
+        self.last_activity = self.created_time
+
+    def __repr__(self):
+        return '<UploadSession ID: {} // Dataset name: {} // Status: {}>'.format(self.id, self.dataset_name, self.status)
+
+class UploadFile(db.Model):
+
+    ''' Represents one file of an UploadSession, uploaded in numbered chunks of chunk_size
+        bytes (the last one can be shorter) that are written into part_path.
+
+        status: 'uploading', 'storing' (all chunks received, being hashed/moved into
+        the data store), 'stored' (file_path is set), 'failed' or 'expired'
+
+        The first hashed_chunks chunks are already hashed (and compressed): hash_state is the
+        saved SHA224 state after them, compressed_size the size of their compressed blocks
+        (see uploads.hash_received_chunks)
+    '''
+
+    __tablename__ = 'upload_file'
+
+    id = db.Column(db.Integer, primary_key=True)
+    session_id = db.Column(db.Integer, db.ForeignKey('upload_session.id'))
+    original_filename = db.Column(db.String(150))
+    size = db.Column(db.BigInteger)
+    chunk_size = db.Column(db.Integer)
+    part_path = db.Column(db.String(500))
+    file_path = db.Column(db.String(500)) # stored file (once status is 'stored')
+    sha224 = db.Column(db.String(56))
+    status = db.Column(db.String(25))
+    hashed_chunks = db.Column(db.Integer)
+    hash_state = db.Column(db.LargeBinary)
+    compressed_size = db.Column(db.BigInteger)
+    chunks = db.relationship('UploadChunk', backref='upload_file', lazy='dynamic')
+
+    def __init__(self, session_id, original_filename, size, chunk_size):
+        self.session_id = session_id
+        self.original_filename = original_filename
+        self.size = size
+        self.chunk_size = chunk_size
+        self.status = 'uploading'
+        self.hashed_chunks = 0
+        self.compressed_size = 0
+
+    def __repr__(self):
+        return '<UploadFile ID: {} // File name: {} // Status: {}>'.format(self.id, self.original_filename, self.status)
+
+class UploadChunk(db.Model):
+
+    ''' Records one received chunk of an UploadFile (one row per chunk, so chunks
+        received by different processes at the same time are all recorded)
+    '''
+
+    __tablename__ = 'upload_chunk'
+
+    file_id = db.Column(db.Integer, db.ForeignKey('upload_file.id'), primary_key=True)
+    number = db.Column(db.Integer, primary_key=True, autoincrement=False)
+
+    def __init__(self, file_id, number):
+        self.file_id = file_id
+        self.number = number
+
+    def __repr__(self):
+        return '<UploadChunk File ID: {} // Chunk: {}>'.format(self.file_id, self.number)
+
 class MS1File(db.Model):
 
     ''' Represents one MS1 file.
@@ -74,7 +227,11 @@ class MS1File(db.Model):
 
     id = db.Column(db.Integer, primary_key=True)
     file_path = db.Column(db.String(500)) # one dataset may have multiple rows in table (one per MS1 file)
+    blob_id = db.Column(db.Integer, db.ForeignKey('blob.id')) # stored file (see Blob)
     deleted = db.Column(db.Boolean)
+    scans = db.Column(db.Integer)
+    # first/last scan, retention time range, instrument and H line headers (see parsers.ms1_summary)
+    summary = db.Column(postgresql.JSON)
     original_filename = db.Column(db.String(150))
     dataset_id = db.Column(db.Integer, db.ForeignKey('dataset.id'))
     created_time = db.Column(db.DateTime)
@@ -99,8 +256,12 @@ class MS2File(db.Model):
 
     id = db.Column(db.Integer, primary_key=True)
     file_path = db.Column(db.String(500)) # one dataset may have multiple rows in table (one per MS2 file)
+    blob_id = db.Column(db.Integer, db.ForeignKey('blob.id')) # stored file (see Blob)
     deleted = db.Column(db.Boolean)
     scans = db.Column(db.Integer)
+    # first/last scan, peak count, retention time and precursor m/z ranges, charge states,
+    # instrument and H line headers (see parsers.ms2_summary)
+    summary = db.Column(postgresql.JSON)
     original_filename = db.Column(db.String(150))
     dataset_id = db.Column(db.Integer, db.ForeignKey('dataset.id'))
     created_time = db.Column(db.DateTime)
@@ -127,10 +288,13 @@ class SQTFile(db.Model):
 
     id = db.Column(db.Integer, primary_key=True)
     file_path = db.Column(db.String(500)) # one dataset may have multiple rows in table (one per MS2 file)
+    blob_id = db.Column(db.Integer, db.ForeignKey('blob.id')) # stored file (see Blob)
     original_filename = db.Column(db.String(150))
     dbsearch_id = db.Column(db.Integer, db.ForeignKey('db_search.id'))
     created_time = db.Column(db.DateTime)
     scans = db.Column(db.Integer)
+    # first/last scan, charge states, search engine, database and H line headers (see parsers.sqt_summary)
+    summary = db.Column(postgresql.JSON)
     deleted = db.Column(db.Boolean)
 
     def __init__(self, file_path, dbsearch_id, original_filename=None):
@@ -153,6 +317,7 @@ class DTAFile(db.Model):
 
     id = db.Column(db.Integer, primary_key=True)
     file_path = db.Column(db.String(500)) # one dataset may have multiple rows in table (one per MS2 file)
+    blob_id = db.Column(db.Integer, db.ForeignKey('blob.id')) # stored file (see Blob)
     original_filename = db.Column(db.String(150))
     dbsearch_id = db.Column(db.Integer, db.ForeignKey('db_search.id'))
     created_time = db.Column(db.DateTime)
@@ -161,6 +326,9 @@ class DTAFile(db.Model):
     # DTASelect flags used for filtering, e.g. '-p 2 -m 0 --trypstat'
     flags = db.Column(db.String(100))
 
+    # summary table at the end of the file (protein/peptide/spectrum counts -- see parsers.dtaselect_summary)
+    summary = db.Column(postgresql.JSON)
+
     def __init__(self, file_path, dbsearch_id, original_filename=None):
         self.file_path = file_path
         self.dbsearch_id = dbsearch_id
@@ -0,0 +1,189 @@
+#!/usr/bin/env python3
+
+# vectorized reader for MS1 files (same batches of arrays as biome/ms2.py),
+# TIC/base peak chromatograms, and extracted ion chromatograms (XIC)
+#
+# The XIC index (all peaks, scans sorted by retention time and peaks by m/z) is written
+# batch by batch to a sidecar file by cache.build_ms1_sidecars
+import numpy as np
+from biome import ( bgzf,
+                    ms2,
+                    )
+
+BATCH_SIZE = 1000
+
+def scan_batch(blocks, mz_dtype=np.float64, intensity_dtype=np.float32):
+
+    ''' Parses MS1 scans (as yielded by ms2.scan_blocks) into one batch of arrays
+
+        Returns a dict:
+            'scans': {'scan': int32, 'retention_time': float64 (NaN if missing)}
+            'mz': mz_dtype, 'intensity': intensity_dtype (peaks of all scans, concatenated)
+            'peak_offsets': int64 (scan i has peaks peak_offsets[i]:peak_offsets[i+1])
+    '''
+
+    scans, retention_times = [], []
+    peak_regions, peak_counts = [], []
+
+    for block in blocks:
+        lines, peaks = ms2.split_scan(block)
+        scans.append(int(lines[0].split(b'\t')[1]))
+        retention_time = np.nan
+        for line in lines[1:]:
+            if line.startswith(b'I\tRetTime\t'):
+                retention_time = float(line[10:])
+                break
+        retention_times.append(retention_time)
+
+        peak_regions.append(peaks)
+        peak_counts.append(peaks.count(b'\n')+1 if peaks else 0)
+
+    peak_array = ms2.parse_peaks(b'\n'.join(region for region in peak_regions if region), sum(peak_counts))
+
+    return {'scans': {  'scan': np.array(scans, dtype=np.int32),
+                        'retention_time': np.array(retention_times, dtype=np.float64),
+                        },
+            'mz': peak_array[:, 0].astype(mz_dtype),
+            'intensity': peak_array[:, 1].astype(intensity_dtype),
+            'peak_offsets': np.cumsum([0]+peak_counts, dtype=np.int64),
+            }
+
+def read_batches(in_file, batch_size=BATCH_SIZE, mz_dtype=np.float64, intensity_dtype=np.float32):
+
+    ''' Streams an MS1 file (plain or compressed, see bgzf.open) as batches of up to
+        batch_size scans (see scan_batch) (generator function)
+    '''
+
+    with bgzf.open(in_file, 'rb') as f:
+        blocks = []
+        for _, block in ms2.scan_blocks(f):
+            blocks.append(block)
+            if len(blocks) == batch_size:
+                yield scan_batch(blocks, mz_dtype, intensity_dtype)
+                blocks = []
+        if blocks:
+            yield scan_batch(blocks, mz_dtype, intensity_dtype)
+
+def batch_chromatograms(batch):
+
+    ''' Total ion current and base peak (most intense peak) of each scan in a batch
+
+        Returns a dict of arrays (one value per scan): 'scan', 'retention_time', 'tic',
+        'base_peak_mz', 'base_peak_intensity' (0 for scans without peaks)
+    '''
+
+    offsets = batch['peak_offsets']
+    intensity = batch['intensity']
+    counts = np.diff(offsets)
+    has_peaks = counts > 0
+
+    # reduceat over the starts of scans with peaks (scans without peaks are empty segments in between)
+    tic = np.zeros(len(counts))
+    base_peak_intensity = np.zeros(len(counts), dtype=intensity.dtype)
+    base_peak_mz = np.zeros(len(counts))
+    if has_peaks.any():
+        starts = offsets[:-1][has_peaks]
+        tic[has_peaks] = np.add.reduceat(intensity, starts, dtype=np.float64)
+        base_peak_intensity[has_peaks] = np.maximum.reduceat(intensity, starts)
+
+        # first peak of each scan with the scan's maximum intensity
+        peak_scans = np.repeat(np.arange(len(counts)), counts)
+        is_base_peak = intensity == base_peak_intensity[peak_scans]
+        scans_with_base_peak, first = np.unique(peak_scans[is_base_peak], return_index=True)
+        base_peak_mz[scans_with_base_peak] = batch['mz'][np.flatnonzero(is_base_peak)[first]]
+
+    return {'scan': batch['scans']['scan'],
+            'retention_time': batch['scans']['retention_time'],
+            'tic': tic,
+            'base_peak_mz': base_peak_mz,
+            'base_peak_intensity': base_peak_intensity.astype(np.float64),
+            }
+
+def chromatograms(in_file, batch_size=BATCH_SIZE):
+
+    ''' TIC and base peak chromatograms of an MS1 file (see batch_chromatograms),
+        computed batch by batch, so only one batch of peaks is in memory at a time
+    '''
+
+    parts = [batch_chromatograms(batch) for batch in read_batches(in_file, batch_size=batch_size)]
+    if not parts:
+        parts = [batch_chromatograms(scan_batch([]))]
+
+    return {name: np.concatenate([part[name] for part in parts]) for name in parts[0]}
+
+def segment_positions(offsets, order):
+
+    ''' Peak positions of scans (segments offsets[i]:offsets[i+1]) taken in the given order
+        (order can also be a subset of the scans)
+
+        Returns (positions, new peak offsets)
+    '''
+
+    starts = offsets[:-1][order]
+    counts = offsets[1:][order] - starts
+    new_offsets = np.cumsum(np.append(0, counts))
+
+    return np.repeat(starts - new_offsets[:-1], counts) + np.arange(new_offsets[-1]), new_offsets
+
+def sort_scan_peaks(batch):
+
+    ''' Sorts the peaks of each scan of a batch (see scan_batch) by m/z, unless they
+        already are (MS1 files usually are), so XICs can binary search them (see xic)
+    '''
+
+    offsets = batch['peak_offsets']
+    peak_scans = np.repeat(np.arange(len(offsets)-1), np.diff(offsets))
+    unsorted = (np.diff(batch['mz']) < 0) & (peak_scans[1:] == peak_scans[:-1])
+    if unsorted.any():
+        peak_order = np.lexsort((batch['mz'], peak_scans))
+        batch = dict(batch, mz=batch['mz'][peak_order], intensity=batch['intensity'][peak_order])
+
+    return batch
+
+def _segment_searchsorted(values, starts, stops, targets):
+    # np.searchsorted(values[starts[i]:stops[i]], targets[i]) + starts[i] for all segments at once
+    # (bisection on all segments together: one vectorized step per halving of the longest segment)
+    lo, hi = starts.copy(), stops.copy()
+    while (lo < hi).any():
+        searching = lo < hi
+        mid = (lo + hi) // 2
+        below = searching & (values[np.minimum(mid, len(values)-1)] < targets)
+        lo = np.where(below, mid+1, lo)
+        hi = np.where(searching & ~below, mid, hi)
+
+    return lo
+
+def xic(index, mz, ppm=10, rt_start=None, rt_end=None):
+
+    ''' Extracted ion chromatogram: summed intensity of the peaks within mz +/- ppm
+        in each scan with rt_start <= retention time <= rt_end
+
+        index: scans sorted by retention time, each scan's peaks sorted by m/z
+        (see cache.build_ms1_sidecars). Only the scans in the retention time range are
+        searched, with binary searches (retention time, then m/z within each scan)
+
+        Returns a dict of arrays (one value per scan in range): 'scan', 'retention_time', 'intensity'
+    '''
+
+    scans = index['scans']
+    retention_times = scans['retention_time']
+    first = np.searchsorted(retention_times, rt_start, 'left') if rt_start is not None else 0
+    last = np.searchsorted(retention_times, rt_end, 'right') if rt_end is not None else len(retention_times)
+    last = max(first, last)
+
+    tolerance = mz * ppm / 1e6
+    starts = np.asarray(index['peak_offsets'][first:last])
+    stops = np.asarray(index['peak_offsets'][first+1:last+1])
+    left = _segment_searchsorted(index['mz'], starts, stops, np.full(len(starts), mz - tolerance))
+    right = _segment_searchsorted(index['mz'], left, stops, np.full(len(starts), np.nextafter(mz + tolerance, np.inf)))
+
+    # sum the (few) peaks in each scan's window
+    counts = right - left
+    window_starts = np.cumsum(counts) - counts
+    peaks = np.repeat(left - window_starts, counts) + np.arange(counts.sum())
+    intensity = np.bincount(np.repeat(np.arange(len(counts)), counts), weights=index['intensity'][peaks], minlength=len(counts))
+
+    return {'scan': np.asarray(scans['scan'][first:last]),
+            'retention_time': np.asarray(retention_times[first:last]),
+            'intensity': intensity,
+            }
@@ -0,0 +1,422 @@
+#!/usr/bin/env python3
+
+# vectorized reader for MS2 files: batches of scans with their peaks as NumPy arrays,
+# the scan index for random access to single scans (scan_index, parse_scan), and a
+# splitter that writes chunks of scans as byte ranges of the file (see split_file)
+#
+# Only depends on NumPy and bgzf.py (doesn't import the Flask app), so Celery worker code can
+# use it too, e.g. with this file next to biome_worker.py (like make_filtered_fasta_helpers.py)
+import os
+import re
+import errno
+import numpy as np
+
+try:
+    from biome import bgzf
+except ImportError:
+    # (next to biome_worker.py, without the biome package)
+    import bgzf
+
+READ_SIZE = 8*1024*1024
+BATCH_SIZE = 1000
+# name suffix of the scan index sidecar of an MS2 file (see scan_index and cache.ms2_scan_index)
+INDEX_SUFFIX = '.ms2idx'
+# largest byte range copied by one system call (see copy_range)
+COPY_SIZE = 1024*1024*1024
+
+# first peak line of a scan (header lines start with a letter, peak lines with a digit)
+PEAKS_START = re.compile(b'^[0-9]', re.M)
+
+def scan_blocks(f, read_size=READ_SIZE):
+
+    ''' Splits an MS2 (or MS1) file (binary file object) into scans in one buffered pass (generator function)
+
+        Yields (offset, bytes) of each scan: its S line through its last peak line (with its line end),
+        and its byte offset in the file. H lines before the first scan are skipped.
+        The scan boundaries of the index (scan_index), the readers (read_batches) and the
+        splitter (scan_offsets, split_file) all come from here
+    '''
+
+    buffer = b''
+    buffer_offset = 0 # (file offset of buffer[0])
+    start = None # (start of the current scan in buffer)
+
+    while True:
+        data = f.read(read_size)
+        # (the last 2 bytes of the previous read could be the start of '\nS\t')
+        search_from = max(len(buffer)-2, 0)
+        buffer += data
+
+        if start is None:
+            if not buffer_offset and buffer.startswith(b'S\t'):
+                start = 0
+            else:
+                i = buffer.find(b'\nS\t', search_from)
+                if i == -1:
+                    if not data:
+                        return
+                    buffer_offset += max(len(buffer)-2, 0)
+                    buffer = buffer[-2:]
+                    continue
+                start = i+1
+            search_from = start
+
+        i = buffer.find(b'\nS\t', search_from)
+        while i != -1:
+            yield buffer_offset+start, buffer[start:i+1]
+            start = i+1
+            i = buffer.find(b'\nS\t', start)
+
+        if not data:
+            # (last scan)
+            if start < len(buffer):
+                yield buffer_offset+start, buffer[start:]
+            return
+
+        buffer_offset += start
+        buffer = buffer[start:]
+        start = 0
+
+def parse_peaks(peaks, peak_count):
+    # peak lines ('m/z intensity [charge]') -> (peak_count, 2) array, converted in one call
+    if not peak_count:
+        return np.empty((0, 2))
+
+    columns = len(peaks.split(b'\n', 1)[0].split())
+    values = np.fromstring(peaks, sep=' ')
+    if len(values) == peak_count*columns:
+        return values.reshape(peak_count, columns)[:, :2]
+
+    # different numbers of columns (or blank lines): parse line by line
+    return np.array([line.split()[:2] for line in peaks.splitlines() if line.strip()], dtype=np.float64)
+
+def split_scan(block):
+
+    ''' Splits a scan (as yielded by scan_blocks) into its header lines (the S line,
+        then I/Z/... lines) and its peak lines (bytes, without trailing whitespace)
+    '''
+
+    # (peak lines start after the S line)
+    second_line = block.find(b'\n')+1
+    match = PEAKS_START.search(block, second_line) if second_line else None
+    if not match:
+        return block.rstrip().split(b'\n'), b''
+
+    return block[:match.start()].rstrip().split(b'\n'), block[match.start():].rstrip()
+
+def scan_batch(blocks, mz_dtype=np.float64, intensity_dtype=np.float32):
+
+    ''' Parses MS2 scans (as yielded by scan_blocks) into one batch of arrays
+
+        Returns a dict:
+            'scans': {'scan': int32, 'precursor_mz': float64, 'retention_time': float64 (NaN if missing),
+                      'charge': int8 (first Z line, 0 if missing)}
+            'mz': mz_dtype, 'intensity': intensity_dtype (peaks of all scans, concatenated)
+            'peak_offsets': int64 (scan i has peaks peak_offsets[i]:peak_offsets[i+1])
+    '''
+
+    scans, precursor_mzs, retention_times, charges = [], [], [], []
+    peak_regions, peak_counts = [], []
+
+    for block in blocks:
+        lines, peaks = split_scan(block)
+        fields = lines[0].split(b'\t')
+        scans.append(int(fields[1]))
+        precursor_mzs.append(float(fields[3]))
+        retention_time, charge = np.nan, 0
+        for line in lines[1:]:
+            if line.startswith(b'I\tRetTime\t'):
+                retention_time = float(line[10:])
+            elif line.startswith(b'Z\t') and not charge:
+                charge = int(line.split(b'\t')[1])
+        retention_times.append(retention_time)
+        charges.append(charge)
+
+        peak_regions.append(peaks)
+        peak_counts.append(peaks.count(b'\n')+1 if peaks else 0)
+
+    peak_array = parse_peaks(b'\n'.join(region for region in peak_regions if region), sum(peak_counts))
+
+    return {'scans': {  'scan': np.array(scans, dtype=np.int32),
+                        'precursor_mz': np.array(precursor_mzs, dtype=np.float64),
+                        'retention_time': np.array(retention_times, dtype=np.float64),
+                        'charge': np.array(charges, dtype=np.int8),
+                        },
+            'mz': peak_array[:, 0].astype(mz_dtype),
+            'intensity': peak_array[:, 1].astype(intensity_dtype),
+            'peak_offsets': np.cumsum([0]+peak_counts, dtype=np.int64),
+            }
+
+def read_batches(in_file, batch_size=BATCH_SIZE, mz_dtype=np.float64, intensity_dtype=np.float32):
+
+    ''' Streams an MS2 file as batches of up to batch_size scans (see scan_batch) (generator function)
+
+        Only one batch (plus one read buffer) is held in memory at a time.
+        in_file can be plain or compressed (see bgzf.open)
+    '''
+
+    with bgzf.open(in_file, 'rb') as f:
+        blocks = []
+        for _, block in scan_blocks(f):
+            blocks.append(block)
+            if len(blocks) == batch_size:
+                yield scan_batch(blocks, mz_dtype, intensity_dtype)
+                blocks = []
+        if blocks:
+            yield scan_batch(blocks, mz_dtype, intensity_dtype)
+
+def concatenate_batches(batches):
+
+    ''' Concatenates batches (e.g. from read_batches) into one batch (peak offsets are shifted)
+    '''
+
+    batches = list(batches)
+    if not batches:
+        return scan_batch([])
+
+    peak_offsets = [batches[0]['peak_offsets'][:1]]
+    for batch in batches:
+        peak_offsets.append(batch['peak_offsets'][1:] + peak_offsets[-1][-1])
+
+    return {'scans': {column: np.concatenate([batch['scans'][column] for batch in batches]) for column in batches[0]['scans']},
+            'mz': np.concatenate([batch['mz'] for batch in batches]),
+            'intensity': np.concatenate([batch['intensity'] for batch in batches]),
+            'peak_offsets': np.concatenate(peak_offsets),
+            }
+
+def read_file(in_file, **kwargs):
+
+    ''' Reads a whole MS2 file into one batch (see read_batches for keyword arguments)
+    '''
+
+    return concatenate_batches(read_batches(in_file, **kwargs))
+
+def scan_offsets(f, read_size=READ_SIZE):
+
+    ''' Finds the scans of an MS2 file (binary file object) in one pass (see scan_blocks)
+
+        Returns an int64 array with the byte offset of each scan (its S line), plus the size of
+        the file: scan i is bytes offsets[i]:offsets[i+1], and bytes before offsets[0] are the H lines
+    '''
+
+    offsets = []
+    end = None
+
+    for offset, block in scan_blocks(f, read_size):
+        offsets.append(offset)
+        end = offset+len(block)
+
+    # (a file without scans is all H lines)
+    offsets.append(f.tell() if end is None else end)
+
+    return np.array(offsets, dtype=np.int64)
+
+def scan_index(in_file):
+
+    ''' Indexes the scans of an MS2 file (one streaming pass, peaks are counted but not parsed)
+
+        in_file can be plain or compressed (see bgzf.open). Scan i is bytes
+        scans['offset'][i]:scans['offset'][i]+scans['length'][i] of the (uncompressed) file
+        (its S line through its last peak line). A scan can have several Z lines, so charge
+        states are a separate table: scan i has charges[charge_offsets[i]:charge_offsets[i+1]].
+        Missing values (e.g. no RetTime I line) are NaN.
+
+        Returns a dict:
+            'scans': {'scan': int32, 'precursor_mz': float64, 'retention_time': float64,
+                      'peak_count': int32, 'offset': int64, 'length': int64}
+            'charges': {'charge': int8, 'mh': float64}
+            'charge_offsets': int64
+            'scan_lookup': {'scan': int32 (sorted), 'row': int64 (row in 'scans')}
+    '''
+
+    scans, precursor_mzs, retention_times, peak_counts, offsets, lengths = [], [], [], [], [], []
+    charges, mhs, charge_offsets = [], [], [0]
+
+    with bgzf.open(in_file, 'rb') as f:
+        for offset, block in scan_blocks(f):
+            lines, peaks = split_scan(block)
+            fields = lines[0].split(b'\t')
+            try:
+                scans.append(int(fields[1]))
+                precursor_mzs.append(float(fields[3]))
+            except (IndexError, ValueError):
+                raise ValueError('Malformed S line at byte {} of {}: {!r}'.format(offset, in_file, lines[0]))
+            retention_time = np.nan
+            for line in lines[1:]:
+                if line.startswith(b'I\tRetTime\t'):
+                    retention_time = float(line.split(b'\t')[2])
+                elif line.startswith(b'Z\t'):
+                    fields = line.split(b'\t')
+                    try:
+                        charges.append(int(fields[1]))
+                        mhs.append(float(fields[2]))
+                    except (IndexError, ValueError):
+                        raise ValueError('Malformed Z line in scan {} of {}: {!r}'.format(scans[-1], in_file, line))
+            retention_times.append(retention_time)
+            peak_counts.append(peaks.count(b'\n')+1 if peaks else 0)
+            offsets.append(offset)
+            lengths.append(len(block))
+            charge_offsets.append(len(charges))
+
+    # scan numbers in sorted order, for binary search (rows are in file order)
+    scan_order = np.argsort(np.array(scans, dtype=np.int32), kind='mergesort')
+
+    return {'scans': {  'scan': np.array(scans, dtype=np.int32),
+                        'precursor_mz': np.array(precursor_mzs, dtype=np.float64),
+                        'retention_time': np.array(retention_times, dtype=np.float64),
+                        'peak_count': np.array(peak_counts, dtype=np.int32),
+                        'offset': np.array(offsets, dtype=np.int64),
+                        'length': np.array(lengths, dtype=np.int64),
+                        },
+            'charges': {'charge': np.array(charges, dtype=np.int8),
+                        'mh': np.array(mhs, dtype=np.float64),
+                        },
+            'charge_offsets': np.array(charge_offsets, dtype=np.int64),
+            'scan_lookup': {'scan': np.array(scans, dtype=np.int32)[scan_order],
+                            'row': scan_order.astype(np.int64),
+                            },
+            }
+
+def index_offsets(scans):
+
+    ''' Scan offsets (as scan_offsets) from the 'scans' table of a scan index (see scan_index),
+        e.g. for split_file: scans['offset'] plus the end of the last scan.
+        None for a file without scans (the size of its H lines isn't in the index)
+    '''
+
+    if not len(scans['offset']):
+        return None
+
+    return np.append(scans['offset'], scans['offset'][-1]+scans['length'][-1]).astype(np.int64)
+
+def scan_rows(index, scans):
+
+    ''' Finds scans in a scan index (see scan_index) by scan number (binary search,
+        doesn't depend on the number of scans)
+
+        Returns a list with the row of each scan in index['scans'] (None for scans that aren't in the file)
+    '''
+
+    lookup = index['scan_lookup']
+    scans = np.asarray(scans, dtype=np.int64)
+    positions = np.minimum(np.searchsorted(lookup['scan'], scans), max(len(lookup['scan'])-1, 0))
+
+    return [int(lookup['row'][position]) if len(lookup['scan']) and lookup['scan'][position] == scan else None
+            for position, scan in zip(positions, scans)]
+
+def parse_scan(scan_bytes):
+
+    ''' Parses one scan of an MS2 file (its S line through its last peak line), e.g. bytes
+        read at the offset of the scan in its scan index (see scan_index)
+
+        Returns a dict like:
+            {'scan': 13, 'precursor_mz': 1261.62732, 'retention_time': 0.08,
+             'charges': [{'charge': 3, 'mh': 3782.86741}],
+             'peaks': {'mz': [108.3175, ...], 'intensity': [164.0, ...]}}
+    '''
+
+    scan = {'retention_time': None, 'charges': []}
+    mzs, intensities = [], []
+
+    for line in scan_bytes.splitlines():
+        first = line[:1]
+        if first.isdigit():
+            fields = line.split(None, 2)
+            mzs.append(float(fields[0]))
+            intensities.append(float(fields[1]))
+        elif first == b'S':
+            fields = line.split(b'\t')
+            scan['scan'] = int(fields[1])
+            scan['precursor_mz'] = float(fields[3])
+        elif first == b'Z':
+            fields = line.split(b'\t')
+            scan['charges'].append({'charge': int(fields[1]), 'mh': float(fields[2])})
+        elif line.startswith(b'I\tRetTime\t'):
+            scan['retention_time'] = float(line.split(b'\t')[2])
+
+    scan['peaks'] = {'mz': mzs, 'intensity': intensities}
+
+    return scan
+
+def _copy_file_range(in_fd, out_fd, offset, length):
+    return os.copy_file_range(in_fd, out_fd, length, offset)
+
+def _sendfile(in_fd, out_fd, offset, length):
+    return os.sendfile(out_fd, in_fd, offset, length)
+
+def _pread_write(in_fd, out_fd, offset, length):
+    return os.write(out_fd, os.pread(in_fd, min(length, READ_SIZE), offset))
+
+# fastest first: copy_file_range (Linux, Python 3.8+) and sendfile copy in the kernel,
+# without reading the data into Python. Both can fail for some file systems/kernels
+_copy_functions = [copy for name, copy in (('copy_file_range', _copy_file_range), ('sendfile', _sendfile)) if hasattr(os, name)] + [_pread_write]
+_unsupported = (errno.ENOSYS, errno.EXDEV, errno.EINVAL, errno.EOPNOTSUPP, errno.ENOTSUP, errno.EBADF)
+
+def copy_range(in_fd, out_fd, offset, length):
+
+    ''' Copies bytes offset:offset+length of a file (in_fd) to the current position of out_fd
+
+        Uses os.copy_file_range or os.sendfile (no copies through user space) if they work
+        for these files, otherwise os.pread and os.write
+    '''
+
+    copy_functions = _copy_functions
+    while length > 0:
+        try:
+            copied = copy_functions[0](in_fd, out_fd, offset, min(length, COPY_SIZE))
+        except OSError as exc:
+            if exc.errno not in _unsupported or len(copy_functions) == 1:
+                raise
+            copy_functions = copy_functions[1:]
+            continue
+        if not copied:
+            raise ValueError('Unexpected end of file (bytes {}:{} missing)'.format(offset, offset+length))
+        offset += copied
+        length -= copied
+
+def split_file(in_file, chunks, out_path, offsets=None):
+
+    ''' Splits an MS2 file into up to `chunks` MS2 files of consecutive scans
+        (about the same number of scans each, fewer files if there are fewer scans)
+
+        out_path is a format string for the chunk paths, e.g. '/data/temp/sample_{}.ms2'
+        (chunk numbers start at 1, and are zero-padded to the number of digits of chunks).
+        Each chunk has the H lines of the file, then its scans: one contiguous byte range,
+        copied with copy_range for plain files (compressed files are decompressed once more).
+
+        offsets can be given (e.g. from the scan index, see index_offsets),
+        otherwise the file is read once to find them (see scan_offsets).
+
+        Returns the chunk paths, in scan order
+    '''
+
+    plain = bgzf.file_format(in_file) == 'plain'
+    number_format = '{:0'+str(len(str(chunks)))+'d}'
+
+    with bgzf.open(in_file, 'rb') as f:
+        if offsets is None:
+            offsets = scan_offsets(f)
+        offsets = [int(offset) for offset in offsets]
+        scan_count = len(offsets)-1
+        chunks = min(chunks, scan_count)
+        bounds = [offsets[i*scan_count // chunks] for i in range(chunks+1)] if chunks else []
+
+        f.seek(0)
+        header = f.read(offsets[0])
+
+        chunk_paths = []
+        for i, (start, stop) in enumerate(zip(bounds[:-1], bounds[1:]), 1):
+            chunk_path = out_path.format(number_format.format(i))
+            with open(chunk_path, 'wb') as chunk_file:
+                chunk_file.write(header)
+                if plain:
+                    chunk_file.flush() # (copy_range writes to the file descriptor)
+                    copy_range(f.fileno(), chunk_file.fileno(), start, stop-start)
+                else:
+                    # (chunks are written in file order, so gzip files only seek forward)
+                    f.seek(start)
+                    for position in range(start, stop, READ_SIZE):
+                        chunk_file.write(f.read(min(READ_SIZE, stop-position)))
+            chunk_paths.append(chunk_path)
+
+    return chunk_paths
@@ -1,9 +1,606 @@
 #!/usr/bin/env python3
 
+import os
 import re
-from itertools import chain
+import sys
+import threading
+import multiprocessing
+import numpy as np
+from collections import OrderedDict
+from collections.abc import Mapping
+from itertools import chain, islice
+from biome import ( bgzf,
+                    )
 
-def dtaselect_json(in_file, small=False, get_tax=False, check_peptides=False, get_hashes=False, return_reverse=True):
+DTASELECT_FOOTER = '\tProteins\tPeptide IDs\tSpectra\n'
+DTASELECT_SUMMARY_BLOCK_SIZE = 4096
+# how the dtaselect_files pool starts its workers: not 'fork', which can deadlock a child of a
+# process with other threads running (e.g. a uWSGI worker with ingest threads)
+POOL_START_METHOD = 'spawn'
+
+MOD_PATTERN = re.compile('\((.*?)\)')
+
+def _per_to_float(x):
+    # '50%' -> 0.50
+    return float(x[:-1]) / 100
+
+def _dtaselect_header(f):
+    """ skips the DTASelect header and returns the locus and peptide column names
+    """
+
+    line = next(f)
+    while not line.startswith('Locus'):
+        line = next(f)
+
+    locus_columns = line.strip().split('\t')
+    peptide_columns = next(f).rstrip().split('\t')
+
+    return locus_columns, peptide_columns
+
+def _dtaselect_groups(f):
+    """ yields one (locus_rows, peptide_rows) tuple per protein group (generator function)
+
+    Each row is the list of tab-separated fields of one line.
+    Stops at the summary table at the end of the file.
+    """
+
+    line = next(f)
+    while line != DTASELECT_FOOTER:
+        locus_rows = []
+        while line[0] not in '\t*':  # While it starts with a number or "Rev'
+            locus_rows.append(line.strip().split('\t'))
+            line = next(f)
+
+        peptide_rows = []
+        while line[0] in '\t*' and line != DTASELECT_FOOTER:
+            peptide_rows.append(line.rstrip().split('\t'))
+            line = next(f)
+
+        yield locus_rows, peptide_rows
+
+def _split_locus(locus):
+    """ 'Reverse_12345||description' -> (12345, 'description', True)
+    """
+
+    reverse = locus.startswith('Reverse_')
+    if reverse:
+        locus = locus[8:]
+    if '||' in locus:
+        protdb_id, _, description = locus.partition('||')
+        return int(protdb_id), description, reverse
+    return int(locus), locus, reverse
+
+def _peptide_sequence(sequence):
+    """ 'K.AM(15.9949)K.L' -> (aa_sequence, is_modified, unmod_peptide, diff_mass, mods)
+
+    mods is a list of (AA, pos, mass) tuples. pos is the 1-based position of the modified AA
+    """
+
+    # same as re.findall('\.(.*)\.', sequence)[0]
+    aa_sequence = sequence[sequence.index('.')+1:sequence.rindex('.')]
+    if ')' not in aa_sequence:
+        return aa_sequence, False, aa_sequence, 0, []
+
+    # one pass over the PTMs: keep the pieces between them, instead of
+    # repeated str.replace/str.index on the partially stripped sequence
+    pieces = []
+    diff_mass = 0
+    mods = []
+    last_end = 0
+    unmod_length = 0
+    for match in MOD_PATTERN.finditer(aa_sequence):
+        start, end = match.span()
+        mass = float(match.group(1))
+        diff_mass += mass
+        pieces.append(aa_sequence[last_end:start])
+        unmod_length += start - last_end
+        mods.append((aa_sequence[start - 1], unmod_length, mass))  # 1-based
+        last_end = end
+    pieces.append(aa_sequence[last_end:])
+
+    return aa_sequence, True, ''.join(pieces), diff_mass, mods
+
+def _file_name_info(file_name):
+    """ '05282015_lysed_AW_0518_Phe3_4.1364.1364.2' -> (lc_step, scan, charge_state)
+
+    Also works with '05282015_lysed_AW_0518_Phe3_4_150529142251.1364.1364.2'
+    lc_step (MudPIT salt step) is None if it can't be parsed
+    """
+
+    fields = file_name.split('.')
+    base_name = fields[0].split('_')
+    try:
+        lcstep = int(base_name[-1])
+        if lcstep > 100:
+            lcstep = int(base_name[-2])
+    except ValueError:
+        lcstep = None
+
+    return lcstep, int(fields[1]), int(fields[3])
+
+class Record(Mapping):
+
+    """ read-only, dict-like record for one parsed line of a file (base class)
+
+    Fields from the file are kept in one tuple (`_values`), indexed by a column name -> position
+    dict that is shared by all records parsed from the same file. Fields added by the parser
+    are __slots__ attributes, and alias keys are properties, so nothing is stored twice and
+    there is no per-record dict.
+
+    Supports dict-style access (record['XCorr'], record.get('mods'), 'mods' in record, dict(record), ...)
+    for callers that expect dicts, and attribute access for parser-added fields (record.lc_step).
+    """
+
+    __slots__ = ('_columns', '_values')
+
+    _fields = ()    # parser-added fields (__slots__ of subclasses), in key order
+    _aliases = ()   # alias keys (properties of subclasses), in key order
+    _optional = ()  # fields that are missing (not in keys) when None
+
+    def __init__(self, columns, values, *fields):
+        self._columns = columns
+        self._values = values
+        for name, value in zip(self._fields, fields):
+            setattr(self, name, value)
+
+    def __getitem__(self, key):
+        position = self._columns.get(key)
+        if position is not None:
+            return self._values[position]
+        if key in self._fields or key in self._aliases:
+            value = getattr(self, key)
+            if value is None and key in self._optional:
+                raise KeyError(key)
+            return value
+        raise KeyError(key)
+
+    def __iter__(self):
+        yield from self._columns
+        for name in self._fields:
+            if name not in self._optional or getattr(self, name) is not None:
+                yield name
+        yield from self._aliases
+
+    def __len__(self):
+        return sum(1 for _ in self)
+
+    def __repr__(self):
+        return '{}({!r})'.format(type(self).__name__, dict(self))
+
+    def __getstate__(self):
+        return (self._columns, self._values) + tuple(getattr(self, name) for name in self._fields)
+
+    def __setstate__(self, state):
+        self.__init__(*state)
+
+class Locus(Record):
+
+    """ one locus line of a DTASelect-filter.txt file (see dtaselect_json for the fields)
+    """
+
+    __slots__ = ('description', 'reverse')
+    _fields = __slots__
+
+class Peptide(Record):
+
+    """ one peptide line of a DTASelect-filter.txt file (see dtaselect_json for the fields)
+
+    unmod_peptide, diff_mass and mods are only keys of modified peptides.
+    LCStep, Scan, ChargeState, AA_Sequence and isModified are aliases
+    """
+
+    __slots__ = ('aa_sequence', 'is_modified', 'unmod_peptide', 'diff_mass', 'mods', 'lc_step', 'scan', 'charge_state')
+    _fields = __slots__
+    _aliases = ('LCStep', 'Scan', 'ChargeState', 'AA_Sequence', 'isModified')
+    _optional = ('unmod_peptide', 'diff_mass', 'mods')
+
+    # To try to not break things
+    LCStep = property(lambda self: self.lc_step)
+    Scan = property(lambda self: self.scan)
+    ChargeState = property(lambda self: self.charge_state)
+    AA_Sequence = property(lambda self: self.aa_sequence)
+    isModified = property(lambda self: self.is_modified)
+
+def _rows(types, rows, skip_bad_rows=False):
+    """ converts a list of rows (lists of strings) to a list of tuples of values
+
+    Converts one column at a time (a single map() per column instead of one call per field).
+    Falls back to converting line by line if the rows don't all have one field per column.
+    With skip_bad_rows, rows that fail to convert are printed and replaced with None.
+    """
+
+    columns = list(zip(*rows))
+    if len(columns) == len(types):
+        try:
+            columns = [values if type_ is str else list(map(type_, values)) for type_, values in zip(types, columns)]
+            return list(zip(*columns))
+        except ValueError:
+            if not skip_bad_rows:
+                raise
+
+    converted = []
+    for row in rows:
+        try:
+            if len(row) < len(types):
+                raise ValueError('missing fields')
+            converted.append(tuple(x(y) for x, y in zip(types, row)))
+        except ValueError:
+            if not skip_bad_rows:
+                raise
+            print("parsing line failed: " + '\t'.join(row))
+            converted.append(None)
+    return converted
+
+def _column_index(names):
+    # column name -> position, shared by all records of a file
+    return {name: i for i, name in enumerate(names)}
+
+def _filter_groups(groups, locus_columns, peptide_columns, return_reverse=True, min_spectrum_count=None,
+                   min_sequence_count=None, loci=None, lc_steps=None):
+    """ drops protein groups (and peptides) from _dtaselect_groups output (generator function)
+
+    Filters are checked on the raw fields they need, before anything else in the group is converted.
+    See dtaselect_json for the filters
+    """
+
+    spectrum_count = locus_columns.index('Spectrum Count')
+    sequence_count = locus_columns.index('Sequence Count')
+    file_name = peptide_columns.index('FileName')
+    if loci is not None:
+        loci = set(loci)
+
+    for locus_rows, peptide_rows in groups:
+        # skip this one if we are skipping reverse loci
+        if not return_reverse and all(row[0].startswith('Reverse_') for row in locus_rows):
+            continue
+
+        try:
+            if min_spectrum_count is not None and max(int(row[spectrum_count]) for row in locus_rows) < min_spectrum_count:
+                continue
+            if min_sequence_count is not None and max(int(row[sequence_count]) for row in locus_rows) < min_sequence_count:
+                continue
+            if loci is not None and loci.isdisjoint(_split_locus(row[0])[0] for row in locus_rows):
+                continue
+        except (ValueError, IndexError):
+            # let _dtaselect_proteins report lines that can't be parsed
+            pass
+
+        if lc_steps is not None:
+            first, last = lc_steps
+            steps = [_file_name_info(row[file_name])[0] for row in peptide_rows]
+            peptide_rows = [row for row, step in zip(peptide_rows, steps) if step is not None and first <= step <= last]
+            if not peptide_rows:
+                continue
+
+        yield locus_rows, peptide_rows
+
+def _dtaselect_proteins(groups, locus_columns, peptide_columns):
+    """ converts a window of protein groups from _dtaselect_groups to protein dicts (see dtaselect_json)
+
+    Fields are converted in one batch for all groups in the window
+    (groups are filtered before, see _filter_groups).
+    """
+
+    locus_types = [str, int, int, _per_to_float, int, int, float, str, float, float, str]
+    peptide_types = [str, str, float, float, float, float, float, float, int, float, float, int, str]
+
+    # Read loci for all proteins
+    locus_index = _column_index(locus_columns)
+    locus_position = locus_index['Locus']
+    loci = []
+    for values in _rows(locus_types, [row for locus_rows, _ in groups for row in locus_rows], skip_bad_rows=True):
+        if values is None:
+            loci.append(None)
+            continue
+        # Parse out reverse loci
+        locus, description, reverse = _split_locus(values[locus_position])
+        values = values[:locus_position] + (locus,) + values[locus_position+1:]
+        loci.append(Locus(locus_index, values, description, reverse))
+
+    proteins = []
+    start = 0
+    for locus_rows, peptide_rows in groups:
+        protein = dict()
+        protein['loci'] = [l for l in loci[start:start+len(locus_rows)] if l is not None]
+        protein['peptides'] = peptide_rows
+        start += len(locus_rows)
+
+        # Are all loci for a protein reverse?
+        ## - shouldn't this logic be changed to: 'are any loci reverse?' and if so, set 'Reverse' to True?
+        ## (because then we can't distinguish this peptide match from a fictional protein from a real protein)
+        ## - There aren't typically many overlapping peptides between forward and reverse proteins anyway (~1%)
+        protein['reverse'] = all(l.reverse for l in protein['loci'])
+
+        proteins.append(protein)
+
+    # Read peptides
+    peptide_index = _column_index(peptide_columns)
+    sequence_position = peptide_index['Sequence']
+    file_name_position = peptide_index['FileName']
+    peptides = []
+    for values in _rows(peptide_types, [row for protein in proteins for row in protein['peptides']]):
+        # Pull out peptide sequences
+        aa_sequence, is_modified, unmod_peptide, diff_mass, mods = _peptide_sequence(values[sequence_position])
+        if not is_modified:
+            unmod_peptide = diff_mass = mods = None
+
+        # MudPIT salt step (chromatography method from Xcalibur),
+        # scan number from instrument (unique per salt step) - from MS2 / SQT file
+        # and predicted ion charge from instrument - from MS2 / SQT file
+        lc_step, scan, charge_state = _file_name_info(values[file_name_position])
+
+        peptides.append(Peptide(peptide_index, values, aa_sequence, is_modified, unmod_peptide, diff_mass, mods,
+                                lc_step, scan, charge_state))
+
+    start = 0
+    for protein in proteins:
+        n_peptides = len(protein['peptides'])
+        protein['peptides'] = peptides[start:start+n_peptides]
+        start += n_peptides
+
+        protein['peptide_seq'] = list(OrderedDict.fromkeys(x.aa_sequence for x in protein['peptides']))
+        protein['forward_loci'] = [l['Locus'] for l in protein['loci'] if not l.reverse]
+        protein['all_loci'] = [l['Locus'] for l in protein['loci']]
+
+        # get a "representative" locus (the largest one)
+        max_length = max(l['Length'] for l in protein['loci'])
+        protein['name'] = [l.description for l in protein['loci'] if l['Length'] == max_length][0]
+
+    return proteins
+
+class StringColumn():
+
+    """ a column of strings, stored as one UTF-8 byte buffer plus offsets
+    (string i is data[offsets[i]:offsets[i+1]]) instead of a fixed-width NumPy '<U' array,
+    which takes 4 bytes per character of the longest string for every row
+    :param data: uint8 array (e.g. memory-mapped, see biome.cache)
+    :param offsets: int64 array with one more value than the number of strings
+
+    Supports len(), indexing (returns str), slicing (returns a StringColumn that shares data) and tolist()
+    """
+
+    __slots__ = ('data', 'offsets')
+
+    def __init__(self, data, offsets):
+        self.data = data
+        self.offsets = offsets
+
+    @classmethod
+    def from_strings(cls, strings):
+        encoded = [string.encode('utf-8') for string in strings]
+        data = b''.join(encoded)
+        return cls(np.frombuffer(data, dtype=np.uint8) if data else np.zeros(0, dtype=np.uint8),
+                   np.cumsum([0] + [len(x) for x in encoded], dtype=np.int64))
+
+    @classmethod
+    def concatenate(cls, columns):
+        # (offsets of slices don't start at 0)
+        shifts = np.cumsum([0] + [column.offsets[-1] - column.offsets[0] for column in columns[:-1]])
+        return cls(np.concatenate([column.data[column.offsets[0]:column.offsets[-1]] for column in columns]),
+                   np.concatenate([columns[0].offsets[:1] - columns[0].offsets[0]] +
+                                  [column.offsets[1:] - column.offsets[0] + shift for column, shift in zip(columns, shifts)]))
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, key):
+        if isinstance(key, slice):
+            start, stop, step = key.indices(len(self))
+            if step != 1:
+                raise ValueError('StringColumn slices must be contiguous')
+            return StringColumn(self.data, self.offsets[start:max(start, stop)+1])
+        index = key + len(self) if key < 0 else key
+        if not 0 <= index < len(self):
+            raise IndexError('StringColumn index {} out of range'.format(key))
+        return self.data[self.offsets[index]:self.offsets[index+1]].tobytes().decode('utf-8')
+
+    def __iter__(self):
+        return iter(self.tolist())
+
+    def tolist(self):
+        offsets = (self.offsets - self.offsets[0]).tolist()
+        data = self.data[self.offsets[0]:self.offsets[-1]].tobytes()
+        return [data[start:stop].decode('utf-8') for start, stop in zip(offsets, offsets[1:])]
+
+    def __repr__(self):
+        return 'StringColumn({!r})'.format(self.tolist())
+
+def _columns(names, types, rows):
+    """ converts a list of rows (lists of strings) to a dict of column name -> array
+    (StringColumn for str columns). One conversion per column instead of one call per field
+    """
+
+    fields = list(zip(*rows)) if rows else [()] * len(names)
+    table = dict()
+    for name, type_, values in zip(names, types, fields):
+        if type_ is _per_to_float:
+            table[name] = np.array([x[:-1] for x in values], dtype=np.float64) / 100
+        elif type_ is str:
+            table[name] = StringColumn.from_strings(values)
+        else:
+            table[name] = np.array(values, dtype=type_)
+    return table
+
+
+TAXDB_QUERY_SIZE = 10000
+
+def _lookup_tax_ids(taxDB, protdb_ids, query_size=TAXDB_QUERY_SIZE):
+    """ returns a dict of protDB ID -> taxID for protdb_ids, using one taxDB query per `query_size` IDs
+    """
+
+    protdb_ids = sorted(set(protdb_ids))
+    tax_ids = dict()
+    for start in range(0, len(protdb_ids), query_size):
+        for doc in taxDB.find({'_id': {'$in': protdb_ids[start:start+query_size]}}, {'taxID': 1}):
+            if doc.get('taxID') is not None:
+                tax_ids[doc['_id']] = doc['taxID']
+
+    return tax_ids
+
+def _add_taxonomy(proteins, taxDB, lca, lca_cache):
+    """ sets 'tax_id' and 'lca' for a window of proteins, with bulk taxDB queries for all of their forward loci
+
+    lca_cache is a dict of frozenset(taxIDs) -> LCA, shared between windows so that
+    the (slow) LCA lookup is only done once for each distinct set of taxIDs
+    """
+
+    tax_ids = _lookup_tax_ids(taxDB, (locus for protein in proteins for locus in protein['forward_loci']))
+
+    for protein in proteins:
+        protein_tax_ids = frozenset(tax_ids[locus] for locus in protein['forward_loci'] if locus in tax_ids)
+        if protein_tax_ids:
+            if protein_tax_ids not in lca_cache:
+                lca_cache[protein_tax_ids] = lca(sorted(protein_tax_ids))
+            protein['tax_id'] = sorted(protein_tax_ids)
+            protein['lca'] = lca_cache[protein_tax_ids]
+        else:
+            protein['tax_id'] = []
+            protein['lca'] = None
+        # To try to not break things
+        protein['LCA'] = protein['lca']
+
+PROTDB_QUERY_SIZE = 10000
+
+def _lookup_protdb_docs(protDB, protdb_ids, query_size=PROTDB_QUERY_SIZE):
+    """ returns a dict of protDB ID -> protDB document for protdb_ids, using one protDB query per `query_size` IDs
+    """
+
+    protdb_ids = sorted(set(protdb_ids))
+    docs = dict()
+    for start in range(0, len(protdb_ids), query_size):
+        for doc in protDB.find({'_id': {'$in': protdb_ids[start:start+query_size]}}):
+            docs[doc['_id']] = doc
+
+    return docs
+
+def _peptide_matcher(peptides):
+    """ builds one regex that finds all of `peptides` in a protein sequence in a single scan
+
+    Peptides contained in another peptide are left out (they're found if the longer one is),
+    so no two remaining peptides can match at the same position, and the zero-width
+    lookahead finds overlapping matches.
+    Returns (compiled pattern, set of peptides the pattern can find)
+    """
+
+    peptides = sorted(set(peptides), key=len, reverse=True)
+    maximal = []
+    for peptide in peptides:
+        if not any(peptide in longer for longer in maximal):
+            maximal.append(peptide)
+
+    return re.compile('(?=({}))'.format('|'.join(map(re.escape, maximal)))), set(maximal)
+
+def _check_peptides(proteins, protDB):
+    """ sets 'protDB' and 'all_peptides_in_proteins' for a window of proteins,
+    prefetching protDB documents for all of their forward loci in bulk
+
+    Checks unmodified peptide sequences against the sequences of all forward loci.
+    Returns the representative (first) forward locus of proteins that failed the check
+    """
+
+    docs = _lookup_protdb_docs(protDB, (locus for protein in proteins for locus in protein['forward_loci']))
+
+    mismatches = []
+    for protein in proteins:
+        # Are all peptides found within the fasta sequences for all possible forward_loci ?
+        # Skip reverse loci. May want to change this to use all loci, regardless of forward or reverse
+        # to avoid some proteins not having these entries.
+        # Keeping like this for now to keep compatibility with get_forward_loci lookup
+        if not protein['forward_loci']:
+            continue
+
+        protein['protDB'] = [docs[locus] for locus in protein['forward_loci'] if locus in docs]
+        pattern, peptides = _peptide_matcher(MOD_PATTERN.sub('', peptide) for peptide in protein['peptide_seq'])
+        protein['all_peptides_in_proteins'] = bool(protein['protDB']) and all(
+            peptides <= set(pattern.findall(doc['s'])) for doc in protein['protDB'])
+        if not protein['all_peptides_in_proteins']:
+            mismatches.append(protein['forward_loci'][0])
+
+    return mismatches
+
+REDUNDB_QUERY_SIZE = 10000
+REDUNDB_CACHE_SIZE = 200000
+
+class LRUCache():
+
+    """ bounded dict-like cache that evicts the least recently used keys (thread-safe)
+    """
+
+    def __init__(self, maxsize):
+        self.maxsize = maxsize
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._items)
+
+    def __contains__(self, key):
+        return key in self._items
+
+    def get(self, key, default=None):
+        with self._lock:
+            try:
+                self._items.move_to_end(key)
+            except KeyError:
+                return default
+            return self._items[key]
+
+    def __setitem__(self, key, value):
+        with self._lock:
+            self._items[key] = value
+            self._items.move_to_end(key)
+            while len(self._items) > self.maxsize:
+                self._items.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._items.clear()
+
+# protDB ID -> redundancy hash (or None if not in redunDB), shared by all files parsed in this process
+_redundb_hashes = LRUCache(REDUNDB_CACHE_SIZE)
+_NOT_CACHED = object()
+
+def _lookup_hashes(redunDB, protdb_ids, hash_cache, query_size=REDUNDB_QUERY_SIZE):
+    """ returns a dict of protDB ID -> redundancy hash (None if not in redunDB) for protdb_ids
+
+    IDs in hash_cache aren't looked up again; the rest are queried `query_size` IDs at a time
+    """
+
+    hashes = dict()
+    missing = []
+    for protdb_id in set(protdb_ids):
+        hash_ = hash_cache.get(protdb_id, _NOT_CACHED)
+        if hash_ is _NOT_CACHED:
+            missing.append(protdb_id)
+        else:
+            hashes[protdb_id] = hash_
+
+    missing.sort()
+    for start in range(0, len(missing), query_size):
+        chunk = missing[start:start+query_size]
+        found = dict()
+        for doc in redunDB.find({'pID': {'$in': chunk}}, {'pID': 1}):
+            for protdb_id in doc['pID']:
+                found.setdefault(protdb_id, doc['_id'])
+        for protdb_id in chunk:
+            hashes[protdb_id] = hash_cache[protdb_id] = found.get(protdb_id)
+
+    return hashes
+
+def _add_hashes(proteins, redunDB, hash_cache):
+    """ sets 'hashes' for a window of proteins, with bulk redunDB queries for all of their forward loci
+    """
+
+    hashes = _lookup_hashes(redunDB, (locus for protein in proteins for locus in protein['forward_loci']), hash_cache)
+
+    for protein in proteins:
+        protein_hashes = (hashes[locus] for locus in protein['forward_loci'])
+        protein['hashes'] = list(OrderedDict.fromkeys(h for h in protein_hashes if h is not None))
+
+def dtaselect_json(in_file, small=False, get_tax=False, check_peptides=False, get_hashes=False, return_reverse=True, window=1000,
+                   taxdb=None, lca=None, protdb=None, redundb=None, hash_cache=None,
+                   start=0, stop=None, group_offsets=None,
+                   min_spectrum_count=None, min_sequence_count=None, loci=None, lc_steps=None):
     """ steps through and parses a DTASelect-filter.txt file (generator function)
     :param in_file: path to DTASelect-filter.txt file
     :param small: get rid of keys: 'loci' and 'peptides'
@@ -11,14 +608,26 @@ def dtaselect_json(in_file, small=False, get_tax=False, check_peptides=False, ge
     :param check_peptides: Check if all peptide sequences are in all proteins sequences in 'forward_loci'
     :param get_hashes:
     :param return_reverse: include reverse loci
+    :param window: number of protein groups that are read and converted at a time
+    :param taxdb: taxDB collection used by get_tax (default: taxDB on wl-cmadmin)
+    :param lca: function returning the LCA of a list of taxIDs, used by get_tax (default: Taxonomy().LCA)
+    :param protdb: protDB collection used by check_peptides (default: ProtDB_072114 on wl-cmadmin)
+    :param redundb: redunDB collection used by get_hashes (default: redunDB on wl-cmadmin)
+    :param hash_cache: LRUCache of protDB ID -> hash used by get_hashes (default: shared by the whole process)
+    :param start, stop: only parse protein groups start:stop (counting all protein groups in the file, including reverse)
+    :param group_offsets: byte offsets from dtaselect_group_offsets. Seeks straight to protein group `start`
+    :param min_spectrum_count: only protein groups with a locus with at least this 'Spectrum Count'
+    :param min_sequence_count: only protein groups with a locus with at least this 'Sequence Count'
+    :param loci: only protein groups with a locus in this collection of protDB IDs
+    :param lc_steps: (first, last) only peptides from these salt steps (inclusive). Protein groups without any are skipped
     :type in_file: str
 
         get_forward_loci is removed
         noProtDB is removed. If the locus contains a "||", the part before the pipes is determined to be the protID
 
     protein is a dict with (possible) fields:
-        loci: list of locus dicts. described below
-        peptides: list of peptide dicts. described below
+        loci: list of Locus records (read-only, dict-like). described below
+        peptides: list of Peptide records (read-only, dict-like). described below
         reverse: boolean. True if all loci for a protein are reverse
         peptide_seq: set. All peptide amino acid sequences
         forward_loci: list. 'Locus' fields in loci for forward loci
@@ -28,12 +637,12 @@ def dtaselect_json(in_file, small=False, get_tax=False, check_peptides=False, ge
         lca: Int or None. Lowest common ancestor of tax_ids
         hashes: list. MD5sums of protein sequences for forward_loci. len(hashes) gives the number of unique proteins matching
 
-    loci: dict parsed from Loci lines in file. Mostly unchanged
+    loci: Locus record parsed from Loci lines in file. Mostly unchanged
         fields from file: Locus, Sequence Count, Spectrum Count, Sequence Coverage, Length, MolWt, pI, Validation Status, NSAF, EMPAI, Descriptive Name
         fields added:
             reverse: boolean. True if `locus` starts with "Reverse_"
             description: part after'||', if exists
-    peptides: dict parsed from peptide lines in file. Mostly unchanged.
+    peptides: Peptide record parsed from peptide lines in file. Mostly unchanged.
         fields from file: Unique, FileName, XCorr, DeltCN, Conf%, M+H+m CalcM+H+, TotalIntensity, SpR, SpScore, IonProportion, Redundancy, Sequence
         fields added:
             aa_sequence: `Sequence` with the left and right sequence stripped
@@ -45,177 +654,551 @@ def dtaselect_json(in_file, small=False, get_tax=False, check_peptides=False, ge
 
     """
 
-    def per_to_float(x):
-        # '50%' -> 0.50
-        return float(x[:-1]) / 100
-
     if get_tax:
-        from ..analysis import taxonomy
-        from pymongo import MongoClient
-        client = MongoClient('wl-cmadmin', 27017)
-        taxDB = client.taxDB.taxDB
-        t = taxonomy.Taxonomy()
+        if taxdb is None:
+            from pymongo import MongoClient
+            client = MongoClient('wl-cmadmin', 27017)
+            taxdb = client.taxDB.taxDB
+        if lca is None:
+            from ..analysis import taxonomy
+            lca = taxonomy.Taxonomy().LCA
+        lca_cache = dict()
 
     if check_peptides:
-        protDB = MongoClient('wl-cmadmin', 27018).ProtDB_072114.ProtDB_072114
+        if protdb is None:
+            from pymongo import MongoClient
+            protdb = MongoClient('wl-cmadmin', 27018).ProtDB_072114.ProtDB_072114
+        mismatches = []
 
     if get_hashes:
-        client = MongoClient('wl-cmadmin', 27017)
-        redunDB = client.redunDB.redunDB
+        if redundb is None:
+            from pymongo import MongoClient
+            client = MongoClient('wl-cmadmin', 27017)
+            redundb = client.redunDB.redunDB
+        if hash_cache is None:
+            hash_cache = _redundb_hashes
 
     with open(in_file) as f:
-        line = next(f)
+        locus_columns, peptide_columns = _dtaselect_header(f)
 
-        # Skip header.
-        # TODO: parse it
-        while not line.startswith('Locus'):
-            line = next(f)
+        if group_offsets is not None:
+            # byte offsets are valid seek() positions for text files with a stateless decoder (e.g. UTF-8)
+            start = min(start, len(group_offsets)-1)
+            f.seek(int(group_offsets[start]))
+            skip = 0
+        else:
+            skip = start
+        groups = islice(_dtaselect_groups(f), skip, None if stop is None else max(skip, skip+stop-start))
 
-        # Read locus header
-        locus_columns = line.strip().split('\t')
-        locus_types = [str, int, int, per_to_float, int, int, float, str, float, float, str]
+        # filters are checked on raw lines, so rejected protein groups are never converted
+        groups = _filter_groups(groups, locus_columns, peptide_columns, return_reverse,
+                                min_spectrum_count, min_sequence_count, loci, lc_steps)
 
-        # Read peptide header
-        line = next(f)
-        peptide_columns = line.rstrip().split('\t')
-        peptide_types = [str, str, float, float, float, float, float, float, int, float, float, int, str]
+        while True:
+            # protein groups are read and converted in windows of `window` groups
+            window_groups = list(islice(groups, window))
+            if not window_groups:
+                break
+
+            proteins = _dtaselect_proteins(window_groups, locus_columns, peptide_columns)
+
+            if get_tax:
+                _add_taxonomy(proteins, taxdb, lca, lca_cache)
+
+            if check_peptides:
+                mismatches.extend(_check_peptides(proteins, protdb))
+
+            if get_hashes:
+                _add_hashes(proteins, redundb, hash_cache)
+
+            for protein in proteins:
+                if small:
+                    del protein['loci']
+                    del protein['peptides']
+
+                yield protein
+
+    if check_peptides and mismatches:
+        print('not all peptides in proteins for {} protein groups: {}'.format(len(mismatches), ', '.join(map(str, mismatches))))
+
+def dtaselect_group_offsets(in_file):
+    """ finds the byte offset of each protein group in a DTASelect-filter.txt file (one pass, no parsing)
+    :param in_file: path to DTASelect-filter.txt file
+
+    Returns an int64 array with one offset per protein group (first locus line),
+    plus the offset of the summary table at the end of the file.
+    Protein group i is bytes offsets[i]:offsets[i+1] of the file
+    """
+
+    footer = DTASELECT_FOOTER.encode('utf-8').rstrip()
+    offsets = []
+
+    with open(in_file, 'rb') as f:
         line = next(f)
+        while not line.startswith(b'Locus'):
+            line = next(f)
+        next(f)  # peptide column names
+        position = f.tell()
 
-        # Read the rest of the file
-        while line != '\tProteins\tPeptide IDs\tSpectra\n':
-            protein = dict()
-            # Read loci for a protein
-            loci = []
-            while not line.startswith('\t') and not line.startswith('*'):  # While it starts with a number or "Rev'
-                try:
-                    loci.append(dict(zip(locus_columns, [x(y) for x, y in zip(locus_types, line.strip().split('\t'))])))
-                except:
-                    print("parsing line failed: " + line)
-                line = next(f)
-
-            # Read peptides
-            peptides = []
-            while line[0] in ['\t', '*'] and line != '\tProteins\tPeptide IDs\tSpectra\n':
-                peptides.append(
-                    dict(zip(peptide_columns, [x(y) for x, y in zip(peptide_types, line.rstrip().split('\t'))])))
-                line = next(f)
-
-            protein['peptides'] = peptides
-            protein['loci'] = loci
-
-            # Parse out reverse loci
-            for l in protein['loci']:
-                if l['Locus'].startswith('Reverse_'):
-                    l['reverse'] = True
-                    l['Locus'] = l['Locus'][8:]
-                else:
-                    l['reverse'] = False
-                if l['Locus'].count("||"):
-                    locus_split = l['Locus'].split('||')
-                    l['description'] = '||'.join(locus_split[1:])
-                    l['Locus'] = int(locus_split[0])
-                else:
-                    l['description'] = l['Locus']
-                    l['Locus'] = int(l['Locus'])
-
-            # Are all loci for a protein reverse?
-            ## - shouldn't this logic be changed to: 'are any loci reverse?' and if so, set 'Reverse' to True?
-            ## (because then we can't distinguish this peptide match from a fictional protein from a real protein)
-            ## - There aren't typically many overlapping peptides between forward and reverse proteins anyway (~1%)
-            if all([l['reverse'] for x in protein['loci']]):
-                protein['reverse'] = True
+        in_loci = False
+        for line in f:
+            if line.rstrip(b'\r\n') == footer:
+                break
+            if line[:1] not in (b'\t', b'*'):
+                if not in_loci:
+                    offsets.append(position)
+                in_loci = True
             else:
-                protein['reverse'] = False
+                in_loci = False
+            position += len(line)
 
-            if not return_reverse and protein['reverse']:  # skip this one if we are skipping reverse loci
-                continue
+    offsets.append(position)
 
-            # Pull out peptide sequences
-            for p in protein['peptides']:
-                p['aa_sequence'] = re.findall('\.(.*)\.', p['Sequence'])[0]
-                p['is_modified'] = True if ')' in p['aa_sequence'] else False
-                if p['is_modified']:
-                    unmod_peptide = p['aa_sequence']
-                    diff_mass = 0
-                    mods = []
-                    for match in re.finditer('\((.*?)\)', p['aa_sequence']):
-                        mass = float(match.groups()[0])
-                        AA = p['aa_sequence'][match.span()[0] - 1]
-                        diff_mass += mass
-                        pos = unmod_peptide.index(match.group())  # 1-based
-                        mods.append((AA, pos, mass))
-                        unmod_peptide = unmod_peptide.replace(match.group(), '', 1)
-                    p['unmod_peptide'] = unmod_peptide
-                    p['diff_mass'] = diff_mass
-                    p['mods'] = mods
-
-                # MudPIT salt step (chromatography method from Xcalibur)
-                '''To work with these
-                05282015_lysed_AW_0518_Phe3_4.1364.1364.2
-                05282015_lysed_AW_0518_Phe3_4_150529142251.1364.1364.2
-                '''
-                try:
-                    lcstep = int(p['FileName'].split('.')[0].split('_')[-1])
-                    if lcstep > 100:
-                        lcstep = int(p['FileName'].split('.')[0].split('_')[-2])
-                    p['lc_step'] = lcstep
-                except ValueError:
-                    p['lc_step'] = None
-
-                # Scan number from instrument (unique per salt step) - from MS2 / SQT file
-                p['scan'] = int(p['FileName'].split('.')[1])
-
-                # predicted ion charge from instrument - from MS2 / SQT file
-                p['charge_state'] = int(p['FileName'].split('.')[3])
-
-                # To try to not break things
-                p['LCStep'] = p['lc_step']
-                p['Scan'] = p['scan']
-                p['ChargeState'] = p['charge_state']
-                p['AA_Sequence'] = p['aa_sequence']
-                p['isModified'] = p['is_modified']
-
-            protein['peptide_seq'] = list(set((x['aa_sequence'] for x in protein['peptides'])))
-            protein['forward_loci'] = [l['Locus'] for l in protein['loci'] if not l['reverse']]
-            protein['all_loci'] = [l['Locus'] for l in protein['loci']]
-
-            # get a "representative" locus (the largest one)
-            max_length = max(l['Length'] for l in protein['loci'])
-            protein['name'] = [l['description'] for l in protein['loci'] if l['Length'] == max_length][0]
+    return np.array(offsets, dtype=np.int64)
 
-            if get_tax:
-                # get all possible taxIDs
-                protDB_ids = [int(x.split('||')[0]) for x in protein['forward_loci']]
-                taxIDs_doc = list(taxDB.aggregate(
-                    [{'$match': {'_id': {'$in': protDB_ids}}},
-                     {'$group': {'_id': None, 'taxID': {'$addToSet': '$taxID'}}}]))
-                if taxIDs_doc:
-                    protein['tax_id'] = taxIDs_doc[0]['taxID']
-                    protein['lca'] = t.LCA(taxIDs_doc[0]['taxID'])
-                else:
-                    protein['tax_id'] = []
-                    protein['lca'] = None
-                # To try to not break things
-                protein['LCA'] = protein['lca']
+def _summary_key(name):
+    # 'Redundant Forward matches' -> 'redundant_forward_matches'
+    return name.strip().lower().replace(' ', '_')
 
-            if check_peptides:
-                # Are all peptides found within the fasta sequences for all possible forward_loci ?
-                # Skip reverse loci. May want to change this to use all loci, regardless of forward or reverse
-                # to avoid some proteins not having these entries.
-                # Keeping like this for now to keep compatibility with get_forward_loci lookup
-                if protein['forward_loci']:
-                    protein['protDB'] = list(protDB.find({'_id': {'$in': protein['forward_loci']}}))
-                    defline, seq = zip(*[(x['d'], x['s']) for x in protein['protDB']])
-                    protein['all_peptides_in_proteins'] = all(
-                        [all([p in s for p in protein['peptide_seq']]) for s in seq])
-                    if not protein['all_peptides_in_proteins']:
-                        print('not all peptides in proteins' + str(protein['forward_loci'][0]))
+def _summary_value(value):
+    for type_ in (int, float):
+        try:
+            return type_(value)
+        except ValueError:
+            pass
+    return value
 
-            if get_hashes:
-                protein['hashes'] = [x['_id'] for x in redunDB.find({'pID': {'$in': protein['forward_loci']}})]
+def dtaselect_summary(in_file, block_size=DTASELECT_SUMMARY_BLOCK_SIZE):
+    """ parses only the summary tables at the end of a DTASelect-filter.txt file
+    :param in_file: path to DTASelect-filter.txt file
+    :param block_size: number of bytes read from the end of the file at first (read size grows until the summary is found)
+
+    Seeks from the end of the file, so the time doesn't depend on the size of the file.
+    Returns None if there is no summary table, otherwise a dict like:
+        {'unfiltered': {'proteins': 311583, 'peptide_ids': 60554, 'spectra': 1042696},
+         'filtered': {...}, 'forward_matches': {...}, ..., 'forward_fdr': {'proteins': 0.71, ...},
+         'classification': {'unclassified': {'nonredundant_proteins': 0, 'redundant_proteins': 0}}}
+    """
+
+    footer = DTASELECT_FOOTER.rstrip('\n').encode('utf-8')
+
+    with open(in_file, 'rb') as f:
+        size = f.seek(0, os.SEEK_END)
+        read_size = min(block_size, size)
+        while True:
+            f.seek(size-read_size)
+            tail = f.read(read_size)
+            position = tail.rfind(footer)
+            if position != -1:
+                break
+            if read_size == size:
+                return None
+            read_size = min(read_size*4, size)
+
+    lines = tail[position:].decode('utf-8').splitlines()
+    summary = dict()
+    table = summary
+    columns = [_summary_key(name) for name in lines[0].split('\t')[1:]]
+    for line in lines[1:]:
+        fields = line.rstrip().split('\t')
+        if not line.strip():
+            columns = None
+        elif columns is None:
+            # header of the next table (e.g. 'Classification\tNonredundant Proteins\tRedundant Proteins')
+            table = summary.setdefault(_summary_key(fields[0]), dict())
+            columns = [_summary_key(name) for name in fields[1:]]
+        else:
+            table[_summary_key(fields[0])] = {column: _summary_value(value) for column, value in zip(columns, fields[1:])}
+
+    return summary
+
+def dtaselect_header_info(in_file):
+    """ parses the header lines at the start of a DTASelect-filter.txt file (only reads the header)
+    :param in_file: path to DTASelect-filter.txt file
+
+    Returns a dict like (values are None if the header is shorter):
+        {'version': 'DTASelect v2.1.3', 'directory': '/path/to/search',
+         'database': '/path/to/search/db.fasta', 'search_engine': 'Blazmass ? in SQT format.',
+         'flags': '--quiet --sfp 0.01 -p 2'}
+    """
+
+    lines = []
+    with open(in_file, 'r') as f:
+        for line in f:
+            # (the criteria table after the flags line has tab-separated fields)
+            if '\t' in line or line.startswith('Locus') or len(lines) == 5:
+                break
+            lines.append(line.strip())
+
+    lines += [None]*(5 - len(lines))
+
+    return dict(zip(('version', 'directory', 'database', 'search_engine', 'flags'), lines))
+
+def dtaselect_columnar(in_file, return_reverse=True, min_spectrum_count=None, min_sequence_count=None, loci=None, lc_steps=None):
+    """ parses a DTASelect-filter.txt file into NumPy arrays (one per column)
+    :param in_file: path to DTASelect-filter.txt file
+    :param return_reverse: include reverse protein groups
+    :param min_spectrum_count, min_sequence_count, loci, lc_steps: filters, see dtaselect_json
+    :type in_file: str
+
+    Holds the same information as dtaselect_json (without taxonomy/protDB lookups), but as
+    flat tables, so that analyses (e.g. peptides per salt step) can run vectorized.
+
+    returns a dict with keys:
+        loci: dict of column -> array, one row per locus. Same fields as dtaselect_json loci
+            ('Locus' is the integer protDB ID)
+        peptides: dict of column -> array, one row per peptide line. Same fields as dtaselect_json peptides, except:
+            aa_sequence, unmod_peptide: not stored (derived from `Sequence`, see dtaselect_from_columnar)
+            diff_mass: 0 for unmodified peptides
+            lc_step: -1 if it couldn't be parsed from `FileName`
+        mods: dict with 'AA', 'pos' and 'mass' arrays, one row per PTM
+        proteins: dict with 'reverse' and 'name' arrays, one row per protein group
+        loci_offsets: protein group i owns loci rows loci_offsets[i]:loci_offsets[i+1]
+        peptide_offsets: protein group i owns peptide rows peptide_offsets[i]:peptide_offsets[i+1]
+        mod_offsets: peptide j owns mods rows mod_offsets[j]:mod_offsets[j+1]
+
+    Text columns (e.g. `Descriptive Name`, `Sequence`, 'AA') are StringColumns (UTF-8 bytes plus offsets)
+    """
+
+    locus_types = [str, np.int64, np.int64, _per_to_float, np.int64, np.int64, np.float64, str, np.float64, np.float64, str]
+    peptide_types = [str, str, np.float64, np.float64, np.float64, np.float64, np.float64, np.float64, np.int64, np.float64, np.float64, np.int64, str]
+
+    locus_rows = []
+    locus_info = []
+    peptide_rows = []
+    loci_offsets = [0]
+    peptide_offsets = [0]
+    protein_reverse = []
+    protein_names = []
+
+    with open(in_file) as f:
+        locus_columns, peptide_columns = _dtaselect_header(f)
+
+        groups = _filter_groups(_dtaselect_groups(f), locus_columns, peptide_columns, return_reverse,
+                                min_spectrum_count, min_sequence_count, loci, lc_steps)
 
-            if small:
-                del protein['loci']
-                del protein['peptides']
+        for group_loci, group_peptides in groups:
+            group_info = [_split_locus(row[0]) for row in group_loci]
+            reverse = all(reverse for _, _, reverse in group_info)
+
+            # "representative" locus (the largest one)
+            lengths = [int(row[4]) for row in group_loci]
+            protein_names.append(group_info[lengths.index(max(lengths))][1])
+            protein_reverse.append(reverse)
+
+            locus_rows.extend(group_loci)
+            locus_info.extend(group_info)
+            peptide_rows.extend(group_peptides)
+            loci_offsets.append(len(locus_rows))
+            peptide_offsets.append(len(peptide_rows))
+
+    loci = _columns(locus_columns, locus_types, locus_rows)
+    locus, description, reverse = zip(*locus_info) if locus_info else [()] * 3
+    loci['Locus'] = np.array(locus, dtype=np.int64)
+    loci['description'] = StringColumn.from_strings(description)
+    loci['reverse'] = np.array(reverse, dtype=bool)
+
+    peptides = _columns(peptide_columns, peptide_types, peptide_rows)
+
+    sequences = [_peptide_sequence(sequence) for sequence in peptides['Sequence']]
+    _, is_modified, _, diff_mass, mods = zip(*sequences) if sequences else [()] * 5
+    peptides['is_modified'] = np.array(is_modified, dtype=bool)
+    peptides['diff_mass'] = np.array(diff_mass, dtype=np.float64)
+
+    file_names = [_file_name_info(file_name) for file_name in peptides['FileName']]
+    lc_step, scan, charge_state = zip(*file_names) if file_names else [()] * 3
+    peptides['lc_step'] = np.array([-1 if x is None else x for x in lc_step], dtype=np.int64)
+    peptides['scan'] = np.array(scan, dtype=np.int64)
+    peptides['charge_state'] = np.array(charge_state, dtype=np.int64)
+
+    all_mods = list(chain.from_iterable(mods))
+    AA, pos, mass = zip(*all_mods) if all_mods else [()] * 3
+
+    return {'loci': loci,
+            'peptides': peptides,
+            'mods': {'AA': StringColumn.from_strings(AA), 'pos': np.array(pos, dtype=np.int64), 'mass': np.array(mass, dtype=np.float64)},
+            'proteins': {'reverse': np.array(protein_reverse, dtype=bool), 'name': StringColumn.from_strings(protein_names)},
+            'loci_offsets': np.array(loci_offsets, dtype=np.int64),
+            'peptide_offsets': np.array(peptide_offsets, dtype=np.int64),
+            'mod_offsets': np.cumsum([0] + [len(m) for m in mods], dtype=np.int64),
+            }
+
+def dtaselect_from_columnar(tables, small=False, start=0, stop=None):
+    """ yields protein dicts in the dtaselect_json format from dtaselect_columnar output (generator function)
+    :param tables: dict returned by dtaselect_columnar (or a memory-mapped copy, see biome.cache)
+    :param small: get rid of keys: 'loci' and 'peptides'
+    :param start, stop: only yield protein groups start:stop
+
+    Only the fields parsed from the file itself are available (no get_tax/check_peptides/get_hashes fields).
+    Values are converted to plain Python types (in Locus/Peptide records).
+    """
+
+    loci = tables['loci']
+    peptides = tables['peptides']
+    mods = tables['mods']
+    loci_offsets = tables['loci_offsets'].tolist()
+    peptide_offsets = tables['peptide_offsets'].tolist()
+    mod_offsets = tables['mod_offsets']
+
+    # file columns (the tuple part of the records), then parser-added fields
+    locus_columns = [c for c in loci if c not in Locus._fields]
+    locus_index = _column_index(locus_columns)
+    peptide_columns = [c for c in peptides if c not in Peptide._fields]
+    peptide_index = _column_index(peptide_columns)
+    sequence_position = peptide_index['Sequence']
+    # (aa_sequence and unmod_peptide aren't stored, they're derived from Sequence)
+    peptide_fields = ['is_modified', 'diff_mass', 'lc_step', 'scan', 'charge_state']
+
+    protein_reverse = tables['proteins']['reverse'][start:stop].tolist()
+    for i, reverse in enumerate(protein_reverse, start):
+        protein = dict()
+
+        group_start, group_stop = loci_offsets[i], loci_offsets[i+1]
+        values = zip(*[loci[c][group_start:group_stop].tolist() for c in locus_columns])
+        fields = zip(*[loci[c][group_start:group_stop].tolist() for c in Locus._fields])
+        protein_loci = [Locus(locus_index, v, *f) for v, f in zip(values, fields)]
+
+        group_start, group_stop = peptide_offsets[i], peptide_offsets[i+1]
+        values = zip(*[peptides[c][group_start:group_stop].tolist() for c in peptide_columns])
+        fields = zip(*[peptides[c][group_start:group_stop].tolist() for c in peptide_fields])
+        protein_peptides = []
+        for j, (v, f) in enumerate(zip(values, fields), group_start):
+            is_modified, diff_mass, lc_step, scan, charge_state = f
+            aa_sequence, _, unmod_peptide, _, _ = _peptide_sequence(v[sequence_position])
+            if is_modified:
+                mod_start, mod_stop = mod_offsets[j], mod_offsets[j+1]
+                peptide_mods = list(zip(mods['AA'][mod_start:mod_stop].tolist(),
+                                        mods['pos'][mod_start:mod_stop].tolist(),
+                                        mods['mass'][mod_start:mod_stop].tolist()))
+            else:
+                unmod_peptide = diff_mass = peptide_mods = None
+            if lc_step == -1:
+                lc_step = None
+            protein_peptides.append(Peptide(peptide_index, tuple(v), aa_sequence, is_modified, unmod_peptide, diff_mass, peptide_mods,
+                                            lc_step, scan, charge_state))
+
+        protein['loci'] = protein_loci
+        protein['peptides'] = protein_peptides
+        protein['reverse'] = reverse
+        protein['peptide_seq'] = list(OrderedDict.fromkeys(x.aa_sequence for x in protein_peptides))
+        protein['forward_loci'] = [l['Locus'] for l in protein_loci if not l.reverse]
+        protein['all_loci'] = [l['Locus'] for l in protein_loci]
+        protein['name'] = tables['proteins']['name'][i]
+
+        if small:
+            del protein['loci']
+            del protein['peptides']
+
+        yield protein
+
+def _concatenate_columns(columns):
+    if isinstance(columns[0], StringColumn):
+        return StringColumn.concatenate(columns)
+    return np.concatenate(columns)
+
+def merge_columnar(tables_list):
+    """ concatenates dtaselect_columnar outputs (one per file) into one set of tables
+    :param tables_list: list of dicts returned by dtaselect_columnar
+
+    Offsets are shifted so they index into the merged tables, and 'file_offsets' is added:
+    file i owns protein groups file_offsets[i]:file_offsets[i+1]
+    """
+
+    merged = dict()
+    for name in ('loci', 'peptides', 'mods', 'proteins'):
+        columns = tables_list[0][name].keys()
+        merged[name] = {column: _concatenate_columns([tables[name][column] for tables in tables_list]) for column in columns}
+
+    # (offsets table, table the offsets index into)
+    offsets = (('loci_offsets', 'loci', 'Locus'), ('peptide_offsets', 'peptides', 'Sequence'), ('mod_offsets', 'mods', 'AA'))
+    for name, table, column in offsets:
+        shifts = np.cumsum([0] + [len(tables[table][column]) for tables in tables_list[:-1]])
+        merged[name] = np.concatenate([tables_list[0][name][:1]] +
+                                      [tables[name][1:] + shift for tables, shift in zip(tables_list, shifts)])
+
+    merged['file_offsets'] = np.cumsum([0] + [len(tables['proteins']['name']) for tables in tables_list], dtype=np.int64)
+
+    return merged
+
+def _parse_dtaselect_file(args):
+    # runs in a pool worker process (see dtaselect_files)
+    in_file, columnar, kwargs = args
+    if columnar:
+        return dtaselect_columnar(in_file, **kwargs)
+    return list(dtaselect_json(in_file, **kwargs))
+
+def _pool_context():
+    # multiprocessing context of the dtaselect_files pool (see POOL_START_METHOD)
+    context = multiprocessing.get_context(POOL_START_METHOD)
+    if not os.path.basename(sys.executable).startswith('python'):
+        # (e.g. in uWSGI workers sys.executable is the uwsgi binary)
+        context.set_executable(os.path.join(sys.exec_prefix, 'bin', 'python3'))
+    return context
+
+def dtaselect_files(in_files, columnar=False, processes=None, merge=True, **kwargs):
+    """ parses several DTASelect-filter.txt files concurrently, in a pool of worker processes
+    :param in_files: list of paths to DTASelect-filter.txt files
+    :param columnar: parse with dtaselect_columnar (and merge the tables with merge_columnar) instead of dtaselect_json
+    :param processes: size of the process pool (default: number of CPUs). No pool is started for 1 process or 1 file
+    :param merge: with columnar=True, merge the tables of all files (otherwise returns a list of tables, one per file)
+    :param kwargs: passed on to dtaselect_json/dtaselect_columnar (must be picklable, so e.g. no taxdb/protdb collections)
+
+    Each file is parsed in its own process, so parsing isn't limited by the GIL of the calling process.
+    Workers are started with POOL_START_METHOD (not forked), so this is safe to call from a threaded process.
+    Returns merged tables (columnar=True), or a list with one list of protein dicts per file (in the order of in_files)
+    """
+
+    in_files = list(in_files)
+    processes = min(processes or multiprocessing.cpu_count(), len(in_files))
+    jobs = [(in_file, columnar, kwargs) for in_file in in_files]
+
+    if processes <= 1:
+        results = list(map(_parse_dtaselect_file, jobs))
+    else:
+        with _pool_context().Pool(processes) as pool:
+            results = pool.map(_parse_dtaselect_file, jobs, chunksize=1)
+
+    if columnar and merge:
+        return merge_columnar(results) if results else None
+    return results
+
+def file_headers(in_file):
+    """ parses the H lines at the start of an MS1, MS2 or SQT file (stops at the first other line)
+    :param in_file: path to MS1/MS2/SQT file (plain or compressed, see bgzf.open)
+
+    Returns a dict like {'Extractor': 'RAWXtract', 'InstrumentType': 'FTMS', 'FirstScan': '1', ...}
+    (values of repeated keys, e.g. 'Comments', are joined with '; ')
+    """
+
+    headers = dict()
+    with bgzf.open(in_file, 'r') as f:
+        for line in f:
+            if not line.startswith('H\t'):
+                break
+            _add_header(headers, line)
+
+    return headers
+
+def _add_header(headers, line):
+    # 'H\tKey\tValue' -> headers['Key'] = 'Value'
+    fields = line.rstrip('\r\n').split('\t', 2)
+    if len(fields) < 2 or not fields[1]:
+        return
+    value = fields[2].strip() if len(fields) == 3 else ''
+    headers[fields[1]] = headers[fields[1]]+'; '+value if fields[1] in headers else value
+
+def _value_range(array):
+    # [min, max] of the non-NaN values of array, or None
+    array = array[~np.isnan(array)]
+    return [float(array.min()), float(array.max())] if len(array) else None
+
+def _charge_distribution(charges):
+    # array of charge states -> {'2': number of 2+ charge states, ...} (JSON object keys are strings)
+    values, counts = np.unique(np.asarray(charges, dtype=np.int64), return_counts=True)
+    return {str(value): int(count) for value, count in zip(values, counts)}
+
+def _header_summary(headers):
+    # instrument/extractor fields of MS1/MS2 file headers (see file_headers)
+    return {'headers': headers,
+            'instrument': headers.get('InstrumentType'),
+            'extractor': ' '.join(filter(None, (headers.get('Extractor'), headers.get('ExtractorVersion')))) or None,
+            }
+
+def ms2_summary(index, headers=None):
+    """ summary fields of an MS2 file, from its scan index
+    :param index: dict returned by ms2.scan_index
+    :param headers: dict returned by file_headers (optional)
+
+    Returns a dict like:
+        {'scans': 4, 'first_scan': 13, 'last_scan': 95, 'peaks': 180,
+         'retention_time': [0.08, 0.6], 'precursor_mz': [960.22797, 1261.62732],
+         'charges': {'2': 1, '3': 2, '4': 1}}
+    (ranges are None for files without scans/retention times)
+    With headers, also has 'headers', 'instrument' and 'extractor' (None if not in the headers)
+    """
+
+    scans = index['scans']
+
+    summary = { 'scans': len(scans['scan']),
+                'first_scan': int(scans['scan'][0]) if len(scans['scan']) else None,
+                'last_scan': int(scans['scan'][-1]) if len(scans['scan']) else None,
+                'peaks': int(scans['peak_count'].sum()),
+                'retention_time': _value_range(scans['retention_time']),
+                'precursor_mz': _value_range(scans['precursor_mz']),
+                'charges': _charge_distribution(index['charges']['charge']),
+                }
+    if headers is not None:
+        summary.update(_header_summary(headers))
+
+    return summary
+
+def ms1_summary(chromatograms, headers=None):
+    """ summary fields of an MS1 file, from its chromatograms
+    :param chromatograms: dict returned by ms1.chromatograms
+    :param headers: dict returned by file_headers (optional)
+
+    Returns a dict like:
+        {'scans': 3, 'first_scan': 1, 'last_scan': 5, 'retention_time': [0.0, 0.02],
+         'max_tic': 3412313.5}
+    With headers, also has 'headers', 'instrument' and 'extractor' (see ms2_summary)
+    """
+
+    scans = chromatograms['scan']
+
+    summary = { 'scans': len(scans),
+                'first_scan': int(scans[0]) if len(scans) else None,
+                'last_scan': int(scans[-1]) if len(scans) else None,
+                'retention_time': _value_range(chromatograms['retention_time']),
+                'max_tic': float(chromatograms['tic'].max()) if len(scans) else None,
+                }
+    if headers is not None:
+        summary.update(_header_summary(headers))
+
+    return summary
+
+def sqt_summary(in_file):
+    """ counts spectra and collects header/search information of an SQT file (one streaming pass)
+    :param in_file: path to SQT file (plain or compressed, see bgzf.open)
+
+    Returns a dict like:
+        {'scans': 120, 'first_scan': 810, 'last_scan': 4203, 'charges': {'2': 70, '3': 50},
+         'search_engine': 'Blazmass 0.983', 'database': 'MassDB.MassDB [MongoDB]',
+         'headers': {'SQTGenerator': 'Blazmass', 'BlazmassVersion': '0.983', ...}}
+    ('scans' is the number of S lines, first/last scan are the lowest/highest scan numbers)
+    """
+
+    headers = dict()
+    scans, charges = [], []
+
+    with bgzf.open(in_file, 'rb') as f:
+        for line in f:
+            first = line[:1]
+            if first == b'S':
+                fields = line.split(b'\t', 4)
+                try:
+                    scans.append(int(fields[1]))
+                    charges.append(int(fields[3]))
+                except (IndexError, ValueError):
+                    raise ValueError('Malformed S line in {}: {!r}'.format(in_file, line))
+            elif first == b'H':
+                _add_header(headers, line.decode('utf-8', 'replace'))
+
+    engine = headers.get('SQTGenerator')
+    version = headers.get('SQTGeneratorVersion') or (headers.get(engine+'Version') if engine else None)
+
+    return {'scans': len(scans),
+            'first_scan': min(scans) if scans else None,
+            'last_scan': max(scans) if scans else None,
+            'charges': _charge_distribution(charges),
+            'search_engine': ' '.join(filter(None, (engine, version))) or None,
+            'database': headers.get('Database'),
+            'headers': headers,
+            }
+
+def count_scans(in_file):
+    """ counts scans (S lines) in an MS2 or SQT file without indexing it
+    :param in_file: path to MS2 or SQT file (plain or compressed, see bgzf.open)
+    """
 
-            yield protein
+    with bgzf.open(in_file, 'rb') as f:
+        return sum(1 for line in f if line[:2] == b'S\t')
@@ -0,0 +1,86 @@
+#!/usr/bin/env python3
+
+# the file format of sidecar files (written by cache.write_tables): MAGIC, header length
+# (uint64), JSON header, then each array's raw data (aligned to ALIGNMENT bytes)
+#
+# Only depends on NumPy (doesn't import the Flask app), so Celery worker code can read the
+# sidecars that are transferred with data files too, e.g. the scan index of an MS2 file
+# (with this file next to biome_worker.py, like ms2.py)
+import os
+import json
+import mmap
+import struct
+import numpy as np
+from hashlib import sha224
+
+MAGIC = b'BIOMETBL'
+VERSION = 2
+ALIGNMENT = 64
+HASH_BLOCK_SIZE = 1024*1024
+
+def padding(position):
+
+    ''' Number of bytes from position to the next multiple of ALIGNMENT
+    '''
+
+    return -position % ALIGNMENT
+
+def read_arrays(path):
+
+    ''' Memory-maps a sidecar file
+
+        Returns (source, arrays): the 'source' dict of its header (see is_current), and a dict of
+        its arrays by name ('table/column' for tables of arrays), read-only views of the mapped file.
+        Raises ValueError if path isn't a sidecar file of this VERSION
+    '''
+
+    with open(path, 'rb') as f:
+        mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+    if mapped[:len(MAGIC)] != MAGIC:
+        raise ValueError('{} is not a biome sidecar file'.format(path))
+
+    header_length, = struct.unpack_from('<Q', mapped, len(MAGIC))
+    header_start = len(MAGIC) + 8
+    header = json.loads(mapped[header_start:header_start+header_length].decode('utf-8'))
+    if header['version'] != VERSION:
+        raise ValueError('{} has unsupported sidecar version {}'.format(path, header['version']))
+
+    data_start = header_start + header_length
+    data_start += padding(data_start)
+
+    arrays = dict()
+    for entry in header['arrays']:
+        dtype = np.dtype(entry['dtype'])
+        count = int(np.prod(entry['shape']))
+        if count:
+            arrays[entry['name']] = np.frombuffer(mapped, dtype=dtype, count=count, offset=data_start+entry['offset']).reshape(entry['shape'])
+        else:
+            arrays[entry['name']] = np.empty(entry['shape'], dtype=dtype)
+
+    return header['source'], arrays
+
+def content_hash(file_path):
+
+    ''' SHA224 hex digest of file_path (same as the upload file names)
+    '''
+
+    hasher = sha224()
+    with open(file_path, 'rb') as f:
+        for block in iter(lambda: f.read(HASH_BLOCK_SIZE), b''):
+            hasher.update(block)
+
+    return hasher.hexdigest()
+
+def is_current(source, file_path):
+
+    ''' True if a sidecar (with the 'source' dict of its header) was made from the current
+        contents of file_path: same size, and same modification time or content hash
+        (e.g. a copy of the file, see cache.source_signature)
+    '''
+
+    stat_result = os.stat(file_path)
+    if source['size'] != stat_result.st_size:
+        return False
+
+    return source['mtime_ns'] == stat_result.st_mtime_ns or source['sha224'] == content_hash(file_path)
@@ -0,0 +1,150 @@
+#!/usr/bin/env python3
+
+# streaming columnar reader for SQT files (database search results: S, M and L lines)
+#
+# Only depends on NumPy and bgzf.py (doesn't import the Flask app), so Celery worker code can
+# use it too, e.g. with this file next to biome_worker.py (like make_filtered_fasta_helpers.py)
+import numpy as np
+
+try:
+    from biome import bgzf
+except ImportError:
+    # (next to biome_worker.py, without the biome package)
+    import bgzf
+
+BATCH_SIZE = 10000
+
+# (column name, type) of the fields of each line type, in file order
+SPECTRUM_COLUMNS = (('low_scan', np.int64),
+                    ('high_scan', np.int64),
+                    ('charge', np.int64),
+                    ('process_time', np.float64),
+                    ('server', str),
+                    ('observed_mass', np.float64),
+                    ('total_intensity', np.float64),
+                    ('lowest_sp', np.float64),
+                    ('sequence_matches', np.int64),
+                    )
+MATCH_COLUMNS = (   ('xcorr_rank', np.int64),
+                    ('sp_rank', np.int64),
+                    ('calculated_mass', np.float64),
+                    ('delta_cn', np.float64),
+                    ('xcorr', np.float64),
+                    ('sp', np.float64),
+                    ('matched_ions', np.int64),
+                    ('expected_ions', np.int64),
+                    ('sequence', str),
+                    ('validation', str),
+                    )
+LOCUS_COLUMNS = (   ('locus', str),
+                    ('peptide_index', str),
+                    ('peptide', str),
+                    )
+
+def _table(columns, lines):
+    # lines of one type (e.g. all M lines of a batch) -> dict of column name -> array
+    # Splits all lines at once and takes each column with a slice (every width-th field),
+    # then converts each column with one np.array() call.
+    # Text columns are object arrays (fixed-width unicode arrays of long locus descriptions are huge)
+    width = len(columns)+1 # (+ line type field)
+    fields = '\t'.join(lines).split('\t') if lines else []
+
+    if len(fields) != width*len(lines):
+        # some lines have more or fewer fields (e.g. no validation flag, L lines with only the locus):
+        # missing trailing fields are empty strings
+        fields = []
+        for line in lines:
+            row = line.split('\t')[:width]
+            fields.extend(row + ['']*(width - len(row)))
+
+    return {name: np.array(fields[i+1::width], dtype=object if type_ is str else type_) for i, (name, type_) in enumerate(columns)}
+
+def batch_tables(spectrum_lines, match_lines, locus_lines, match_counts, locus_counts):
+
+    ''' Converts the S, M and L lines (without line ends) of a batch of spectra to typed columnar arrays
+
+        Returns a dict:
+            'spectra': one row per S line (SPECTRUM_COLUMNS)
+            'matches': one row per M line (MATCH_COLUMNS)
+            'loci': one row per L line (LOCUS_COLUMNS)
+            'match_offsets': spectrum i has matches match_offsets[i]:match_offsets[i+1]
+            'locus_offsets': match j has loci locus_offsets[j]:locus_offsets[j+1]
+    '''
+
+    return {'spectra': _table(SPECTRUM_COLUMNS, spectrum_lines),
+            'matches': _table(MATCH_COLUMNS, match_lines),
+            'loci': _table(LOCUS_COLUMNS, locus_lines),
+            'match_offsets': np.cumsum([0]+match_counts, dtype=np.int64),
+            'locus_offsets': np.cumsum([0]+locus_counts, dtype=np.int64),
+            }
+
+def read_batches(in_file, batch_size=BATCH_SIZE, top_n=None):
+
+    ''' Streams an SQT file as batches of up to batch_size spectra (see batch_tables) (generator function)
+
+        With top_n, only the first top_n M lines of each spectrum (and their L lines) are kept.
+        Lines are only sorted by type while reading; each line type of a batch is split
+        at once, and each column is converted with one np.array() call. H lines are skipped.
+        in_file can be plain or compressed (see bgzf.open)
+    '''
+
+    spectrum_lines, match_lines, locus_lines = [], [], []
+    match_counts, locus_counts = [], []
+    keep_match = False
+
+    with bgzf.open(in_file, 'r') as f:
+        for line in f:
+            first = line[:1]
+            if first == 'L':
+                if keep_match:
+                    locus_lines.append(line.rstrip('\r\n'))
+                    locus_counts[-1] += 1
+            elif first == 'M' and spectrum_lines:
+                keep_match = top_n is None or match_counts[-1] < top_n
+                if keep_match:
+                    match_lines.append(line.rstrip('\r\n'))
+                    match_counts[-1] += 1
+                    locus_counts.append(0)
+            elif first == 'S':
+                if len(spectrum_lines) == batch_size:
+                    yield batch_tables(spectrum_lines, match_lines, locus_lines, match_counts, locus_counts)
+                    spectrum_lines, match_lines, locus_lines = [], [], []
+                    match_counts, locus_counts = [], []
+                spectrum_lines.append(line.rstrip('\r\n'))
+                match_counts.append(0)
+                keep_match = False
+
+    if spectrum_lines:
+        yield batch_tables(spectrum_lines, match_lines, locus_lines, match_counts, locus_counts)
+
+def concatenate_batches(batches):
+
+    ''' Concatenates batches (e.g. from read_batches) into one set of tables (offsets are shifted)
+    '''
+
+    batches = list(batches)
+    if not batches:
+        return batch_tables([], [], [], [], [])
+
+    tables = {name: {column: np.concatenate([batch[name][column] for batch in batches]) for column in batches[0][name]}
+              for name in ('spectra', 'matches', 'loci')}
+
+    for name in ('match_offsets', 'locus_offsets'):
+        shifts = np.cumsum([0] + [batch[name][-1] for batch in batches[:-1]])
+        tables[name] = np.concatenate([batches[0][name][:1]] + [batch[name][1:] + shift for batch, shift in zip(batches, shifts)])
+
+    return tables
+
+def read_file(in_file, **kwargs):
+
+    ''' Reads a whole SQT file into one set of tables (see read_batches for keyword arguments)
+    '''
+
+    return concatenate_batches(read_batches(in_file, **kwargs))
+
+def match_spectra(tables):
+
+    ''' Row in tables['spectra'] of each match (e.g. to get the charge state of each PSM)
+    '''
+
+    return np.repeat(np.arange(len(tables['match_offsets'])-1), np.diff(tables['match_offsets']))
@@ -0,0 +1,79 @@
+#!/usr/bin/env python3
+
+# Benchmark for the DTASelect-filter.txt parsers.
+# Builds a large synthetic DTASelect file by repeating the protein groups of
+# the mock file in base.py, then reports lines/sec for each parsing mode.
+#
+# Run from the root (biome) directory:
+# (venv) $ python -m biome.testing.bench_parsers --groups 50000
+
+import os
+import time
+import argparse
+import textwrap
+from tempfile import mkstemp
+from biome import parsers
+from biome.testing import base
+
+def make_synthetic_dta_file(file_path, n_groups):
+
+    ''' Writes a DTASelect-filter.txt file with (about) n_groups protein groups
+        to file_path, using the header, protein groups and summary of the mock file
+
+        Returns the number of lines written
+    '''
+
+    lines = textwrap.dedent(base.sample_dta_file).splitlines(True)
+    first_group = [i for i, line in enumerate(lines) if line.startswith('Unique\t')][0] + 1
+    footer = lines.index(parsers.DTASELECT_FOOTER)
+
+    header_lines = lines[:first_group]
+    group_lines = lines[first_group:footer]
+    footer_lines = lines[footer:]
+    n_sample_groups = sum(1 for i, line in enumerate(group_lines) if line[0] not in '\t*' and (i == 0 or group_lines[i-1][0] in '\t*'))
+    repeats = max(1, n_groups // n_sample_groups)
+
+    with open(file_path, 'w') as f:
+        f.writelines(header_lines)
+        for _ in range(repeats):
+            f.writelines(group_lines)
+        f.writelines(footer_lines)
+
+    return len(header_lines) + repeats*len(group_lines) + len(footer_lines)
+
+def run_benchmark(file_path, n_lines, repeat=3):
+
+    ''' Times each parser on file_path (best of `repeat` runs)
+        and prints lines/sec
+    '''
+
+    benchmarks = (  ('dtaselect_json', lambda: sum(1 for _ in parsers.dtaselect_json(file_path))),
+                    ('dtaselect_json (small)', lambda: sum(1 for _ in parsers.dtaselect_json(file_path, small=True))),
+                    ('dtaselect_columnar', lambda: parsers.dtaselect_columnar(file_path)),
+                    )
+
+    for name, func in benchmarks:
+        timings = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            func()
+            timings.append(time.perf_counter() - start)
+        best = min(timings)
+        print('{:<25} {:>10.3f} s {:>12,.0f} lines/sec'.format(name, best, n_lines/best))
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark DTASelect-filter.txt parsers on a synthetic file')
+    parser.add_argument('--groups', help='Number of protein groups in the synthetic file', type=int, default=20000)
+    parser.add_argument('--repeat', help='Number of timed runs per parser (best is reported)', type=int, default=3)
+    args = parser.parse_args()
+
+    file_path = mkstemp(suffix='DTASelect-filter.txt')[1]
+    try:
+        n_lines = make_synthetic_dta_file(file_path, args.groups)
+        print('Synthetic DTASelect file: {:,} lines, {:,} bytes'.format(n_lines, os.path.getsize(file_path)))
+        run_benchmark(file_path, n_lines, repeat=args.repeat)
+    finally:
+        os.remove(file_path)
+
+if __name__ == '__main__':
+    main()
@@ -2,8 +2,13 @@
 
 from biome import ( api, 
                     app, 
+                    bgzf, 
+                    cache, 
+                    datastore, 
                     db, 
+                    ingest, 
                     models, 
+                    uploads, 
                     views, 
                     views_documents, 
                     views_helpers, 
@@ -11,7 +16,15 @@ from biome import ( api,
 from biome.testing import base
 from flask import ( jsonify, 
                     )
+import gzip
 import json
+import os
+import socket
+import subprocess
+import sys
+import time
+from datetime import timedelta
+from hashlib import sha224
 
 class TestDatasetAPI(base.BaseDatasetCreatedTestCase):
 
@@ -92,6 +105,24 @@ class TestDTAFileAPI(base.BaseDTAFileCreatedTestCase):
         self.assertIn('id', json_resp)
         self.assertEqual(json_resp['id'], 1)
 
+    def test_dtafile_summary_is_stored_at_upload(self):
+
+        ''' Tests that the DTASelect summary table is saved with the DTAFile record
+            and returned by the quick info view
+        '''
+
+        self.assertEqual(models.DTAFile.query.get(self.dtafile_id).summary['filtered']['proteins'], 141)
+
+        json_resp = json.loads(views_helpers.get_json_response('api.dtafile_quickinfo', self.dtafile_id))
+        self.assertEqual(json_resp['summary']['unfiltered']['spectra'], 1042696)
+
+    def test_dtafile_flags_are_stored_at_upload(self):
+
+        ''' Tests that the DTASelect flags (from the file header) are saved with the DTAFile record
+        '''
+
+        self.assertEqual(models.DTAFile.query.get(self.dtafile_id).flags, '--quiet --sfp 0.01 -p 2')
+
     def test_dtafile_not_found_gives_empty_json_obj(self):
 
         ''' Tests that a DTAFile that doesn't exist (id=2)
@@ -113,3 +144,476 @@ class TestDTAFileAPI(base.BaseDTAFileCreatedTestCase):
         self.assertIn('data', json_resp) # JSON response has 'data'
 
         self.assertEqual(len(json_resp['data']), 9) # 9 loci in this "file"
+
+    def test_dtafile_JSON_is_streamed(self):
+
+        ''' Tests that the parsed DTASelect file is streamed
+            (not built in memory before the response is sent)
+        '''
+
+        resp = self.client.get('/api/dta/{}.json'.format(self.dtafile_id))
+
+        self.assertTrue(resp.is_streamed)
+        self.assertEqual(len(json.loads(resp.get_data().decode('utf-8'))['data']), 9)
+
+    def test_dtafile_JSON_pages(self):
+
+        ''' Tests that ?offset=&limit= returns one page of protein groups
+        '''
+
+        resp = self.client.get('/api/dta/{}.json'.format(self.dtafile_id))
+        all_proteins = json.loads(resp.get_data().decode('utf-8'))['data']
+
+        resp = self.client.get('/api/dta/{}.json?offset=2&limit=3'.format(self.dtafile_id))
+        page = json.loads(resp.get_data().decode('utf-8'))
+
+        self.assertEqual(page['total'], 9)
+        self.assertEqual(page['offset'], 2)
+        self.assertEqual(page['data'], all_proteins[2:5])
+
+        resp = self.client.get('/api/dta/{}.json?offset=8&limit=3'.format(self.dtafile_id))
+        self.assertEqual(json.loads(resp.get_data().decode('utf-8'))['data'], all_proteins[8:])
+
+    def test_dbsearch_JSON_parses_missing_sidecars(self):
+
+        ''' Tests that the DTASelect files of a DBSearch are returned together,
+            and that a missing parsed sidecar is built by the ingest job (not in the view)
+        '''
+
+        sidecar_path = models.DTAFile.query.get(self.dtafile_id).file_path+cache.DTASELECT_SUFFIX
+        os.remove(sidecar_path)
+
+        resp = self.client.get('/api/dbsearch/{}/dta.json'.format(self.dbsearch_id))
+        json_resp = json.loads(resp.get_data().decode('utf-8'))
+
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(json_resp['dtafile_ids'], [self.dtafile_id])
+        self.assertEqual(json_resp['file_offsets'], [0, 9])
+        self.assertEqual(len(json_resp['data']), 9)
+        self.assertTrue(os.path.exists(sidecar_path))
+        self.assertEqual(models.IngestJob.query.filter_by(name='cache_dbsearch_dtaselect_files').count(), 1)
+
+    def test_json_list_encoder(self):
+
+        ''' Tests that the generator-based JSON encoder gives valid JSON
+        '''
+
+        chunks = list(views_helpers.iter_json_list('data', ({'id': i} for i in range(3))))
+
+        self.assertEqual(len(chunks), 5) # opening bytes, 3 items, closing bytes
+        self.assertEqual(json.loads(b''.join(chunks).decode('utf-8')), {'data': [{'id': 0}, {'id': 1}, {'id': 2}]})
+        self.assertEqual(json.loads(b''.join(views_helpers.iter_json_list('data', [])).decode('utf-8')), {'data': []})
+
+        chunks = list(views_helpers.iter_json_list('data', [1], total=9, offset=0))
+        self.assertEqual(json.loads(b''.join(chunks).decode('utf-8')), {'data': [1], 'total': 9, 'offset': 0})
+
+class TestMS2FileAPI(base.BaseMS2FileCreatedTestCase):
+
+    ''' Methods to test random access to MS2File scans
+    '''
+
+    def tearDown(self):
+        sidecar_path = self.ms2_file_path+cache.MS2_INDEX_SUFFIX
+        if os.path.exists(sidecar_path):
+            os.remove(sidecar_path)
+        super().tearDown()
+
+    def test_single_scan(self):
+
+        ''' Tests that /api/ms2/<id>/scan/<scan> returns the peak list of one scan
+        '''
+
+        resp = json.loads(self.client.get('/api/ms2/{}/scan/40'.format(self.ms2file_id)).get_data().decode('utf-8'))
+
+        self.assertEqual(resp['scan'], 40)
+        self.assertEqual(resp['precursor_mz'], 960.22797)
+        self.assertEqual(resp['charges'], [{'charge': 4, 'mh': 3837.89004}])
+        self.assertEqual(len(resp['peaks']['mz']), len(resp['peaks']['intensity']))
+        self.assertEqual(resp['peaks']['mz'][0], float(self.ms2_file_string.split('S\t000040')[1].splitlines()[9].split()[0]))
+
+        self.assertEqual(self.client.get('/api/ms2/{}/scan/41'.format(self.ms2file_id)).get_data().decode('utf-8').strip(), '{}')
+
+    def test_batched_scans(self):
+
+        ''' Tests that ?scans= returns scans in the requested order (null for missing scans)
+        '''
+
+        resp = self.client.get('/api/ms2/{}/scan?scans=95,13,41'.format(self.ms2file_id))
+        data = json.loads(resp.get_data().decode('utf-8'))['data']
+
+        self.assertEqual([scan and scan['scan'] for scan in data], [95, 13, None])
+
+        resp = self.client.get('/api/ms2/{}/scan?scans=13,x'.format(self.ms2file_id))
+        self.assertIn('error', json.loads(resp.get_data().decode('utf-8')))
+
+    def test_missing_index_is_not_built_in_request(self):
+
+        ''' Tests that a missing scan index is built by an ingest job (503 while the job is queued)
+        '''
+
+        os.remove(self.ms2_file_path+cache.MS2_INDEX_SUFFIX)
+        db.session.add(models.IngestJob('count_scans_in_file', [self.ms2file_id, 'ms2']))
+        db.session.commit()
+
+        self.assertEqual(self.client.get('/api/ms2/{}/scan/40'.format(self.ms2file_id)).status_code, 503)
+        self.assertEqual(self.client.get('/api/ms2/{}/scan?scans=40'.format(self.ms2file_id)).status_code, 503)
+        self.assertFalse(os.path.exists(self.ms2_file_path+cache.MS2_INDEX_SUFFIX))
+        self.assertEqual(models.IngestJob.query.filter_by(name='count_scans_in_file', status='queued').count(), 1)
+
+        models.IngestJob.query.filter_by(status='queued').delete()
+        db.session.commit()
+        resp = self.client.get('/api/ms2/{}/scan/40'.format(self.ms2file_id)) # (TestConfig runs the job right away)
+        self.assertEqual(json.loads(resp.get_data().decode('utf-8'))['scan'], 40)
+
+class TestMS1FileAPI(base.BaseMS1FileCreatedTestCase):
+
+    ''' Methods to test MS1File chromatogram API
+    '''
+
+    def tearDown(self):
+        for suffix in (cache.MS1_CHROMATOGRAM_SUFFIX, cache.MS1_XIC_INDEX_SUFFIX):
+            if os.path.exists(self.ms1_file_path+suffix):
+                os.remove(self.ms1_file_path+suffix)
+        super().tearDown()
+
+    def test_tic(self):
+
+        ''' Tests that /api/ms1/<id>/tic returns one TIC/base peak value per scan
+        '''
+
+        resp = json.loads(self.client.get('/api/ms1/{}/tic'.format(self.ms1file_id)).get_data().decode('utf-8'))
+
+        self.assertEqual(resp['id'], self.ms1file_id)
+        self.assertEqual(len(resp['scan']), self.ms1_file_string.count('S\t'))
+        self.assertEqual(resp['retention_time'][0], 0.01)
+        for name in ('tic', 'base_peak_mz', 'base_peak_intensity'):
+            self.assertEqual(len(resp[name]), len(resp['scan']))
+
+    def test_xic(self):
+
+        ''' Tests that /api/ms1/<id>/xic returns the intensity of a peak in its scan (and only scans in the RT range)
+        '''
+
+        resp = json.loads(self.client.get('/api/ms1/{}/xic?mz=400.2744&ppm=5&rt_end=0.05'.format(self.ms1file_id)).get_data().decode('utf-8'))
+
+        self.assertEqual(resp['retention_time'], [0.01])
+        self.assertAlmostEqual(resp['intensity'][0], 1897.8, places=3)
+        self.assertEqual((resp['mz'], resp['ppm']), (400.2744, 5))
+
+        resp = json.loads(self.client.get('/api/ms1/{}/xic?ppm=5'.format(self.ms1file_id)).get_data().decode('utf-8'))
+        self.assertIn('error', resp)
+
+    def test_missing_chromatograms_are_not_computed_in_request(self):
+
+        ''' Tests that /api/ms1/<id>/tic returns 503 while the chromatograms are being computed
+        '''
+
+        os.remove(self.ms1_file_path+cache.MS1_CHROMATOGRAM_SUFFIX)
+        db.session.add(models.IngestJob('precompute_ms1_chromatograms', [self.ms1file_id]))
+        db.session.commit()
+
+        self.assertEqual(self.client.get('/api/ms1/{}/tic'.format(self.ms1file_id)).status_code, 503)
+        self.assertFalse(os.path.exists(self.ms1_file_path+cache.MS1_CHROMATOGRAM_SUFFIX))
+
+    def test_tic_not_found_gives_empty_json_obj(self):
+
+        ''' Tests that an MS1File that doesn't exist returns an empty JSON object
+        '''
+
+        self.assertEqual(views_helpers.get_json_response('api.ms1file_tic', 2), '{}')
+
+class TestUploadAPI(base.BaseFileInfoTestCase):
+
+    ''' Methods to test chunked, resumable uploads (/api/upload)
+    '''
+
+    def tearDown(self):
+        for upload_file in models.UploadFile.query.all():
+            for path in (upload_file.file_path, upload_file.part_path):
+                if path:
+                    for sidecar_path in [path] + datastore._sidecar_paths(path):
+                        if os.path.exists(sidecar_path):
+                            os.remove(sidecar_path)
+        super().tearDown()
+
+    def start(self, files, chunk_size=1000):
+        resp = self.client.post('/api/upload', data=json.dumps({'dataset_name': 'chunked upload', 
+                                                                'dataset_description': 'test', 
+                                                                'chunk_size': chunk_size, 
+                                                                'files': files, 
+                                                                }))
+        return resp.status_code, json.loads(resp.get_data().decode('utf-8'))
+
+    def put_chunk(self, upload_id, file_id, number, contents, chunk_size=1000):
+        return self.client.put('/api/upload/{}/{}/{}'.format(upload_id, file_id, number), data=contents[number*chunk_size:(number+1)*chunk_size])
+
+    def wait_for_status(self, upload_id, status, timeout=10):
+        deadline = time.time() + timeout
+        while True:
+            db.session.remove() # (see changes made by the background thread)
+            upload_status = json.loads(self.client.get('/api/upload/{}'.format(upload_id)).get_data().decode('utf-8'))
+            if upload_status['status'] == status or time.time() > deadline:
+                return upload_status
+            time.sleep(0.05)
+
+    def test_chunked_upload_creates_dataset(self):
+
+        ''' Tests uploading files in chunks (out of order, one of them missing at first):
+            the dataset is only created after all files are finalized and stored
+        '''
+
+        ms2_contents = self.ms2_file_string.encode('utf-8')
+        dta_contents = self.dta_file_string.encode('utf-8')
+        status_code, upload = self.start([{'filename': self.ms2_file_name, 'size': len(ms2_contents)}, 
+                                          {'filename': self.dta_file_name, 'size': len(dta_contents)}])
+        self.assertEqual(status_code, 200)
+        upload_id = upload['upload_id']
+        ms2_file, dta_file = upload['files']
+        self.assertEqual(ms2_file['missing_chunks'], list(range(ms2_file['chunks'])))
+
+        for number in reversed(range(1, ms2_file['chunks'])):
+            self.assertEqual(self.put_chunk(upload_id, ms2_file['file_id'], number, ms2_contents).status_code, 200)
+        resp = self.client.post('/api/upload/{}/{}/finalize'.format(upload_id, ms2_file['file_id']))
+        self.assertEqual(resp.status_code, 409)
+        self.assertEqual(json.loads(resp.get_data().decode('utf-8'))['missing_chunks'], [0])
+
+        self.put_chunk(upload_id, ms2_file['file_id'], 0, ms2_contents)
+        self.assertEqual(self.client.post('/api/upload/{}/{}/finalize'.format(upload_id, ms2_file['file_id'])).status_code, 202)
+        self.assertEqual(self.wait_for_status(upload_id, 'complete', timeout=1)['status'], 'uploading')
+        self.assertEqual(models.Dataset.query.count(), 0)
+
+        for number in range(dta_file['chunks']):
+            self.put_chunk(upload_id, dta_file['file_id'], number, dta_contents)
+        self.client.post('/api/upload/{}/{}/finalize'.format(upload_id, dta_file['file_id']))
+
+        upload_status = self.wait_for_status(upload_id, 'complete')
+        self.assertEqual(upload_status['status'], 'complete')
+        self.assertEqual([upload_file['sha224'] for upload_file in upload_status['files']], 
+                         [sha224(ms2_contents).hexdigest(), sha224(dta_contents).hexdigest()])
+
+        dataset = models.Dataset.query.get(upload_status['dataset_id'])
+        self.assertEqual(dataset.name, 'chunked upload')
+        ms2file = dataset.ms2files.one()
+        self.assertEqual(ms2file.original_filename, self.ms2_file_name)
+        with bgzf.open(ms2file.file_path, 'rb') as f:
+            self.assertEqual(f.read(), ms2_contents)
+
+    def test_resume_after_interruption(self):
+
+        ''' Tests that the status lists the chunks that still have to be sent,
+            and that chunks can be sent again
+        '''
+
+        contents = self.sqt_file_string.encode('utf-8')
+        _, upload = self.start([{'filename': self.sqt_file_name, 'size': len(contents)}])
+        upload_id, upload_file = upload['upload_id'], upload['files'][0]
+
+        for number in (0, 1, 1, 3):
+            self.assertEqual(self.put_chunk(upload_id, upload_file['file_id'], number, contents).status_code, 200)
+
+        upload_status = json.loads(self.client.get('/api/upload/{}'.format(upload_id)).get_data().decode('utf-8'))
+        self.assertEqual(upload_status['files'][0]['missing_chunks'], [2] + list(range(4, upload_file['chunks'])))
+
+    def test_received_chunks_are_hashed_as_they_arrive(self):
+
+        ''' Tests that the received start of a file is hashed (and compressed) as chunks arrive,
+            that a hashed chunk sent again with other contents is hashed again, and that the
+            stored file has the hash of the final contents
+        '''
+
+        if not uploads.SavedSHA224.available():
+            self.skipTest('libcrypto is not available')
+
+        contents = self.ms2_file_string.encode('utf-8')
+        _, upload = self.start([{'filename': self.ms2_file_name, 'size': len(contents)}])
+        upload_id, file_id = upload['upload_id'], upload['files'][0]['file_id']
+
+        for number in (0, 1, 3):
+            self.put_chunk(upload_id, file_id, number, contents)
+        db.session.remove()
+        upload_file = models.UploadFile.query.get(file_id)
+        self.assertEqual(upload_file.hashed_chunks, 2)
+        self.assertEqual(os.path.getsize(upload_file.part_path+'.bgzf'), upload_file.compressed_size)
+        hasher = uploads.SavedSHA224(upload_file.hash_state)
+        self.assertEqual(hasher.hexdigest(), sha224(contents[:2000]).hexdigest())
+
+        self.put_chunk(upload_id, file_id, 2, contents)
+        db.session.remove()
+        self.assertEqual(models.UploadFile.query.get(file_id).hashed_chunks, 4)
+
+        changed = b'H\tchanged' + contents[9:]
+        self.put_chunk(upload_id, file_id, 0, changed)
+        for number in range(4, upload['files'][0]['chunks']):
+            self.put_chunk(upload_id, file_id, number, changed)
+        self.client.post('/api/upload/{}/{}/finalize'.format(upload_id, file_id))
+
+        upload_status = self.wait_for_status(upload_id, 'complete')
+        self.assertEqual(upload_status['files'][0]['sha224'], sha224(changed).hexdigest())
+        ms2file = models.Dataset.query.get(upload_status['dataset_id']).ms2files.one()
+        with bgzf.open(ms2file.file_path, 'rb') as f:
+            self.assertEqual(f.read(), changed)
+
+    def test_stale_sessions_expire(self):
+
+        ''' Tests that sessions without chunks for UPLOAD_EXPIRY_DAYS are set to 'expired',
+            with their part files removed, and that active sessions are left alone
+        '''
+
+        contents = self.sqt_file_string.encode('utf-8')
+        _, stale = self.start([{'filename': self.sqt_file_name, 'size': len(contents)}])
+        _, active = self.start([{'filename': self.sqt_file_name, 'size': len(contents)}])
+        self.put_chunk(stale['upload_id'], stale['files'][0]['file_id'], 0, contents)
+        self.put_chunk(active['upload_id'], active['files'][0]['file_id'], 0, contents)
+
+        db.session.remove()
+        stale_session = models.UploadSession.query.get(stale['upload_id'])
+        stale_session.last_activity -= timedelta(days=app.config['UPLOAD_EXPIRY_DAYS'] + 1)
+        db.session.commit()
+
+        self.assertEqual(uploads.expire_sessions(), [stale['upload_id']])
+        stale_file = models.UploadFile.query.get(stale['files'][0]['file_id'])
+        self.assertEqual((stale_file.upload_session.status, stale_file.status), ('expired', 'expired'))
+        self.assertFalse(os.path.exists(stale_file.part_path))
+        self.assertEqual(uploads.received_chunks(stale_file), [])
+        self.assertTrue(os.path.exists(models.UploadFile.query.get(active['files'][0]['file_id']).part_path))
+
+        resp = self.put_chunk(stale['upload_id'], stale['files'][0]['file_id'], 1, contents)
+        self.assertEqual(resp.status_code, 400)
+
+    def test_failed_file_can_be_sent_again(self):
+
+        ''' Tests that a file that can't be stored (corrupt gzip upload) can be uploaded
+            and finalized again, and that no compressed part file is left behind
+        '''
+
+        contents = gzip.compress(self.ms2_file_string.encode('utf-8'))
+        corrupt = contents[:-8] + bytes(8) # (wrong CRC and length in the gzip trailer)
+        _, upload = self.start([{'filename': self.ms2_file_name+'.gz', 'size': len(contents)}])
+        upload_id, upload_file = upload['upload_id'], upload['files'][0]
+
+        for number in range(upload_file['chunks']):
+            self.put_chunk(upload_id, upload_file['file_id'], number, corrupt)
+        self.assertEqual(self.client.post('/api/upload/{}/{}/finalize'.format(upload_id, upload_file['file_id'])).status_code, 202)
+
+        upload_status = self.wait_for_status(upload_id, 'complete', timeout=1)
+        self.assertEqual(upload_status['files'][0]['status'], 'uploading')
+        part_path = models.UploadFile.query.get(upload_file['file_id']).part_path
+        self.assertEqual(datastore._sidecar_paths(part_path), [])
+
+        for number in range(upload_file['chunks']):
+            self.assertEqual(self.put_chunk(upload_id, upload_file['file_id'], number, contents).status_code, 200)
+        self.client.post('/api/upload/{}/{}/finalize'.format(upload_id, upload_file['file_id']))
+
+        upload_status = self.wait_for_status(upload_id, 'complete')
+        self.assertEqual(upload_status['status'], 'complete')
+        self.assertEqual(upload_status['files'][0]['sha224'], sha224(self.ms2_file_string.encode('utf-8')).hexdigest())
+
+    def test_invalid_chunks_are_rejected(self):
+
+        ''' Tests that chunks of the wrong size, or past the end of the file, are rejected
+        '''
+
+        contents = self.ms2_file_string.encode('utf-8')
+        _, upload = self.start([{'filename': self.ms2_file_name, 'size': len(contents)}])
+        upload_id, upload_file = upload['upload_id'], upload['files'][0]
+
+        resp = self.client.put('/api/upload/{}/{}/0'.format(upload_id, upload_file['file_id']), data=contents[:999])
+        self.assertEqual(resp.status_code, 400)
+        resp = self.client.put('/api/upload/{}/{}/{}'.format(upload_id, upload_file['file_id'], upload_file['chunks']), data=b'')
+        self.assertEqual(resp.status_code, 400)
+        self.assertEqual(uploads.received_chunks(models.UploadFile.query.get(upload_file['file_id'])), [])
+
+    def test_invalid_file_types_are_rejected(self):
+
+        ''' Tests that uploads of unsupported file types aren't started
+        '''
+
+        status_code, resp = self.start([{'filename': 'some_other_document.pdf', 'size': 10}])
+
+        self.assertEqual(status_code, 400)
+        self.assertIn('error', resp)
+        self.assertEqual(models.UploadSession.query.count(), 0)
+
+class TestIngestJobs(base.BaseMS2FileCreatedTestCase):
+
+    ''' Methods to test background ingest jobs (see biome.ingest) and /api/job(s)
+
+        (TestConfig runs jobs right away, in the calling thread)
+    '''
+
+    def setUp(self):
+        super().setUp()
+        self.max_queued = app.config['INGEST_MAX_QUEUED']
+
+    def tearDown(self):
+        app.config['INGEST_MAX_QUEUED'] = self.max_queued
+        sidecar_path = self.ms2_file_path+cache.MS2_INDEX_SUFFIX
+        if os.path.exists(sidecar_path):
+            os.remove(sidecar_path)
+        super().tearDown()
+
+    def test_job_is_recorded_as_done(self):
+
+        ''' Tests that the scan counting job of the new MS2File ran, and was recorded
+        '''
+
+        ingest_job = models.IngestJob.query.filter_by(name='count_scans_in_file').one()
+
+        self.assertEqual(ingest_job.args, [self.ms2file_id, 'ms2'])
+        self.assertEqual(ingest_job.status, 'done')
+        self.assertEqual(ingest_job.progress, 1.0)
+        self.assertIsNotNone(ingest_job.finished_time)
+        self.assertEqual(models.MS2File.query.get(self.ms2file_id).scans, 4)
+
+    def test_failed_job_is_recorded(self):
+
+        ''' Tests that a job that raises an exception is recorded as failed (with the error),
+            and that the exception isn't raised by the call
+        '''
+
+        job_id = views_helpers.cache_dtaselect_file(self.ms2_file_path+'.missing')
+
+        resp = json.loads(self.client.get('/api/job/{}'.format(job_id)).get_data().decode('utf-8'))
+        self.assertEqual(resp['status'], 'failed')
+        self.assertIn('FileNotFoundError', resp['message'])
+
+        resp = json.loads(self.client.get('/api/jobs?status=failed').get_data().decode('utf-8'))
+        self.assertEqual([ingest_job['id'] for ingest_job in resp['jobs']], [job_id])
+        self.assertEqual(resp['counts'], {'done': 1, 'failed': 1})
+
+        self.assertEqual(self.client.get('/api/job/{}'.format(job_id+1)).status_code, 404)
+
+    def test_stale_jobs_are_queued_again(self):
+
+        ''' Tests that running jobs of a process (on this host) that exited are queued again
+            when a process starts, and that jobs of running processes aren't
+        '''
+
+        exited = subprocess.Popen([sys.executable, '-c', 'pass'])
+        exited.wait()
+        stale_job = models.IngestJob('count_scans_in_file', [self.ms2file_id, 'ms2'])
+        running_job = models.IngestJob('count_scans_in_file', [self.ms2file_id, 'ms2'])
+        for ingest_job, pid in ((stale_job, exited.pid), (running_job, os.getpid())):
+            ingest_job.status = 'running'
+            ingest_job.worker = '{}:{}'.format(socket.gethostname(), pid)
+            db.session.add(ingest_job)
+        db.session.commit()
+
+        self.assertEqual(ingest.requeue_stale_jobs(), 1)
+        self.assertEqual(stale_job.status, 'queued')
+        self.assertIsNone(stale_job.worker)
+        self.assertEqual(running_job.status, 'running')
+
+    def test_uploads_are_turned_away_when_queue_is_full(self):
+
+        ''' Tests that new uploads get a 503 response while too many jobs are queued
+        '''
+
+        app.config['INGEST_MAX_QUEUED'] = 0
+        self.assertTrue(ingest.queue_full())
+
+        resp = self.client.post('/api/upload', data=json.dumps({'dataset_name': 'later', 
+                                                                'files': [{'filename': self.ms2_file_name, 'size': 10}], 
+                                                                }))
+        self.assertEqual(resp.status_code, 503)
+        self.assertEqual(models.UploadSession.query.count(), 0)
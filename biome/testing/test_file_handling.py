@@ -2,12 +2,17 @@
 
 import io
 import os
+import gzip
+import shutil
 import time
+from hashlib import sha224
 from werkzeug.datastructures import FileStorage
 from werkzeug import secure_filename
 from tempfile import mkstemp
 
 from biome import ( app, 
+                    bgzf, 
+                    datastore, 
                     db, 
                     models, 
                     views, 
@@ -53,6 +58,8 @@ class TestSaveFile(base.BaseFileInfoTestCase):
                                     ):
                 if new_file_path:
                     os.remove(new_file_path)
+                    if os.path.exists(new_file_path+bgzf.INDEX_SUFFIX):
+                        os.remove(new_file_path+bgzf.INDEX_SUFFIX)
         finally:
             for filehandle in ( self.ms1_filehandle, 
                                 self.ms2_filehandle, 
@@ -113,6 +120,241 @@ class TestSaveFile(base.BaseFileInfoTestCase):
 
         self.assertTrue(self.original_filename == secure_filename(self.ms1_filestorage.filename))
 
+class TestStreamingUpload(base.BaseFileInfoTestCase):
+
+    ''' Methods to test hashing uploads while they're written (and skipping duplicates)
+    '''
+
+    def setUp(self):
+        super().setUp()
+        self.new_file_paths = set()
+
+    def tearDown(self):
+        for new_file_path in self.new_file_paths:
+            for path in (new_file_path, new_file_path+bgzf.INDEX_SUFFIX):
+                if os.path.exists(path):
+                    os.remove(path)
+        super().tearDown()
+
+    def save(self, contents, filename):
+        new_file_path, original_filename = views_documents.save_new_file(FileStorage(stream=io.BytesIO(contents), filename=filename))
+        self.new_file_paths.add(new_file_path)
+        return new_file_path
+
+    def test_file_is_named_by_hash(self):
+
+        ''' Tests that the saved file has the uploaded contents, and is named by their SHA224 hash
+            (also for files larger than one block)
+        '''
+
+        contents = self.dta_file_string.encode('utf-8') * (views_documents.UPLOAD_BLOCK_SIZE // len(self.dta_file_string) + 2)
+        new_file_path = self.save(contents, self.dta_file_name)
+
+        with open(new_file_path, 'rb') as f:
+            self.assertEqual(f.read(), contents)
+        self.assertEqual(os.path.basename(new_file_path), views_helpers.get_hash(new_file_path)+'.txt')
+        self.assertFalse([name for name in os.listdir(app.config['UPLOAD_FOLDER']) if name.endswith('.part')])
+
+    def test_duplicate_upload_keeps_existing_file(self):
+
+        ''' Tests that uploading the same contents again doesn't rewrite the saved file
+        '''
+
+        contents = self.ms2_file_string.encode('utf-8')
+        new_file_path = self.save(contents, self.ms2_file_name)
+        mtime = os.stat(new_file_path).st_mtime_ns
+
+        time.sleep(0.01)
+        self.assertEqual(self.save(contents, 'copy_of_'+self.ms2_file_name), new_file_path)
+        self.assertEqual(os.stat(new_file_path).st_mtime_ns, mtime)
+
+    def test_several_files_are_saved_in_order(self):
+
+        ''' Tests that save_new_files returns saved paths in the order of the uploaded files
+        '''
+
+        uploads = [ (self.ms1_file_string, self.ms1_file_name), 
+                    (self.ms2_file_string, self.ms2_file_name), 
+                    (self.sqt_file_string, self.sqt_file_name), 
+                    (self.dta_file_string, self.dta_file_name), 
+                    ]
+        file_objs = [FileStorage(stream=io.BytesIO(contents.encode('utf-8')), filename=filename) for contents, filename in uploads]
+
+        saved_files = views_documents.save_new_files(file_objs)
+        self.new_file_paths.update(new_file_path for new_file_path, _ in saved_files)
+
+        for (new_file_path, original_filename), (contents, filename) in zip(saved_files, uploads):
+            self.assertEqual(original_filename, secure_filename(filename))
+            with bgzf.open(new_file_path, 'r') as f:
+                self.assertEqual(f.read(), contents)
+
+    def test_data_files_are_stored_compressed(self):
+
+        ''' Tests that MS1/MS2/SQT files are stored block-compressed (named by the hash of the
+            uncompressed contents), and DTASelect files are stored as they are
+        '''
+
+        contents = self.ms2_file_string.encode('utf-8')
+        new_file_path = self.save(contents, self.ms2_file_name)
+
+        self.assertTrue(new_file_path.endswith('.ms2.gz'))
+        self.assertEqual(bgzf.file_format(new_file_path), 'bgzf')
+        self.assertTrue(os.path.exists(new_file_path+bgzf.INDEX_SUFFIX))
+        with bgzf.open(new_file_path, 'rb') as f:
+            self.assertEqual(f.read(), contents)
+        self.assertEqual(datastore.hash_from_path(new_file_path), sha224(contents).hexdigest())
+
+        self.assertEqual(bgzf.file_format(self.save(self.dta_file_string.encode('utf-8'), self.dta_file_name)), 'plain')
+
+    def test_gzip_upload_is_decompressed(self):
+
+        ''' Tests that a gzip-compressed upload ('.ms2.gz') is stored like the same file uploaded uncompressed
+        '''
+
+        contents = self.ms2_file_string.encode('utf-8')
+        new_file_path = self.save(contents, self.ms2_file_name)
+
+        compressed_file_path, original_filename = views_documents.save_new_file(FileStorage(stream=io.BytesIO(gzip.compress(contents)), filename=self.ms2_file_name+'.gz'))
+
+        self.assertEqual(compressed_file_path, new_file_path)
+        self.assertEqual(original_filename, secure_filename(self.ms2_file_name))
+
+class TestDataStore(base.BaseDatasetCreatedTestCase):
+
+    ''' Methods to test the content-addressed data store (Blob refcounts and compaction)
+    '''
+
+    def setUp(self):
+        super().setUp()
+        self.stored_file_path, self.hash_val, _, _ = datastore.put_stream(io.BytesIO(self.ms1_file_string.encode('utf-8')), '.ms1')
+
+    def tearDown(self):
+        for path in (self.stored_file_path, self.stored_file_path+'.dtacache'):
+            if os.path.exists(path):
+                os.remove(path)
+        super().tearDown()
+
+    def test_stored_file_is_sharded(self):
+
+        ''' Tests that stored files are saved in <UPLOAD_FOLDER>/ab/cd/<sha224><ext>
+        '''
+
+        self.assertEqual(self.stored_file_path, os.path.join(app.config['UPLOAD_FOLDER'], self.hash_val[:2], self.hash_val[2:4], self.hash_val+'.ms1'))
+        self.assertEqual(self.hash_val, views_helpers.get_hash(self.stored_file_path))
+
+    def test_records_share_one_blob(self):
+
+        ''' Tests that records for the same stored file reference one Blob, and are counted
+        '''
+
+        ms1file_ids = [views_helpers.save_new_ms1_record(self.dataset_id, self.stored_file_path, original_filename=self.ms1_file_name) for _ in range(2)]
+
+        blob = models.Blob.query.filter_by(sha224=self.hash_val).one()
+        self.assertEqual(blob.refcount, 2)
+        self.assertEqual(sorted(ms1file.id for ms1file in blob.ms1files), sorted(ms1file_ids))
+
+    def test_deleting_and_recovering_changes_refcount(self):
+
+        ''' Tests that "deleting" a record decrements the Blob refcount (once), and recovering increments it
+        '''
+
+        ms1file = models.MS1File.query.get(views_helpers.save_new_ms1_record(self.dataset_id, self.stored_file_path, original_filename=self.ms1_file_name))
+
+        for deleted, refcount in ((True, 0), (True, 0), (False, 1)):
+            datastore.set_deleted(ms1file, deleted)
+            db.session.commit()
+            self.assertEqual(models.Blob.query.filter_by(sha224=self.hash_val).one().refcount, refcount)
+
+    def test_compact_removes_unreferenced_files(self):
+
+        ''' Tests that compact() removes stored files (and sidecars) only used by deleted records
+        '''
+
+        ms1file = models.MS1File.query.get(views_helpers.save_new_ms1_record(self.dataset_id, self.stored_file_path, original_filename=self.ms1_file_name))
+        with open(self.stored_file_path+'.dtacache', 'wb') as f:
+            f.write(b'sidecar')
+
+        self.assertEqual(datastore.compact(), [])
+        self.assertTrue(os.path.exists(self.stored_file_path))
+
+        datastore.set_deleted(ms1file, True)
+        db.session.commit()
+
+        self.assertEqual(datastore.compact(), [(self.hash_val, len(self.ms1_file_string)+len(b'sidecar'))])
+        self.assertFalse(os.path.exists(self.stored_file_path))
+        self.assertFalse(os.path.exists(self.stored_file_path+'.dtacache'))
+        self.assertIsNone(models.MS1File.query.get(ms1file.id).blob_id)
+        self.assertEqual(models.Blob.query.count(), 0)
+
+    def test_backfill_registers_legacy_records(self):
+
+        ''' Tests that records saved before the data store existed (flat file path, no Blob)
+            are moved into the store with their sidecars, and that duplicates are removed
+        '''
+
+        legacy_path = os.path.join(app.config['UPLOAD_FOLDER'], self.hash_val+'.ms1')
+        shutil.copyfile(self.stored_file_path, legacy_path)
+        other_contents = self.ms1_file_string.replace('RAWXtract', 'RawXtract').encode('utf-8')
+        other_hash = sha224(other_contents).hexdigest()
+        other_path = os.path.join(app.config['UPLOAD_FOLDER'], other_hash+'.ms1')
+        with open(other_path, 'wb') as f:
+            f.write(other_contents)
+        with open(other_path+'.dtacache', 'wb') as f:
+            f.write(b'sidecar')
+
+        records = [models.MS1File(file_path, self.dataset_id) for file_path in (legacy_path, other_path, other_path)]
+        db.session.add_all(records)
+        db.session.commit()
+
+        moved_path = datastore.blob_path(other_hash, '.ms1')
+        try:
+            self.assertEqual(sorted(datastore.backfill_blobs()), sorted([(legacy_path, self.stored_file_path), (other_path, moved_path)]))
+
+            self.assertFalse(os.path.exists(legacy_path) or os.path.exists(other_path))
+            self.assertTrue(os.path.exists(moved_path+'.dtacache'))
+            self.assertEqual([models.MS1File.query.get(record.id).file_path for record in records], [self.stored_file_path, moved_path, moved_path])
+            self.assertEqual(models.Blob.query.filter_by(sha224=other_hash).one().refcount, 2)
+            self.assertEqual(models.Blob.query.filter_by(sha224=self.hash_val).one().refcount, 1)
+            self.assertEqual(datastore.backfill_blobs(), [])
+        finally:
+            for path in (legacy_path, other_path, other_path+'.dtacache', moved_path, moved_path+'.dtacache'):
+                if os.path.exists(path):
+                    os.remove(path)
+
+    def test_iter_blob_range(self):
+
+        ''' Tests reading a byte range of a stored file in blocks
+        '''
+
+        contents = self.ms1_file_string.encode('utf-8')
+        self.assertEqual(b''.join(datastore.iter_blob(self.stored_file_path, block_size=7)), contents)
+        self.assertEqual(b''.join(datastore.iter_blob(self.stored_file_path, 10, 50, block_size=7)), contents[10:50])
+
+    def test_compress_blobs(self):
+
+        ''' Tests that compress_blobs() compresses stored files that aren't compressed yet,
+            and points the Blob and its records to the compressed file
+        '''
+
+        ms1file_id = views_helpers.save_new_ms1_record(self.dataset_id, self.stored_file_path, original_filename=self.ms1_file_name)
+        compressed_path = self.stored_file_path+datastore.COMPRESSED_SUFFIX
+
+        try:
+            compressed = datastore.compress_blobs()
+
+            self.assertEqual([(hash_val, size_before) for hash_val, size_before, _ in compressed], [(self.hash_val, len(self.ms1_file_string))])
+            self.assertFalse(os.path.exists(self.stored_file_path))
+            self.assertEqual(models.MS1File.query.get(ms1file_id).file_path, compressed_path)
+            self.assertEqual(models.Blob.query.filter_by(sha224=self.hash_val).one().file_path, compressed_path)
+            with datastore.open_blob(self.hash_val) as f:
+                self.assertEqual(f.read(), self.ms1_file_string.encode('utf-8'))
+
+            self.assertEqual(datastore.compress_blobs(), [])
+        finally:
+            for path in (compressed_path, compressed_path+bgzf.INDEX_SUFFIX):
+                if os.path.exists(path):
+                    os.remove(path)
+
 class FileValidationTests(base.BaseFileSavedTestCase):
 
     def setUp(self):
@@ -150,6 +392,14 @@ class FileValidationTests(base.BaseFileSavedTestCase):
 
         self.assertFalse(views_documents.check_file_types(file_list))
 
+    def test_compressed_filenames(self):
+
+        ''' tests that MS1/MS2/SQT files can be uploaded gzip-compressed (but not DTASelect files)
+        '''
+
+        self.assertTrue(views_documents.check_file_types(('sample.ms2.gz', 'sample.ms1.gz', 'sample.sqt.gz', 'DTASelect-filter.txt')))
+        self.assertFalse(views_documents.check_file_types(('sample.ms2.gz', 'DTASelect-filter.txt.gz')))
+
     def test_sha224_MS1_file_hash(self):
 
         ''' tests that get_hash() function returns the correct hash for an input filepath
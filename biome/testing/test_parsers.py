@@ -0,0 +1,1088 @@
+#!/usr/bin/env python3
+
+import os
+import sys
+import gzip
+import math
+import random
+import pickle
+import shutil
+import tempfile
+import numpy as np
+from biome import ( bgzf,
+                    cache,
+                    ms1,
+                    ms2,
+                    parsers,
+                    sidecar,
+                    sqt,
+                    views_plots,
+                    )
+from biome.testing import base
+
+class LocalCollection():
+
+    ''' In-process stand-in for a pymongo collection (only supports find() with
+        {field: {'$in': [...]}} queries, on scalar or array fields),
+        that counts the queries made against it
+    '''
+
+    def __init__(self, documents):
+        self.documents = documents
+        self.queries = []
+
+    def find(self, query, projection=None):
+        self.queries.append(query)
+        (field, condition), = query.items()
+        values = set(condition['$in'])
+        matches = lambda value: bool(values.intersection(value)) if isinstance(value, list) else value in values
+        return [doc for doc in self.documents if matches(doc.get(field))]
+
+class TestDTASelectColumnar(base.BaseFileSavedTestCase):
+
+    ''' Methods to test the columnar DTASelect-filter.txt parser
+    '''
+
+    def setUp(self):
+        super().setUp()
+        self.tables = parsers.dtaselect_columnar(self.dta_file_path)
+
+    def test_columnar_has_one_row_per_protein_group(self):
+
+        ''' Tests that the columnar parser finds the same 9 protein groups
+            as the row-oriented parser, and that the offsets cover all rows
+        '''
+
+        self.assertEqual(len(self.tables['proteins']['name']), 9)
+        self.assertEqual(len(self.tables['loci_offsets']), 10)
+        self.assertEqual(self.tables['loci_offsets'][-1], len(self.tables['loci']['Locus']))
+        self.assertEqual(self.tables['peptide_offsets'][-1], len(self.tables['peptides']['Sequence']))
+
+    def test_columnar_matches_row_parser(self):
+
+        ''' Tests that loci and peptides of each protein group match dtaselect_json output
+        '''
+
+        for i, protein in enumerate(parsers.dtaselect_json(self.dta_file_path)):
+            start, stop = self.tables['loci_offsets'][i:i+2]
+            self.assertEqual(list(self.tables['loci']['Locus'][start:stop]), protein['all_loci'])
+
+            start, stop = self.tables['peptide_offsets'][i:i+2]
+            self.assertEqual(list(self.tables['peptides']['scan'][start:stop]), [p['scan'] for p in protein['peptides']])
+            self.assertEqual(self.tables['peptides']['Sequence'][start:stop].tolist(), [p['Sequence'] for p in protein['peptides']])
+
+    def test_string_columns(self):
+
+        ''' Tests that text columns are stored as UTF-8 bytes plus offsets (StringColumn),
+            and can be indexed, sliced and concatenated
+        '''
+
+        names = self.tables['loci']['Descriptive Name']
+        self.assertIsInstance(names, parsers.StringColumn)
+        self.assertEqual(names.data.dtype, np.uint8)
+        self.assertNotIn('aa_sequence', self.tables['peptides'])
+
+        column = parsers.StringColumn.from_strings(['K.AM(15.9949)K.L', '', 'β-galactosidase'])
+        self.assertEqual((len(column), column[2], column[-2]), (3, 'β-galactosidase', ''))
+        self.assertEqual(column[1:].tolist(), ['', 'β-galactosidase'])
+        self.assertEqual(parsers.StringColumn.concatenate([column[2:], column[:1]]).tolist(), ['β-galactosidase', 'K.AM(15.9949)K.L'])
+        with self.assertRaises(IndexError):
+            column[3]
+
+    def test_psms_per_lc_step(self):
+
+        ''' Tests vectorized count of distinct PSMs per salt step
+        '''
+
+        lc_steps, counts = views_plots.count_psms_per_lc_step(self.tables['peptides'])
+
+        self.assertEqual(list(lc_steps), [2, 3, 4, 5, 6])
+        self.assertEqual(list(counts), [10, 8, 3, 5, 3])
+
+        # peptides without an LC step aren't counted
+        peptides = {name: np.array(values) for name, values in (('lc_step', [-1, 2, 2]), ('scan', [7, 7, 8]), ('charge_state', [2, 2, 2]))}
+        lc_steps, counts = views_plots.count_psms_per_lc_step(peptides)
+        self.assertEqual((list(lc_steps), list(counts)), ([2], [2]))
+
+class TestDTASelectCache(base.BaseFileSavedTestCase):
+
+    ''' Methods to test the memory-mapped sidecar cache of parsed DTASelect files
+    '''
+
+    def tearDown(self):
+        sidecar_path = self.dta_file_path+cache.DTASELECT_SUFFIX
+        if os.path.exists(sidecar_path):
+            os.remove(sidecar_path)
+        super().tearDown()
+
+    def test_sidecar_is_written_and_reused(self):
+
+        ''' Tests that the first call writes a sidecar file,
+            and that later calls return read-only (memory-mapped) arrays
+        '''
+
+        cache.dtaselect_tables(self.dta_file_path)
+        self.assertTrue(os.path.exists(self.dta_file_path+cache.DTASELECT_SUFFIX))
+
+        tables = cache.dtaselect_tables(self.dta_file_path)
+        self.assertFalse(tables['peptides']['scan'].flags.writeable)
+        self.assertEqual(len(tables['proteins']['name']), 9)
+
+    def test_sidecar_matches_row_parser(self):
+
+        ''' Tests that proteins rebuilt from the sidecar match dtaselect_json output
+        '''
+
+        tables = cache.dtaselect_tables(self.dta_file_path)
+        for cached, parsed in zip(parsers.dtaselect_from_columnar(tables), parsers.dtaselect_json(self.dta_file_path)):
+            self.assertEqual(cached['all_loci'], parsed['all_loci'])
+            self.assertEqual(cached['name'], parsed['name'])
+            self.assertEqual(cached['peptides'], parsed['peptides'])
+
+    def test_sidecar_is_invalidated_when_file_changes(self):
+
+        ''' Tests that a changed DTASelect file isn't served from a stale sidecar
+        '''
+
+        cache.dtaselect_tables(self.dta_file_path)
+
+        # drop the last protein group (6 loci + 2 peptide lines)
+        lines = self.dta_file_string.splitlines(True)
+        footer = lines.index(parsers.DTASELECT_FOOTER)
+        with open(self.dta_file_path, 'w') as f:
+            f.writelines(lines[:footer-8] + lines[footer:])
+
+        self.assertIsNone(cache.load_tables(self.dta_file_path, cache.DTASELECT_SUFFIX))
+        self.assertEqual(len(cache.dtaselect_tables(self.dta_file_path)['proteins']['name']), 8)
+
+    def test_touched_file_is_hashed_once(self):
+
+        ''' Tests that a sidecar is still used after the file's mtime changes (same contents),
+            and that the verified hash is remembered for the new mtime
+        '''
+
+        cache.dtaselect_tables(self.dta_file_path)
+        stat_result = os.stat(self.dta_file_path)
+        os.utime(self.dta_file_path, ns=(stat_result.st_atime_ns, stat_result.st_mtime_ns+10**9))
+
+        self.assertIsNotNone(cache.load_tables(self.dta_file_path, cache.DTASELECT_SUFFIX))
+        self.assertEqual(cache._verified_hashes[self.dta_file_path][1], stat_result.st_mtime_ns+10**9)
+        self.assertIsNotNone(cache.load_tables(self.dta_file_path, cache.DTASELECT_SUFFIX))
+
+class TestDTASelectTokenizer(base.BaseFileSavedTestCase):
+
+    ''' Methods to test the DTASelect-filter.txt tokenizer helpers used by dtaselect_json
+    '''
+
+    def test_peptide_sequence(self):
+
+        ''' Tests that PTMs are stripped from a modified peptide in a single pass
+        '''
+
+        aa_sequence, is_modified, unmod_peptide, diff_mass, mods = parsers._peptide_sequence('K.AM(15.9949)KC(57.0215)L.L')
+
+        self.assertEqual(aa_sequence, 'AM(15.9949)KC(57.0215)L')
+        self.assertTrue(is_modified)
+        self.assertEqual(unmod_peptide, 'AMKCL')
+        self.assertAlmostEqual(diff_mass, 15.9949+57.0215)
+        self.assertEqual(mods, [('M', 2, 15.9949), ('C', 4, 57.0215)])
+
+        self.assertEqual(parsers._peptide_sequence('R.AMKL.L'), ('AMKL', False, 'AMKL', 0, []))
+
+    def test_file_name_info(self):
+
+        ''' Tests salt step/scan/charge parsing of both FileName formats
+        '''
+
+        self.assertEqual(parsers._file_name_info('05282015_lysed_AW_0518_Phe3_4.1364.1364.2'), (4, 1364, 2))
+        self.assertEqual(parsers._file_name_info('05282015_lysed_AW_0518_Phe3_4_150529142251.1364.1364.3'), (4, 1364, 3))
+        self.assertEqual(parsers._file_name_info('lysed_AW.1364.1364.2'), (None, 1364, 2))
+
+    def test_windows_match_single_window(self):
+
+        ''' Tests that reading protein groups in small windows gives the same output
+        '''
+
+        self.assertEqual(list(parsers.dtaselect_json(self.dta_file_path, window=2)),
+                         list(parsers.dtaselect_json(self.dta_file_path)))
+
+    def test_reverse_flag_requires_all_loci(self):
+
+        ''' Tests that a protein group is only flagged reverse if all of its loci are reverse
+        '''
+
+        for protein in parsers.dtaselect_json(self.dta_file_path):
+            self.assertEqual(protein['reverse'], all(l['reverse'] for l in protein['loci']))
+            self.assertEqual(protein['forward_loci'], [l['Locus'] for l in protein['loci'] if not l['reverse']])
+
+class TestDTASelectTaxonomy(base.BaseFileSavedTestCase):
+
+    ''' Methods to test batched taxonomy lookups in dtaselect_json(get_tax=True)
+    '''
+
+    def setUp(self):
+        super().setUp()
+        # every protDB ID in the mock file gets taxID 9606, except for the first protein group
+        self.protdb_ids = [locus for protein in parsers.dtaselect_json(self.dta_file_path) for locus in protein['forward_loci']]
+        self.taxdb = LocalCollection([{'_id': protdb_id, 'taxID': 9606} for protdb_id in self.protdb_ids])
+        self.taxdb.documents[0]['taxID'] = 10090
+        self.taxdb.documents.append({'_id': 1, 'taxID': 1})
+        self.lca_calls = []
+
+    def lca(self, tax_ids):
+        self.lca_calls.append(tax_ids)
+        return min(tax_ids)
+
+    def test_tax_ids_are_looked_up_in_bulk(self):
+
+        ''' Tests that taxIDs for all protein groups in a window are found with a single query
+        '''
+
+        proteins = list(parsers.dtaselect_json(self.dta_file_path, get_tax=True, taxdb=self.taxdb, lca=self.lca))
+
+        self.assertEqual(len(self.taxdb.queries), 1)
+        self.assertEqual(proteins[0]['tax_id'], [9606, 10090])
+        self.assertEqual(proteins[0]['lca'], 9606)
+        self.assertEqual(proteins[1]['tax_id'], [9606])
+        self.assertEqual(proteins[1]['LCA'], 9606)
+
+    def test_lca_is_memoized(self):
+
+        ''' Tests that LCA is computed once per distinct set of taxIDs, also across windows
+        '''
+
+        list(parsers.dtaselect_json(self.dta_file_path, get_tax=True, taxdb=self.taxdb, lca=self.lca, window=2))
+
+        self.assertEqual(len(self.taxdb.queries), 5)
+        self.assertEqual(self.lca_calls, [[9606, 10090], [9606]])
+
+    def test_protein_without_tax_ids(self):
+
+        ''' Tests that proteins without taxDB entries get an empty tax_id and no LCA
+        '''
+
+        self.taxdb.documents = []
+        for protein in parsers.dtaselect_json(self.dta_file_path, get_tax=True, taxdb=self.taxdb, lca=self.lca):
+            self.assertEqual(protein['tax_id'], [])
+            self.assertIsNone(protein['lca'])
+
+class TestDTASelectCheckPeptides(base.BaseFileSavedTestCase):
+
+    ''' Methods to test bulk peptide-in-protein checks in dtaselect_json(check_peptides=True)
+    '''
+
+    def setUp(self):
+        super().setUp()
+        # every forward locus gets a sequence made of all (unmodified) peptides of its protein group
+        documents = []
+        for protein in parsers.dtaselect_json(self.dta_file_path):
+            sequence = 'M' + 'G'.join(p.get('unmod_peptide', p['aa_sequence']) for p in protein['peptides'])
+            documents.extend({'_id': locus, 'd': 'protein {}'.format(locus), 's': sequence} for locus in protein['forward_loci'])
+        self.protdb = LocalCollection(documents)
+
+    def test_peptide_matcher(self):
+
+        ''' Tests that one pattern finds overlapping peptides, and peptides contained in other peptides
+        '''
+
+        pattern, peptides = parsers._peptide_matcher(['PEPT', 'TIDE', 'PEP', 'EPTIDE', 'KR'])
+
+        self.assertEqual(peptides, {'PEPT', 'EPTIDE', 'KR'})
+        self.assertEqual(set(pattern.findall('MPEPTIDEKR')), peptides)
+        self.assertEqual(set(pattern.findall('MPEPTIDE')), {'PEPT', 'EPTIDE'})
+
+    def test_sequences_are_prefetched_in_bulk(self):
+
+        ''' Tests that protDB is queried once per window, and that all peptides are found
+        '''
+
+        proteins = list(parsers.dtaselect_json(self.dta_file_path, check_peptides=True, protdb=self.protdb))
+
+        self.assertEqual(len(self.protdb.queries), 1)
+        self.assertTrue(all(protein['all_peptides_in_proteins'] for protein in proteins))
+        self.assertEqual([doc['_id'] for doc in proteins[0]['protDB']], proteins[0]['forward_loci'])
+
+    def test_mismatches_are_reported(self):
+
+        ''' Tests that a missing peptide or a missing protDB sequence fails the check
+        '''
+
+        # first protein group: a sequence is missing a peptide, second protein group: not in protDB
+        self.protdb.documents[0]['s'] = 'MKR'
+        del self.protdb.documents[2]
+
+        proteins = list(parsers.dtaselect_json(self.dta_file_path, check_peptides=True, protdb=self.protdb, window=4))
+
+        self.assertEqual(len(self.protdb.queries), 3)
+        self.assertEqual([i for i, protein in enumerate(proteins) if not protein['all_peptides_in_proteins']], [0, 1])
+
+class TestDTASelectHashes(base.BaseFileSavedTestCase):
+
+    ''' Methods to test batched redundancy hash lookups in dtaselect_json(get_hashes=True)
+    '''
+
+    def setUp(self):
+        super().setUp()
+        # one hash per protein group (all forward loci are redundant), except for the last group
+        self.proteins = list(parsers.dtaselect_json(self.dta_file_path))
+        documents = [{'_id': 'hash{}'.format(i), 'pID': protein['forward_loci']} for i, protein in enumerate(self.proteins[:-1])]
+        documents.append({'_id': 'hashA', 'pID': self.proteins[-1]['forward_loci'][:2]})
+        documents.append({'_id': 'hashB', 'pID': self.proteins[-1]['forward_loci'][2:]})
+        self.redundb = LocalCollection(documents)
+        self.hash_cache = parsers.LRUCache(100)
+
+    def parse(self, **kwargs):
+        return list(parsers.dtaselect_json(self.dta_file_path, get_hashes=True, redundb=self.redundb, hash_cache=self.hash_cache, **kwargs))
+
+    def test_hashes_are_looked_up_in_bulk(self):
+
+        ''' Tests that hashes for all protein groups in a window are found with a single query
+        '''
+
+        proteins = self.parse()
+
+        self.assertEqual(len(self.redundb.queries), 1)
+        self.assertEqual([protein['hashes'] for protein in proteins[:2]], [['hash0'], ['hash1']])
+        self.assertEqual(proteins[-1]['hashes'], ['hashA', 'hashB'])
+
+    def test_hash_cache_is_shared_between_files(self):
+
+        ''' Tests that a second parse is served from the pID -> hash cache (including pIDs without a hash)
+        '''
+
+        self.redundb.documents.pop(0)
+        first = self.parse()
+        second = self.parse()
+
+        self.assertEqual(len(self.redundb.queries), 1)
+        self.assertEqual(first, second)
+        self.assertEqual(second[0]['hashes'], [])
+
+    def test_lru_cache_is_bounded(self):
+
+        ''' Tests that the least recently used keys are evicted first
+        '''
+
+        hash_cache = parsers.LRUCache(2)
+        hash_cache[1] = 'a'
+        hash_cache[2] = 'b'
+        hash_cache.get(1)
+        hash_cache[3] = 'c'
+
+        self.assertEqual(len(hash_cache), 2)
+        self.assertNotIn(2, hash_cache)
+        self.assertEqual(hash_cache.get(1), 'a')
+
+class TestDTASelectFiles(base.BaseFileSavedTestCase):
+
+    ''' Methods to test parsing several DTASelect-filter.txt files in a process pool
+    '''
+
+    def setUp(self):
+        super().setUp()
+        # second file: the mock file without its last protein group (6 loci + 2 peptide lines)
+        lines = self.dta_file_string.splitlines(True)
+        footer = lines.index(parsers.DTASELECT_FOOTER)
+        fd, self.second_file_path = tempfile.mkstemp(suffix='DTASelect-filter.txt')
+        with os.fdopen(fd, 'w') as f:
+            f.writelines(lines[:footer-8] + lines[footer:])
+        self.file_paths = [self.dta_file_path, self.second_file_path, self.dta_file_path]
+
+    def tearDown(self):
+        os.remove(self.second_file_path)
+        super().tearDown()
+
+    def test_files_are_parsed_in_order(self):
+
+        ''' Tests that pooled parsing returns one protein list per file, in the order of the files
+        '''
+
+        results = parsers.dtaselect_files(self.file_paths, processes=2, small=True)
+
+        self.assertEqual([len(proteins) for proteins in results], [9, 8, 9])
+        self.assertEqual(results[1], list(parsers.dtaselect_json(self.second_file_path, small=True)))
+
+    def test_columnar_files_are_merged(self):
+
+        ''' Tests that merged columnar tables (and their offsets) cover the tables of each file
+        '''
+
+        merged = parsers.dtaselect_files(self.file_paths, columnar=True, processes=2)
+        second = parsers.dtaselect_columnar(self.second_file_path)
+
+        self.assertEqual(list(merged['file_offsets']), [0, 9, 17, 26])
+        self.assertEqual(merged['loci_offsets'][-1], len(merged['loci']['Locus']))
+        self.assertEqual(merged['peptide_offsets'][-1], len(merged['peptides']['Sequence']))
+        self.assertEqual(merged['mod_offsets'][-1], len(merged['mods']['AA']))
+
+        # proteins of the second file, rebuilt from the merged tables
+        start, stop = merged['file_offsets'][1:3]
+        from_merged = list(parsers.dtaselect_from_columnar(merged))[start:stop]
+        self.assertEqual(from_merged, list(parsers.dtaselect_from_columnar(second)))
+
+class TestDTASelectIndex(base.BaseFileSavedTestCase):
+
+    ''' Methods to test paged DTASelect parsing with a byte-offset index of protein groups
+    '''
+
+    def tearDown(self):
+        sidecar_path = self.dta_file_path+cache.DTASELECT_INDEX_SUFFIX
+        if os.path.exists(sidecar_path):
+            os.remove(sidecar_path)
+        super().tearDown()
+
+    def test_group_offsets(self):
+
+        ''' Tests that each offset points at the first locus line of a protein group
+        '''
+
+        group_offsets = parsers.dtaselect_group_offsets(self.dta_file_path)
+        proteins = list(parsers.dtaselect_json(self.dta_file_path))
+
+        self.assertEqual(len(group_offsets), len(proteins)+1)
+        with open(self.dta_file_path, 'rb') as f:
+            for offset, protein in zip(group_offsets, proteins):
+                f.seek(offset)
+                self.assertTrue(f.readline().decode('utf-8').startswith(str(protein['all_loci'][0])))
+            f.seek(group_offsets[-1])
+            self.assertEqual(f.readline().decode('utf-8'), parsers.DTASELECT_FOOTER)
+
+    def test_paged_parsing(self):
+
+        ''' Tests that parsing a page of protein groups (with or without the index) gives the same protein groups
+        '''
+
+        proteins = list(parsers.dtaselect_json(self.dta_file_path))
+        group_offsets = cache.dtaselect_index(self.dta_file_path)
+
+        for start, stop in ((0, 3), (2, 5), (7, 20), (9, 10), (20, None)):
+            self.assertEqual(list(parsers.dtaselect_json(self.dta_file_path, start=start, stop=stop, group_offsets=group_offsets)), proteins[start:stop])
+            self.assertEqual(list(parsers.dtaselect_json(self.dta_file_path, start=start, stop=stop)), proteins[start:stop])
+
+        tables = parsers.dtaselect_columnar(self.dta_file_path)
+        self.assertEqual(list(parsers.dtaselect_from_columnar(tables, start=2, stop=5)), proteins[2:5])
+
+class TestDTASelectFilters(base.BaseFileSavedTestCase):
+
+    ''' Methods to test protein group/peptide filters in dtaselect_json and dtaselect_columnar
+    '''
+
+    def parse_loci(self, **filters):
+        return [protein['all_loci'][0] for protein in parsers.dtaselect_json(self.dta_file_path, **filters)]
+
+    def test_count_filters(self):
+
+        ''' Tests minimum spectrum count and minimum sequence count filters
+        '''
+
+        self.assertEqual(self.parse_loci(min_spectrum_count=20), [61472780, 14410537, 61499498, 61500308, 61497412])
+        self.assertEqual(self.parse_loci(min_sequence_count=4), [61472780, 18932601, 61500308, 61497412])
+        self.assertEqual(self.parse_loci(min_spectrum_count=20, min_sequence_count=4), [61472780, 61500308, 61497412])
+
+    def test_loci_filter(self):
+
+        ''' Tests that protein groups are kept if any of their loci is in the set
+        '''
+
+        self.assertEqual(self.parse_loci(loci={14410537, 72194197}), [14410537, 22187885])
+        self.assertEqual(self.parse_loci(loci=[]), [])
+
+    def test_lc_step_filter(self):
+
+        ''' Tests that only peptides from the salt step range are kept
+        '''
+
+        proteins = list(parsers.dtaselect_json(self.dta_file_path, lc_steps=(6, 6)))
+
+        self.assertEqual([protein['all_loci'][0] for protein in proteins], [18932601, 61497412])
+        self.assertTrue(all(p['lc_step'] == 6 for protein in proteins for p in protein['peptides']))
+
+    def test_columnar_filters(self):
+
+        ''' Tests that dtaselect_columnar applies the same filters
+        '''
+
+        filters = {'min_spectrum_count': 18, 'lc_steps': (3, 5)}
+        tables = parsers.dtaselect_columnar(self.dta_file_path, **filters)
+
+        self.assertEqual(list(parsers.dtaselect_from_columnar(tables)), list(parsers.dtaselect_json(self.dta_file_path, **filters)))
+
+class TestDTASelectRecords(base.BaseFileSavedTestCase):
+
+    ''' Methods to test the compact Locus/Peptide records returned by dtaselect_json
+    '''
+
+    def setUp(self):
+        super().setUp()
+        self.proteins = list(parsers.dtaselect_json(self.dta_file_path))
+        self.peptides = [p for protein in self.proteins for p in protein['peptides']]
+
+    def test_dict_style_access(self):
+
+        ''' Tests that records work like the dicts they replace (including alias keys)
+        '''
+
+        peptide = self.peptides[0]
+
+        self.assertEqual(peptide['FileName'].split('.')[1], str(peptide['scan']))
+        self.assertEqual(peptide['LCStep'], peptide.lc_step)
+        self.assertEqual(peptide['AA_Sequence'], peptide['aa_sequence'])
+        self.assertEqual(peptide.get('not a field', 'default'), 'default')
+        self.assertEqual(set(dict(peptide)), set(peptide.keys()))
+        self.assertIn('isModified', peptide)
+        with self.assertRaises(KeyError):
+            peptide['not a field']
+
+        locus = self.proteins[0]['loci'][0]
+        self.assertEqual(locus['Locus'], 61472780)
+        self.assertFalse(locus['reverse'])
+
+    def test_modified_only_keys(self):
+
+        ''' Tests that unmod_peptide/diff_mass/mods are only keys of modified peptides
+        '''
+
+        for peptide in self.peptides:
+            self.assertEqual('mods' in peptide, peptide['is_modified'])
+            self.assertEqual(peptide.get('unmod_peptide') is not None, peptide['is_modified'])
+
+    def test_records_are_compact(self):
+
+        ''' Tests that records don't have a per-record dict, and are smaller than the dicts they replace
+        '''
+
+        peptide = self.peptides[0]
+
+        self.assertFalse(hasattr(peptide, '__dict__'))
+        self.assertLess(sys.getsizeof(peptide) + sys.getsizeof(peptide._values), sys.getsizeof(dict(peptide)) / 2)
+        self.assertIs(peptide._columns, self.peptides[-1]._columns)
+
+    def test_records_can_be_pickled(self):
+
+        ''' Tests that records survive pickling (e.g. results from the dtaselect_files process pool)
+        '''
+
+        self.assertEqual(pickle.loads(pickle.dumps(self.proteins)), self.proteins)
+
+class TestDTASelectSummary(base.BaseFileSavedTestCase):
+
+    ''' Methods to test reading the summary tables at the end of DTASelect-filter.txt files
+    '''
+
+    def test_summary(self):
+
+        ''' Tests all summary rows of the mock file, read with a small block size (several reads from the end)
+        '''
+
+        summary = parsers.dtaselect_summary(self.dta_file_path, block_size=64)
+
+        self.assertEqual(summary, parsers.dtaselect_summary(self.dta_file_path))
+        self.assertEqual(summary['unfiltered'], {'proteins': 311583, 'peptide_ids': 60554, 'spectra': 1042696})
+        self.assertEqual(summary['filtered'], {'proteins': 141, 'peptide_ids': 375, 'spectra': 2262})
+        self.assertEqual(summary['redundant_decoy_matches']['proteins'], 3)
+        self.assertEqual(summary['forward_fdr']['spectra'], 0.44)
+        self.assertEqual(summary['classification'], {'unclassified': {'nonredundant_proteins': 0, 'redundant_proteins': 0}})
+
+    def test_missing_summary(self):
+
+        ''' Tests that a file without a summary table gives None
+        '''
+
+        with open(self.dta_file_path, 'w') as f:
+            f.write(self.dta_file_string[:self.dta_file_string.index(parsers.DTASELECT_FOOTER)])
+
+        self.assertIsNone(parsers.dtaselect_summary(self.dta_file_path, block_size=64))
+
+class TestMS2ScanIndex(base.BaseFileSavedTestCase):
+
+    ''' Methods to test indexing the scans of MS2 files
+    '''
+
+    def tearDown(self):
+        sidecar_path = self.ms2_file_path+cache.MS2_INDEX_SUFFIX
+        if os.path.exists(sidecar_path):
+            os.remove(sidecar_path)
+        super().tearDown()
+
+    def test_scan_index(self):
+
+        ''' Tests the indexed scan fields, and that the byte ranges cover each scan exactly
+        '''
+
+        index = ms2.scan_index(self.ms2_file_path)
+        scans = index['scans']
+        blocks = ['S\t'+block for block in self.ms2_file_string.split('S\t')[1:]]
+
+        self.assertEqual(scans['scan'].tolist(), [13, 40, 68, 95])
+        self.assertEqual(scans['precursor_mz'].tolist(), [1261.62732, 960.22797, 966.47314, 1188.09790])
+        self.assertEqual(scans['retention_time'].tolist(), [0.08, 0.25, 0.43, 0.60])
+        self.assertEqual(index['charges']['charge'].tolist(), [3, 4, 3, 2])
+        self.assertEqual(index['charge_offsets'].tolist(), [0, 1, 2, 3, 4])
+        self.assertEqual(scans['peak_count'].tolist(), [sum(line[:1].isdigit() for line in block.splitlines()) for block in blocks])
+
+        with open(self.ms2_file_path, 'rb') as f:
+            for offset, length, block in zip(scans['offset'], scans['length'], blocks):
+                f.seek(offset)
+                self.assertEqual(f.read(length).decode('utf-8'), block)
+
+        summary = parsers.ms2_summary(index)
+        self.assertEqual(summary['scans'], parsers.count_scans(self.ms2_file_path))
+        self.assertEqual((summary['first_scan'], summary['last_scan']), (13, 95))
+        self.assertEqual(summary['retention_time'], [0.08, 0.60])
+        self.assertEqual(summary['peaks'], int(scans['peak_count'].sum()))
+
+    def test_multiple_charges(self):
+
+        ''' Tests a scan with several Z lines (and one without RetTime)
+        '''
+
+        with open(self.ms2_file_path, 'w') as f:
+            f.write('H\tExtractor\tRAWXtract\nS\t1\t1\t500.5\nZ\t2\t1000.0\nZ\t3\t1499.5\n100.1 5.0 0\nS\t2\t2\t600.0\nZ\t2\t1199.0\n')
+
+        index = cache.ms2_scan_index(self.ms2_file_path)
+
+        self.assertEqual(index['charges']['charge'].tolist(), [2, 3, 2])
+        self.assertEqual(index['charge_offsets'].tolist(), [0, 2, 3])
+        self.assertEqual(index['scans']['peak_count'].tolist(), [1, 0])
+        self.assertTrue(all(map(math.isnan, index['scans']['retention_time'])))
+        self.assertIsNone(parsers.ms2_summary(index)['retention_time'])
+        self.assertTrue(os.path.exists(self.ms2_file_path+cache.MS2_INDEX_SUFFIX))
+
+    def test_scan_lookup(self):
+
+        ''' Tests finding scans by scan number (not in file order), and parsing them from the memory-mapped file
+        '''
+
+        with open(self.ms2_file_path, 'w') as f:
+            f.write('S\t7\t7\t500.5\nI\tRetTime\t1.5\nZ\t2\t1000.0\n100.1 5.0 0\n200.2 6.0\nS\t3\t3\t600.0\nZ\t2\t1199.0\n')
+
+        index = ms2.scan_index(self.ms2_file_path)
+        self.assertEqual(ms2.scan_rows(index, [3, 7, 5, 100]), [1, 0, None, None])
+
+        scan_7, scan_5 = cache.ms2_scans(self.ms2_file_path, [7, 5])
+        self.assertEqual(scan_7, {'scan': 7, 'precursor_mz': 500.5, 'retention_time': 1.5,
+                                  'charges': [{'charge': 2, 'mh': 1000.0}],
+                                  'peaks': {'mz': [100.1, 200.2], 'intensity': [5.0, 6.0]}})
+        self.assertIsNone(scan_5)
+
+class TestMS2Reader(base.BaseFileSavedTestCase):
+
+    ''' Methods to test the vectorized MS2 reader (batches of scans with NumPy peak arrays)
+    '''
+
+    def test_batches(self):
+
+        ''' Tests that batches (of any size, from any read size) hold the same scans and peaks as the text file
+        '''
+
+        index = ms2.scan_index(self.ms2_file_path)
+        peak_lines = [line.split() for line in self.ms2_file_string.splitlines() if line[:1].isdigit()]
+
+        for batch_size in (1, 3, 1000):
+            batches = list(ms2.read_batches(self.ms2_file_path, batch_size=batch_size))
+            self.assertEqual([len(batch['scans']['scan']) for batch in batches][0], min(batch_size, 4))
+
+            scans = ms2.concatenate_batches(batches)
+            self.assertEqual(scans['scans']['scan'].tolist(), index['scans']['scan'].tolist())
+            self.assertEqual(scans['scans']['retention_time'].tolist(), index['scans']['retention_time'].tolist())
+            self.assertEqual(scans['scans']['charge'].tolist(), [3, 4, 3, 2])
+            self.assertEqual(np.diff(scans['peak_offsets']).tolist(), index['scans']['peak_count'].tolist())
+            self.assertEqual(scans['mz'].tolist(), [float(line[0]) for line in peak_lines])
+            self.assertEqual(scans['intensity'].dtype, np.float32)
+
+        with open(self.ms2_file_path, 'rb') as f:
+            blocks = list(ms2.scan_blocks(f, read_size=7))
+        self.assertEqual([offset for offset, _ in blocks], index['scans']['offset'].tolist())
+        self.assertEqual([len(block) for _, block in blocks], index['scans']['length'].tolist())
+
+    def test_split_file(self):
+
+        ''' Tests that chunks have the H lines and consecutive scans (from a plain or compressed file,
+            or from the scan index), and are numbered in scan order
+        '''
+
+        header = 'H\tExtractor\tRAWXtract\nH\tFirstScan\t13\n'
+        with open(self.ms2_file_path, 'w') as f:
+            f.write(header+self.ms2_file_string)
+        bgzf.compress_file(self.ms2_file_path, self.ms2_file_path+'.gz')
+
+        index = ms2.scan_index(self.ms2_file_path)
+        offsets = ms2.index_offsets(index['scans'])
+        with open(self.ms2_file_path, 'rb') as f:
+            self.assertEqual(ms2.scan_offsets(f, read_size=5).tolist(), offsets.tolist())
+
+        # (as read by the Celery worker, without the Flask app)
+        cache.ms2_scan_index(self.ms2_file_path)
+        source, arrays = sidecar.read_arrays(self.ms2_file_path+ms2.INDEX_SUFFIX)
+        self.assertTrue(sidecar.is_current(source, self.ms2_file_path))
+        self.assertEqual(ms2.index_offsets({'offset': arrays['scans/offset'], 'length': arrays['scans/length']}).tolist(), offsets.tolist())
+        os.remove(self.ms2_file_path+ms2.INDEX_SUFFIX)
+
+        out_dir = tempfile.mkdtemp()
+        try:
+            for in_file, scan_offsets in ((self.ms2_file_path, None), (self.ms2_file_path+'.gz', None), (self.ms2_file_path, offsets)):
+                chunk_paths = ms2.split_file(in_file, 10, os.path.join(out_dir, 'sample_{}.ms2'), offsets=scan_offsets)
+
+                self.assertEqual([os.path.basename(path) for path in chunk_paths], ['sample_{:02d}.ms2'.format(i) for i in range(1, 5)])
+                self.assertEqual([ms2.scan_index(path)['scans']['scan'].tolist() for path in chunk_paths], [[13], [40], [68], [95]])
+                chunks = []
+                for path in chunk_paths:
+                    with open(path) as f:
+                        chunks.append(f.read())
+                self.assertTrue(all(chunk.startswith(header) for chunk in chunks))
+                self.assertEqual(''.join(chunk[len(header):] for chunk in chunks), self.ms2_file_string)
+
+            chunk_paths = ms2.split_file(self.ms2_file_path, 3, os.path.join(out_dir, 'sample_{}.ms2'))
+            self.assertEqual([len(ms2.scan_index(path)['scans']['scan']) for path in chunk_paths], [1, 1, 2])
+        finally:
+            shutil.rmtree(out_dir)
+            for path in (self.ms2_file_path+'.gz', self.ms2_file_path+'.gz'+bgzf.INDEX_SUFFIX):
+                os.remove(path)
+
+    def test_irregular_peak_lines(self):
+
+        ''' Tests header lines, scans without peaks, peak lines with two or three columns, and CRLF line ends
+        '''
+
+        with open(self.ms2_file_path, 'wb') as f:
+            f.write(b'H\tExtractor\tRAWXtract\r\nS\t1\t1\t500.5\r\nZ\t2\t1000.0\r\n100.1 5.0 0\r\n200.2 6.0\r\n'
+                    b'S\t2\t2\t600.0\r\nI\tRetTime\t1.25\r\n')
+
+        scans = ms2.read_file(self.ms2_file_path, mz_dtype=np.float32)
+
+        self.assertEqual(scans['scans']['scan'].tolist(), [1, 2])
+        self.assertEqual(scans['scans']['charge'].tolist(), [2, 0])
+        self.assertEqual(scans['scans']['retention_time'][1], 1.25)
+        self.assertEqual(scans['peak_offsets'].tolist(), [0, 2, 2])
+        self.assertEqual(scans['mz'].dtype, np.float32)
+        self.assertEqual(scans['intensity'].tolist(), [5.0, 6.0])
+
+class TestMS1Chromatograms(base.BaseFileSavedTestCase):
+
+    ''' Methods to test the MS1 reader, TIC/base peak chromatograms and XICs
+    '''
+
+    def tearDown(self):
+        for suffix in (cache.MS1_CHROMATOGRAM_SUFFIX, cache.MS1_XIC_INDEX_SUFFIX):
+            if os.path.exists(self.ms1_file_path+suffix):
+                os.remove(self.ms1_file_path+suffix)
+        super().tearDown()
+
+    def test_chromatograms(self):
+
+        ''' Tests TIC/base peak of each scan against the text file (with batches of 1 and 2 scans)
+        '''
+
+        scans = [block.splitlines() for block in self.ms1_file_string.split('S\t')[1:]]
+        peaks = [np.array([line.split()[:2] for line in scan[1:] if line[:1].isdigit()], dtype=np.float64) for scan in scans]
+
+        for batch_size in (1, 2):
+            chromatograms = ms1.chromatograms(self.ms1_file_path, batch_size=batch_size)
+
+            self.assertEqual(chromatograms['scan'].tolist(), [int(scan[0].split('\t')[0]) for scan in scans])
+            np.testing.assert_allclose(chromatograms['tic'], [scan_peaks[:, 1].sum() for scan_peaks in peaks], rtol=1e-5) # (float32 intensities)
+            np.testing.assert_allclose(chromatograms['base_peak_intensity'], [scan_peaks[:, 1].max() for scan_peaks in peaks], rtol=1e-5)
+            self.assertEqual(chromatograms['base_peak_mz'].tolist(), [scan_peaks[scan_peaks[:, 1].argmax(), 0] for scan_peaks in peaks])
+
+        self.assertEqual(cache.ms1_chromatograms(self.ms1_file_path)['tic'].tolist(), chromatograms['tic'].tolist())
+
+    def test_scans_without_peaks(self):
+
+        ''' Tests that scans without peaks have zero TIC, and ties give the first base peak
+        '''
+
+        with open(self.ms1_file_path, 'w') as f:
+            f.write('S\t1\t1\nI\tRetTime\t0.5\n100.0 5.0 0\n200.0 7.0 0\n300.0 7.0 0\nS\t2\t2\nS\t3\t3\n400.0 1.0 0\n')
+
+        chromatograms = ms1.chromatograms(self.ms1_file_path)
+
+        self.assertEqual(chromatograms['tic'].tolist(), [19.0, 0.0, 1.0])
+        self.assertEqual(chromatograms['base_peak_mz'].tolist(), [200.0, 0.0, 400.0])
+        self.assertEqual(chromatograms['retention_time'][0], 0.5)
+        self.assertTrue(math.isnan(chromatograms['retention_time'][1]))
+
+    def test_xic(self):
+
+        ''' Tests XICs (from the memory-mapped index) against summing matching peaks of the text file
+        '''
+
+        scans = [block.splitlines() for block in self.ms1_file_string.split('S\t')[1:]]
+        retention_times = [float(line.split('\t')[2]) for scan in scans for line in scan if line.startswith('I\tRetTime')]
+        peaks = [[tuple(map(float, line.split()[:2])) for line in scan[1:] if line[:1].isdigit()] for scan in scans]
+
+        self.assertIsNone(cache.ms1_xic_index(self.ms1_file_path)) # (only built by the ingest job)
+        cache.build_ms1_sidecars(self.ms1_file_path)
+        index = cache.ms1_xic_index(self.ms1_file_path)
+        for mz, _ in peaks[0][::7]:
+            for ppm in (1, 50):
+                expected = [sum(np.float32(intensity) for peak_mz, intensity in scan_peaks if abs(peak_mz - mz) <= mz*ppm/1e6) for scan_peaks in peaks]
+                np.testing.assert_allclose(ms1.xic(index, mz, ppm=ppm)['intensity'], expected)
+
+        chromatogram = ms1.xic(index, peaks[0][0][0], rt_start=retention_times[1], rt_end=retention_times[1])
+        self.assertEqual(chromatogram['retention_time'].tolist(), retention_times[1:2])
+        self.assertEqual(len(ms1.xic(index, peaks[0][0][0], rt_start=1e6)['scan']), 0)
+
+    def test_xic_index_sorts_scans_and_peaks(self):
+
+        ''' Tests that scans out of retention time order, and peaks out of m/z order, are sorted in the index
+            (within one batch, and across batches), and that chromatograms keep the file's scan order
+        '''
+
+        with open(self.ms1_file_path, 'w') as f:
+            f.write('S\t2\t2\nI\tRetTime\t2.0\n300.0 1.0 0\n100.0 2.0 0\nS\t3\t3\nI\tRetTime\t3.0\nS\t1\t1\nI\tRetTime\t1.0\n200.0 4.0 0\n200.001 8.0 0\n')
+
+        for batch_size in (1, 2, 3):
+            cache.build_ms1_sidecars(self.ms1_file_path, batch_size=batch_size)
+            index = cache.ms1_xic_index(self.ms1_file_path)
+
+            self.assertEqual(index['scans']['scan'].tolist(), [1, 2, 3])
+            self.assertEqual(index['mz'].tolist(), [200.0, 200.001, 100.0, 300.0])
+            self.assertEqual(index['intensity'].tolist(), [4.0, 8.0, 2.0, 1.0])
+            self.assertEqual(index['peak_offsets'].tolist(), [0, 2, 4, 4])
+            self.assertEqual(ms1.xic(index, 200.0, ppm=10)['intensity'].tolist(), [12.0, 0.0, 0.0])
+            self.assertEqual(ms1.xic(index, 100.0, ppm=1, rt_start=1.5)['intensity'].tolist(), [2.0, 0.0])
+            self.assertEqual(cache.ms1_chromatograms(self.ms1_file_path)['scan'].tolist(), [2, 3, 1])
+
+class TestSQTReader(base.BaseFileSavedTestCase):
+
+    ''' Methods to test the streaming columnar SQT reader
+    '''
+
+    def test_tables(self):
+
+        ''' Tests S/M/L tables and offsets against the text file (with batches of 1, 2 and all spectra)
+        '''
+
+        lines = [line.split('\t') for line in self.sqt_file_string.splitlines()]
+        m_lines = [line for line in lines if line[0] == 'M']
+        l_lines = [line for line in lines if line[0] == 'L']
+
+        for batch_size in (1, 2, sqt.BATCH_SIZE):
+            tables = sqt.read_file(self.sqt_file_path, batch_size=batch_size)
+
+            self.assertEqual(tables['spectra']['low_scan'].tolist(), [810, 315, 563])
+            self.assertEqual(tables['spectra']['charge'].tolist(), [4, 3, 2])
+            self.assertEqual(tables['matches']['xcorr'].tolist(), [float(line[5]) for line in m_lines])
+            self.assertEqual(tables['matches']['sequence'].tolist(), [line[9] for line in m_lines])
+            self.assertEqual(tables['loci']['locus'].tolist(), [line[1] for line in l_lines])
+            self.assertEqual(tables['match_offsets'].tolist(), [0, 5, 10, 15])
+            self.assertEqual(tables['locus_offsets'].tolist()[-1], len(l_lines))
+            self.assertEqual(tables['loci']['locus'][tables['locus_offsets'][5]:tables['locus_offsets'][6]].tolist(), [line[1] for line in l_lines[5:6]])
+
+        self.assertEqual(sqt.match_spectra(tables).tolist(), [0]*5 + [1]*5 + [2]*5)
+
+    def test_top_n(self):
+
+        ''' Tests keeping only the best match (and its loci) of each spectrum
+        '''
+
+        tables = sqt.read_file(self.sqt_file_path, top_n=1)
+
+        self.assertEqual(tables['matches']['xcorr_rank'].tolist(), [1, 1, 1])
+        self.assertEqual(tables['match_offsets'].tolist(), [0, 1, 2, 3])
+        self.assertEqual(np.diff(tables['locus_offsets']).tolist(), [1, 1, 4])
+        self.assertTrue(tables['loci']['locus'][1].startswith('Reverse_SZEY-60A_GL0067347'))
+
+    def test_irregular_lines(self):
+
+        ''' Tests lines with missing trailing fields (and H lines, CRLF line ends)
+        '''
+
+        with open(self.sqt_file_path, 'w', newline='') as f:
+            f.write('H\tSQTGenerator\tBlazmass\r\nS\t5\t5\t2\t10\tserver\t1000.5\t88.0\t1.0E-6\t12\r\n'
+                    'M\t1\t1\t1000.4\t0.0\t2.5\t8.0\t10\t20\t-.PEPTIDE.-\r\nL\tgi|1\r\nL\tgi|2\t0\tK.PEPTIDE.R\r\n')
+
+        tables = sqt.read_file(self.sqt_file_path)
+
+        self.assertEqual(tables['spectra']['sequence_matches'].tolist(), [12])
+        self.assertEqual(tables['matches']['sequence'].tolist(), ['-.PEPTIDE.-'])
+        self.assertEqual(tables['matches']['validation'].tolist(), [''])
+        self.assertEqual(tables['loci']['locus'].tolist(), ['gi|1', 'gi|2'])
+        self.assertEqual(tables['loci']['peptide'].tolist(), ['', 'K.PEPTIDE.R'])
+
+class TestFileMetadata(base.BaseFileSavedTestCase):
+
+    ''' Methods to test the header/summary information extracted from uploaded files
+    '''
+
+    def tearDown(self):
+        for suffix in (cache.MS1_CHROMATOGRAM_SUFFIX, cache.MS1_XIC_INDEX_SUFFIX):
+            if os.path.exists(self.ms1_file_path+suffix):
+                os.remove(self.ms1_file_path+suffix)
+        super().tearDown()
+
+    def test_ms1_summary(self):
+
+        ''' Tests H line headers (repeated keys joined), instrument and scan/RT ranges of the MS1 file
+        '''
+
+        headers = parsers.file_headers(self.ms1_file_path)
+        self.assertEqual(headers['Extractor'], 'RAWXtract')
+        self.assertEqual(headers['Resolution'], '')
+        self.assertEqual(headers['Comments'], 'RawXtract written by John Venable, 2003; RawXtract modified by Tao Xu, 2007')
+
+        chromatograms = ms1.chromatograms(self.ms1_file_path)
+        summary = parsers.ms1_summary(chromatograms, headers)
+        self.assertEqual(summary['scans'], self.ms1_file_string.count('\nS\t'))
+        self.assertEqual((summary['first_scan'], summary['last_scan']), (chromatograms['scan'][0], chromatograms['scan'][-1]))
+        self.assertEqual(summary['retention_time'][0], 0.01)
+        self.assertEqual(summary['instrument'], 'FTMS')
+        self.assertEqual(summary['extractor'], 'RAWXtract 1.9.9.2')
+
+    def test_ms2_summary(self):
+
+        ''' Tests the charge state distribution (and a file without H lines)
+        '''
+
+        summary = parsers.ms2_summary(ms2.scan_index(self.ms2_file_path), parsers.file_headers(self.ms2_file_path))
+
+        self.assertEqual(summary['charges'], {'2': 1, '3': 2, '4': 1})
+        self.assertEqual(summary['headers'], {})
+        self.assertIsNone(summary['instrument'])
+
+    def test_sqt_summary(self):
+
+        ''' Tests scans, charge states and search engine/database headers of the SQT file (also compressed)
+        '''
+
+        summary = parsers.sqt_summary(self.sqt_file_path)
+
+        self.assertEqual(summary['scans'], 3)
+        self.assertEqual((summary['first_scan'], summary['last_scan']), (315, 810))
+        self.assertEqual(summary['charges'], {'2': 1, '3': 1, '4': 1})
+        self.assertEqual(summary['search_engine'], 'Blazmass 0.983')
+        self.assertEqual(summary['database'], 'MassDB.MassDB [MongoDB]')
+        self.assertEqual(summary['headers']['PrecursorMasses'], 'MONO')
+
+        bgzf.compress_file(self.sqt_file_path, self.sqt_file_path+'.gz')
+        try:
+            self.assertEqual(parsers.sqt_summary(self.sqt_file_path+'.gz'), summary)
+        finally:
+            for path in (self.sqt_file_path+'.gz', self.sqt_file_path+'.gz'+bgzf.INDEX_SUFFIX):
+                os.remove(path)
+
+    def test_dtaselect_header_info(self):
+
+        ''' Tests the version, database, search engine and flags lines of the DTASelect header
+        '''
+
+        info = parsers.dtaselect_header_info(self.dta_file_path)
+
+        self.assertEqual(info['version'], 'DTASelect v2.1.3')
+        self.assertTrue(info['database'].endswith('filtered_DB_firstmatchonly_noProtDB.fasta'))
+        self.assertEqual(info['search_engine'], 'Blazmass ? in SQT format.')
+        self.assertEqual(info['flags'], '--quiet --sfp 0.01 -p 2')
+
+class TestBlockCompression(base.BaseFileSavedTestCase):
+
+    ''' Methods to test block-compressed (BGZF) data files, and reading them through bgzf.open
+    '''
+
+    def setUp(self):
+        super().setUp()
+        self.compressed_paths = []
+
+    def tearDown(self):
+        for path in self.compressed_paths:
+            for sidecar_path in (path, path+bgzf.INDEX_SUFFIX, path+cache.MS2_INDEX_SUFFIX):
+                if os.path.exists(sidecar_path):
+                    os.remove(sidecar_path)
+        super().tearDown()
+
+    def compress(self, file_path):
+        compressed_path = file_path+'.gz'
+        bgzf.compress_file(file_path, compressed_path)
+        self.compressed_paths.append(compressed_path)
+        return compressed_path
+
+    def test_round_trip(self):
+
+        ''' Tests that compressed files (several blocks, with and without the block index)
+            are read back unchanged, and are valid gzip files
+        '''
+
+        contents = self.ms2_file_string.encode('utf-8') * (3*bgzf.BLOCK_DATA_SIZE // len(self.ms2_file_string) + 1)
+        with open(self.ms2_file_path, 'wb') as f:
+            f.write(contents)
+        compressed_path = self.compress(self.ms2_file_path)
+
+        self.assertEqual(bgzf.file_format(compressed_path), 'bgzf')
+        self.assertEqual(bgzf.file_format(self.ms2_file_path), 'plain')
+        self.assertLess(os.path.getsize(compressed_path), len(contents))
+        with open(compressed_path, 'rb') as f:
+            self.assertEqual(gzip.decompress(f.read()), contents)
+
+        for with_index in (True, False):
+            if not with_index:
+                os.remove(compressed_path+bgzf.INDEX_SUFFIX)
+            with bgzf.open(compressed_path, 'rb') as f:
+                self.assertEqual(f.read(), contents)
+            with bgzf.open(compressed_path, 'r') as f:
+                self.assertEqual(f.readline(), self.ms2_file_string.splitlines(True)[0])
+
+    def test_random_reads(self):
+
+        ''' Tests reading byte ranges within and across block boundaries
+        '''
+
+        rng = random.Random(0)
+        contents = bytes(rng.getrandbits(8) for _ in range(2*bgzf.BLOCK_DATA_SIZE)) + b'A'*(2*bgzf.BLOCK_DATA_SIZE+17)
+        with open(self.ms2_file_path, 'wb') as f:
+            f.write(contents)
+        compressed_path = self.compress(self.ms2_file_path)
+
+        block_file = bgzf.BlockFile(compressed_path)
+        self.assertEqual(block_file.size, len(contents))
+        ranges = [(0, 10), (bgzf.BLOCK_DATA_SIZE-5, 10), (bgzf.BLOCK_DATA_SIZE, 3*bgzf.BLOCK_DATA_SIZE), (len(contents)-5, 100), (len(contents), 1)]
+        ranges += [(rng.randrange(len(contents)), rng.randrange(3*bgzf.BLOCK_DATA_SIZE)) for _ in range(20)]
+        for offset, length in ranges:
+            self.assertEqual(block_file.pread(offset, length), contents[offset:offset+length])
+
+        block_file.seek(bgzf.BLOCK_DATA_SIZE+1)
+        self.assertEqual(block_file.read(5), contents[bgzf.BLOCK_DATA_SIZE+1:bgzf.BLOCK_DATA_SIZE+6])
+        block_file.close()
+
+    def test_readers_on_compressed_files(self):
+
+        ''' Tests that the scan index, scan lookup and readers give the same results for compressed files
+        '''
+
+        ms2_path, ms1_path, sqt_path = map(self.compress, (self.ms2_file_path, self.ms1_file_path, self.sqt_file_path))
+
+        index = ms2.scan_index(self.ms2_file_path)
+        compressed_index = cache.ms2_scan_index(ms2_path)
+        for column in index['scans']:
+            self.assertEqual(compressed_index['scans'][column].tolist(), index['scans'][column].tolist())
+        self.assertEqual(parsers.count_scans(ms2_path), 4)
+        self.assertEqual(list(cache.ms2_scans(ms2_path, [95, 13])), list(cache.ms2_scans(self.ms2_file_path, [95, 13])))
+
+        self.assertEqual(ms2.read_file(ms2_path)['mz'].tolist(), ms2.read_file(self.ms2_file_path)['mz'].tolist())
+        self.assertEqual(ms1.chromatograms(ms1_path)['tic'].tolist(), ms1.chromatograms(self.ms1_file_path)['tic'].tolist())
+        self.assertEqual(sqt.read_file(sqt_path)['loci']['locus'].tolist(), sqt.read_file(self.sqt_file_path)['loci']['locus'].tolist())
+
+
+    def test_open_files_are_closed_when_evicted(self):
+
+        ''' Tests that each process keeps at most max_size data files open, and closes the
+            files it evicts (least recently used first) or replaces
+        '''
+
+        open_files = cache.OpenFiles(max_size=2)
+        opened = [bgzf.BlockFile(self.compress(path)) for path in (self.ms2_file_path, self.ms1_file_path, self.sqt_file_path)]
+
+        open_files.put('ms2', 1, opened[0])
+        open_files.put('ms1', 1, opened[1])
+        self.assertIs(open_files.get('ms2', 1), opened[0])
+        open_files.put('sqt', 1, opened[2])
+
+        self.assertEqual(len(open_files), 2)
+        self.assertTrue(opened[1].closed)
+        self.assertIsNone(open_files.get('ms1', 1))
+        self.assertFalse(opened[0].closed)
+
+        self.assertIsNone(open_files.get('ms2', 2))
+        open_files.put('ms2', 2, bgzf.BlockFile(self.compressed_paths[0]))
+        self.assertTrue(opened[0].closed)
+
+        open_files.clear()
+        self.assertTrue(opened[2].closed)
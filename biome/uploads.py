@@ -0,0 +1,581 @@
+#!/usr/bin/env python3
+
+# chunked, resumable uploads of large data files (see the /api/upload views in views_api.py)
+#
+# A client starts an upload session for all files of a new dataset (start_session), then
+# PUTs numbered chunks of each file, in any order and from any number of connections.
+# Each chunk is written directly into place in a preallocated part file in
+# UPLOAD_FOLDER, and recorded (UploadChunk), so an interrupted upload is resumed by
+# asking which chunks are missing (session_status). As chunks arrive, the received start
+# of each file is hashed (and compressed, for MS1/MS2/SQT files) and the hash state saved
+# (hash_received_chunks). Once all its chunks are received, a file is finalized: an ingest
+# job hashes (and compresses) the rest of the part file and moves it into the data store
+# (datastore.store_file). The Dataset and its file records are created when the last file
+# of the session is stored. Sessions that stop receiving chunks are removed after
+# UPLOAD_EXPIRY_DAYS (expire_sessions, see manage.py expire_uploads).
+import ctypes
+import ctypes.util
+import os
+import zlib
+from datetime import datetime, timedelta
+from hashlib import sha224
+from sqlalchemy import text
+from sqlalchemy.exc import IntegrityError
+from werkzeug import secure_filename
+from biome import ( app,
+                    bgzf,
+                    datastore,
+                    db,
+                    ingest,
+                    models,
+                    views_documents,
+                    )
+
+READ_SIZE = 4*1024*1024
+PARTS_DIRECTORY = 'uploads'
+# progress of store_upload is reported every PROGRESS_BLOCKS reads
+PROGRESS_BLOCKS = 64
+# a chunk upload hashes at most HASH_AHEAD_CHUNKS received chunks (see hash_received_chunks)
+HASH_AHEAD_CHUNKS = 4
+# first key of the advisory locks on upload files (the second is the file ID)
+LOCK_NAMESPACE = 2201
+
+class UploadError(ValueError):
+
+    ''' Raised for invalid upload requests (the message is returned to the client)
+    '''
+
+def _load_libcrypto():
+    # OpenSSL's libcrypto (which hashlib uses too), for a SHA224 whose state can be saved
+    # between chunk uploads (hashlib's can't be). None if it can't be loaded (or gives a wrong
+    # hash): files are then only hashed once they're finalized
+    path = ctypes.util.find_library('crypto')
+    if path is None:
+        return None
+    try:
+        libcrypto = ctypes.CDLL(path)
+        libcrypto.SHA224_Init.argtypes = [ctypes.c_void_p]
+        libcrypto.SHA224_Update.argtypes = [ctypes.c_void_p, ctypes.c_char_p, ctypes.c_size_t]
+        libcrypto.SHA224_Final.argtypes = [ctypes.c_char_p, ctypes.c_void_p]
+    except (OSError, AttributeError):
+        return None
+
+    ctx = ctypes.create_string_buffer(SavedSHA224.STATE_SIZE)
+    digest = ctypes.create_string_buffer(28)
+    libcrypto.SHA224_Init(ctx)
+    libcrypto.SHA224_Update(ctx, b'abc', 3)
+    libcrypto.SHA224_Final(digest, ctx)
+    if digest.raw != sha224(b'abc').digest():
+        return None
+
+    return libcrypto
+
+class SavedSHA224():
+
+    ''' SHA224 hasher (update() and hexdigest() as hashlib's) whose state (the bytes of its
+        OpenSSL context) can be saved, e.g. in the database, and restored: SavedSHA224(state)
+
+        Only available if libcrypto could be loaded (see available())
+    '''
+
+    # bytes kept of the context (sizeof(SHA256_CTX) is 112)
+    STATE_SIZE = 128
+
+    def __init__(self, state=None):
+        self._ctx = ctypes.create_string_buffer(self.STATE_SIZE)
+        if state is None:
+            _libcrypto.SHA224_Init(self._ctx)
+        else:
+            ctypes.memmove(self._ctx, state, min(len(state), self.STATE_SIZE))
+
+    @staticmethod
+    def available():
+        return _libcrypto is not None
+
+    @property
+    def state(self):
+        return self._ctx.raw
+
+    def update(self, data):
+        data = bytes(data)
+        _libcrypto.SHA224_Update(self._ctx, data, len(data))
+
+    def hexdigest(self):
+        # (finalizes a copy, so more data can still be added)
+        ctx = ctypes.create_string_buffer(self._ctx.raw, self.STATE_SIZE)
+        digest = ctypes.create_string_buffer(28)
+        _libcrypto.SHA224_Final(digest, ctx)
+        return digest.raw.hex()
+
+_libcrypto = _load_libcrypto()
+
+def chunk_count(size, chunk_size):
+
+    ''' Number of chunks of a file of size bytes (at least 1, empty files have one empty chunk)
+    '''
+
+    return max(-(-size // chunk_size), 1)
+
+def chunk_length(upload_file, number):
+
+    ''' Expected length of chunk number of upload_file (the last chunk can be shorter)
+    '''
+
+    return max(min(upload_file.chunk_size, upload_file.size - number*upload_file.chunk_size), 0)
+
+def part_path(upload_file):
+
+    ''' Path of the part file that the chunks of upload_file are written into
+        (in UPLOAD_FOLDER, so it's renamed into the data store instead of copied)
+    '''
+
+    return os.path.join(app.config['UPLOAD_FOLDER'], PARTS_DIRECTORY, '{}_{}.part'.format(upload_file.session_id, upload_file.id))
+
+def start_session(dataset_name, dataset_description, files, chunk_size=None):
+
+    ''' Starts an upload session for the files of a new dataset
+
+        files is a list of dicts {'filename': ..., 'size': ...} (size in bytes).
+        Creates an empty (sparse) part file of the full size for each file.
+
+        Returns the new UploadSession
+    '''
+
+    chunk_size = int(chunk_size or app.config['UPLOAD_CHUNK_SIZE'])
+    if not 0 < chunk_size <= app.config['UPLOAD_MAX_CHUNK_SIZE']:
+        raise UploadError('chunk_size must be between 1 and {} bytes'.format(app.config['UPLOAD_MAX_CHUNK_SIZE']))
+    if not dataset_name:
+        raise UploadError('A dataset name is required')
+    if not files:
+        raise UploadError('No files to upload')
+    try:
+        filenames = [str(file_info['filename']) for file_info in files]
+        sizes = [int(file_info['size']) for file_info in files]
+    except (KeyError, TypeError, ValueError):
+        raise UploadError('Each file needs a filename and a size')
+    if not views_documents.check_file_types(filenames):
+        raise UploadError('Can\'t upload all of those file types... {}'.format(', '.join(filenames)))
+    if any(size < 0 for size in sizes):
+        raise UploadError('File sizes can\'t be negative')
+
+    upload_session = models.UploadSession(dataset_name, dataset_description)
+    db.session.add(upload_session)
+    db.session.flush()
+
+    os.makedirs(os.path.join(app.config['UPLOAD_FOLDER'], PARTS_DIRECTORY), exist_ok=True)
+    for filename, size in zip(filenames, sizes):
+        upload_file = models.UploadFile(upload_session.id, secure_filename(filename), size, chunk_size)
+        db.session.add(upload_file)
+        db.session.flush()
+        upload_file.part_path = part_path(upload_file)
+        with open(upload_file.part_path, 'wb') as f:
+            f.truncate(size)
+
+    db.session.commit()
+
+    app.logger.info('Started upload session {} for dataset {} ({})'.format(upload_session.id, dataset_name, ', '.join(filenames)))
+
+    return upload_session
+
+def received_chunks(upload_file):
+
+    ''' Sorted numbers of the chunks of upload_file that were received
+    '''
+
+    query = db.session.query(models.UploadChunk.number).filter_by(file_id=upload_file.id).order_by(models.UploadChunk.number)
+
+    return [number for number, in query.all()]
+
+def file_status(upload_file):
+
+    ''' Dict describing an uploaded file (for the upload API)
+    '''
+
+    chunks = chunk_count(upload_file.size, upload_file.chunk_size)
+    received = set(received_chunks(upload_file))
+
+    return {'file_id': upload_file.id,
+            'filename': upload_file.original_filename,
+            'size': upload_file.size,
+            'chunk_size': upload_file.chunk_size,
+            'chunks': chunks,
+            'missing_chunks': [number for number in range(chunks) if number not in received],
+            'status': upload_file.status,
+            'sha224': upload_file.sha224,
+            }
+
+def session_status(upload_session):
+
+    ''' Dict describing an upload session and its files (for the upload API). A client
+        resumes an interrupted upload by sending each file's missing_chunks
+    '''
+
+    return {'upload_id': upload_session.id,
+            'dataset_name': upload_session.dataset_name,
+            'status': upload_session.status,
+            'dataset_id': upload_session.dataset_id,
+            'files': [file_status(upload_file) for upload_file in upload_session.files.order_by(models.UploadFile.id)],
+            }
+
+def _hash_and_compress(upload_file):
+    # hashes (and block-compresses, for MS1/MS2/SQT files) the part file of upload_file in one
+    # sequential pass, reporting progress of the ingest job. Gzip-compressed uploads ('.gz') are
+    # decompressed first, so the hash is the hash of the uncompressed contents (as for files
+    # uploaded with save_new_file). Returns (sha224 hex digest, path of the compressed file
+    # (part path + '.bgzf') or None, its block index or None)
+    hasher = sha224()
+    decompressor = None
+    if upload_file.original_filename.lower().endswith(views_documents.COMPRESSED_UPLOAD_SUFFIX):
+        decompressor = zlib.decompressobj(16+zlib.MAX_WBITS)
+
+    def decompress(data):
+        # (gzip files can have several members, e.g. BGZF files)
+        nonlocal decompressor
+        parts = []
+        while data:
+            if decompressor.eof:
+                decompressor = zlib.decompressobj(16+zlib.MAX_WBITS)
+            parts.append(decompressor.decompress(data))
+            data = decompressor.unused_data if decompressor.eof else b''
+        return b''.join(parts)
+
+    extension = views_documents.uploaded_filename(upload_file.original_filename)[-4:]
+    compressed_path, compressed_file, writer = None, None, None
+    if datastore.is_compressed_type(extension):
+        compressed_path = upload_file.part_path+'.bgzf'
+        compressed_file = open(compressed_path, 'wb')
+        writer = bgzf.BlockWriter(compressed_file)
+
+    try:
+        with open(upload_file.part_path, 'rb') as f:
+            for block_number, data in enumerate(iter(lambda: f.read(READ_SIZE), b'')):
+                if block_number % PROGRESS_BLOCKS == 0:
+                    ingest.report_progress(0.9*block_number*READ_SIZE/max(upload_file.size, 1), 'Hashing {}'.format(upload_file.original_filename))
+                if decompressor is not None:
+                    data = decompress(data)
+                hasher.update(data)
+                if writer is not None:
+                    writer.write(data)
+        if decompressor is not None and not decompressor.eof:
+            raise UploadError('{} is an incomplete gzip file'.format(upload_file.original_filename))
+        if writer is not None:
+            writer.close()
+    except:
+        if compressed_file is not None:
+            compressed_file.close()
+            os.remove(compressed_path)
+        raise
+    if compressed_file is not None:
+        compressed_file.close()
+
+    return hasher.hexdigest(), compressed_path, writer.index if writer is not None else None
+
+def _lock_file(upload_file, wait=True):
+    # takes the (transaction) advisory lock of upload_file, so only one process hashes it
+    # at a time; the lock is released by the next commit or rollback. With wait=False,
+    # returns False right away if another process has it
+    params = {'namespace': LOCK_NAMESPACE, 'file_id': upload_file.id}
+    if wait:
+        db.session.execute(text('SELECT pg_advisory_xact_lock(:namespace, :file_id)'), params)
+        return True
+    return bool(db.session.execute(text('SELECT pg_try_advisory_xact_lock(:namespace, :file_id)'), params).scalar())
+
+def _can_checkpoint(upload_file):
+    # gzip-compressed uploads are hashed in one pass when they're finalized
+    # (the state of their decompression can't be saved)
+    return SavedSHA224.available() and not upload_file.original_filename.lower().endswith(views_documents.COMPRESSED_UPLOAD_SUFFIX)
+
+def _reset_checkpoint(upload_file):
+    # forgets the hashed start of upload_file (e.g. a hashed chunk was sent again with other contents)
+    upload_file.hashed_chunks = 0
+    upload_file.hash_state = None
+    upload_file.compressed_size = 0
+    if upload_file.part_path and os.path.exists(upload_file.part_path+'.bgzf'):
+        os.remove(upload_file.part_path+'.bgzf')
+
+def _hash_chunks(upload_file, stop, finish=False):
+    # hashes (and block-compresses, for MS1/MS2/SQT files) the chunks of upload_file from
+    # hashed_chunks up to stop, continuing from the saved checkpoint. With finish=False,
+    # saves the new checkpoint (not committed); with finish=True (stop is the number of chunks),
+    # returns (sha224 hex digest, path of the compressed file or None, its block index or None)
+    # as _hash_and_compress. The caller holds the lock of the file (see _lock_file)
+    start = upload_file.hashed_chunks or 0
+    hasher = SavedSHA224(upload_file.hash_state if start else None)
+    position = start*upload_file.chunk_size
+    stop_position = min(stop*upload_file.chunk_size, upload_file.size)
+
+    extension = views_documents.uploaded_filename(upload_file.original_filename)[-4:]
+    compressed_path, compressed_file, writer = None, None, None
+    if datastore.is_compressed_type(extension):
+        compressed_path = upload_file.part_path+'.bgzf'
+        compressed_size = (upload_file.compressed_size or 0) if start else 0
+        compressed_file = open(compressed_path, 'r+b' if os.path.exists(compressed_path) else 'w+b')
+        compressed_file.truncate(compressed_size) # (drops anything written after the checkpoint)
+        compressed_file.seek(compressed_size)
+        writer = bgzf.BlockWriter(compressed_file, compressed_offset=compressed_size, uncompressed_offset=position)
+
+    try:
+        with open(upload_file.part_path, 'rb') as f:
+            f.seek(position)
+            block_number = 0
+            while position < stop_position:
+                if finish and block_number % PROGRESS_BLOCKS == 0:
+                    ingest.report_progress(0.9*position/max(upload_file.size, 1), 'Hashing {}'.format(upload_file.original_filename))
+                data = f.read(min(READ_SIZE, stop_position - position))
+                if not data:
+                    raise UploadError('{} is shorter than {} bytes'.format(upload_file.part_path, upload_file.size))
+                hasher.update(data)
+                if writer is not None:
+                    writer.write(data)
+                position += len(data)
+                block_number += 1
+        if writer is not None:
+            if finish:
+                writer.close()
+            else:
+                writer.flush()
+    finally:
+        if compressed_file is not None:
+            compressed_file.close()
+
+    if finish:
+        return hasher.hexdigest(), compressed_path, bgzf.block_index(compressed_path) if compressed_path is not None else None
+
+    upload_file.hashed_chunks = stop
+    upload_file.hash_state = hasher.state
+    upload_file.compressed_size = writer.compressed_size if writer is not None else 0
+
+def hash_received_chunks(upload_file, max_chunks=HASH_AHEAD_CHUNKS):
+
+    ''' Hashes (and compresses, for MS1/MS2/SQT files) up to max_chunks received chunks
+        that follow the hashed start of upload_file, and saves the hash state (see
+        models.UploadFile), so store_upload only has to hash what's left instead of
+        reading the whole file again. Called after each chunk upload (see write_chunk)
+
+        Does nothing if another process is hashing the file, for gzip-compressed
+        uploads, or if libcrypto isn't available. Returns the number of hashed chunks
+    '''
+
+    if not _can_checkpoint(upload_file):
+        return 0
+    if not _lock_file(upload_file, wait=False):
+        db.session.rollback()
+        return upload_file.hashed_chunks or 0
+    db.session.refresh(upload_file)
+    start = upload_file.hashed_chunks or 0
+
+    query = db.session.query(models.UploadChunk.number).filter(models.UploadChunk.file_id == upload_file.id,
+                                                               models.UploadChunk.number >= start)
+    stop = start
+    for number, in query.order_by(models.UploadChunk.number).limit(max_chunks):
+        if number != stop:
+            break
+        stop += 1
+
+    if stop > start and upload_file.status == 'uploading':
+        _hash_chunks(upload_file, stop)
+    db.session.commit()
+
+    return upload_file.hashed_chunks or 0
+
+def write_chunk(upload_file, number, stream, block_size=READ_SIZE):
+
+    ''' Writes chunk number of upload_file from stream (e.g. request.stream) at its
+        offset in the part file, and records it
+
+        Chunks can be sent again (e.g. if the connection dropped before the response);
+        they're written again (if an already hashed chunk changed, the file is hashed
+        again from the start). Then hashes what it can of the file (see hash_received_chunks).
+        Returns the number of bytes written
+    '''
+
+    if upload_file.status != 'uploading':
+        raise UploadError('File {} is not being uploaded (status: {})'.format(upload_file.id, upload_file.status))
+    if not 0 <= number < chunk_count(upload_file.size, upload_file.chunk_size):
+        raise UploadError('File {} has no chunk {}'.format(upload_file.id, number))
+
+    expected = chunk_length(upload_file, number)
+    offset = number*upload_file.chunk_size
+    written = 0
+    was_hashed = number < (upload_file.hashed_chunks or 0)
+    changed = False
+
+    fd = os.open(upload_file.part_path, os.O_RDWR if was_hashed else os.O_WRONLY)
+    try:
+        while written < expected:
+            block = stream.read(min(block_size, expected - written))
+            if not block:
+                break
+            if was_hashed and not changed:
+                changed = os.pread(fd, len(block), offset+written) != block
+            os.pwrite(fd, block, offset+written)
+            written += len(block)
+        if written != expected or stream.read(1):
+            raise UploadError('Chunk {} of file {} must be {} bytes'.format(number, upload_file.id, expected))
+    finally:
+        os.close(fd)
+
+    try:
+        with db.session.begin_nested():
+            db.session.add(models.UploadChunk(upload_file.id, number))
+    except IntegrityError:
+        pass # chunk was sent again
+    models.UploadSession.query.filter_by(id=upload_file.session_id).update({models.UploadSession.last_activity: datetime.now()}, synchronize_session=False)
+    db.session.commit()
+
+    if changed:
+        _lock_file(upload_file)
+        db.session.refresh(upload_file)
+        _reset_checkpoint(upload_file)
+        db.session.commit()
+
+    try:
+        hash_received_chunks(upload_file)
+    except:
+        # (the chunk is stored; the rest of the file is hashed when it's finalized)
+        app.logger.exception('Could not hash received chunks of uploaded file {}'.format(upload_file.id))
+        db.session.rollback()
+
+    return written
+
+def finalize_file(upload_file):
+
+    ''' Checks that all chunks of upload_file were received, then stores it
+        in the background (see store_upload). Returns the missing chunk numbers
+        (the file is only stored if there are none)
+    '''
+
+    missing_chunks = file_status(upload_file)['missing_chunks']
+    if missing_chunks:
+        return missing_chunks
+
+    models.UploadSession.query.filter_by(id=upload_file.session_id).update({models.UploadSession.last_activity: datetime.now()}, synchronize_session=False)
+
+    # only one request gets to store the file (finalize can be sent again, to any process)
+    claimed = models.UploadFile.query.filter_by(id=upload_file.id, status='uploading').update({models.UploadFile.status: 'storing'}, synchronize_session=False)
+    db.session.commit()
+
+    if claimed:
+        store_upload(upload_file.id)
+
+    return []
+
+@ingest.job
+def store_upload(file_id):
+
+    ''' Hashes (and compresses) an uploaded file, moves it into the data store,
+        and creates the dataset if it was the last file of its upload session
+
+        If the file can't be stored (e.g. a corrupt gzip upload), it's set back to
+        'uploading', so chunks can be sent again and the file finalized again
+        (the error is the message of the ingest job)
+
+        Runs as a background ingest job (see biome.ingest), so it doesn't hold up page loads.
+    '''
+
+    upload_file = models.UploadFile.query.get(file_id)
+    extension = views_documents.uploaded_filename(upload_file.original_filename)[-4:]
+
+    compressed_path = None
+    try:
+        if _can_checkpoint(upload_file):
+            # (waits for a chunk upload that's still hashing the file)
+            _lock_file(upload_file)
+            db.session.refresh(upload_file)
+            hash_val, compressed_path, block_index = _hash_chunks(upload_file, chunk_count(upload_file.size, upload_file.chunk_size), finish=True)
+        else:
+            hash_val, compressed_path, block_index = _hash_and_compress(upload_file)
+        ingest.report_progress(0.9, 'Hashed {}'.format(upload_file.original_filename))
+
+        if compressed_path is None:
+            file_path, is_new = datastore.store_file(upload_file.part_path, hash_val, extension)
+        else:
+            file_path, is_new = datastore.store_file(compressed_path, hash_val, extension, block_index)
+            os.remove(upload_file.part_path)
+    except:
+        app.logger.error('Could not store uploaded file {} (upload session {})'.format(upload_file.original_filename, upload_file.session_id))
+        db.session.rollback()
+        if compressed_path is not None and os.path.exists(compressed_path):
+            os.remove(compressed_path)
+        _reset_checkpoint(upload_file)
+        upload_file.status = 'uploading'
+        db.session.commit()
+        raise
+
+    upload_file.file_path = file_path
+    upload_file.sha224 = hash_val
+    upload_file.status = 'stored'
+    db.session.commit()
+
+    app.logger.info('Stored uploaded file {} as {} ({})'.format(upload_file.original_filename, file_path, 'new' if is_new else 'already stored'))
+
+    complete_session(upload_file.session_id)
+
+def complete_session(session_id):
+
+    ''' Creates the dataset of an upload session (see views_documents.save_dataset)
+        once all of its files are stored. Returns the Dataset ID, or None if files
+        are still being uploaded (or the dataset was already created)
+    '''
+
+    statuses = [status for status, in db.session.query(models.UploadFile.status).filter_by(session_id=session_id).all()]
+    if any(status != 'stored' for status in statuses):
+        return None
+
+    # only one request gets to create the dataset (files can be stored by different processes at once)
+    claimed = models.UploadSession.query.filter_by(id=session_id, status='uploading').update({models.UploadSession.status: 'complete'}, synchronize_session=False)
+    db.session.commit()
+    if not claimed:
+        return None
+
+    upload_session = models.UploadSession.query.get(session_id)
+    saved_files = [(upload_file.file_path, views_documents.uploaded_filename(upload_file.original_filename))
+                   for upload_file in upload_session.files.order_by(models.UploadFile.id)]
+    try:
+        dataset = views_documents.save_dataset(upload_session.dataset_name, upload_session.dataset_description, saved_files)
+    except:
+        app.logger.error('Could not create dataset for upload session {}'.format(session_id))
+        upload_session.status = 'failed'
+        db.session.commit()
+        raise
+
+    upload_session.dataset_id = dataset['dataset_id']
+    db.session.commit()
+
+    app.logger.info('Upload session {} complete: created Dataset ID {}'.format(session_id, dataset['dataset_id']))
+
+    return dataset['dataset_id']
+
+def expire_sessions(days=None):
+
+    ''' Removes the part files (and received chunk records) of upload sessions that haven't
+        received chunks for days (default: app.config['UPLOAD_EXPIRY_DAYS']), and sets them
+        to 'expired'. Sessions with a file that's being stored are left alone.
+        Returns the IDs of the expired sessions
+    '''
+
+    days = app.config['UPLOAD_EXPIRY_DAYS'] if days is None else days
+    cutoff = datetime.now() - timedelta(days=days)
+    last_activity = db.func.coalesce(models.UploadSession.last_activity, models.UploadSession.created_time)
+    stale_sessions = models.UploadSession.query.filter(models.UploadSession.status == 'uploading', last_activity < cutoff).all()
+
+    expired = []
+    for upload_session in stale_sessions:
+        upload_files = upload_session.files.all()
+        if any(upload_file.status == 'storing' for upload_file in upload_files):
+            continue
+        for upload_file in upload_files:
+            if upload_file.status == 'stored':
+                continue
+            for path in (upload_file.part_path, upload_file.part_path+'.bgzf'):
+                if path and os.path.exists(path):
+                    os.remove(path)
+            upload_file.chunks.delete(synchronize_session=False)
+            upload_file.hash_state = None
+            upload_file.status = 'expired'
+        upload_session.status = 'expired'
+        db.session.commit()
+        expired.append(upload_session.id)
+        app.logger.info('Upload session {} expired (no chunks received since {})'.format(upload_session.id, upload_session.last_activity))
+
+    return expired
@@ -1,19 +1,27 @@
 #!/usr/bin/env python3
 
 import json
+import math
+from itertools import chain
 from flask import ( Blueprint, 
                     current_app, 
                     jsonify, 
                     render_template, 
                     request, 
+                    Response, 
+                    stream_with_context, 
                     )
 from biome import ( app, 
                     api, 
+                    cache, 
                     data, 
                     db, 
+                    ingest, 
                     models, 
+                    ms1, 
                     parsers,  
                     tasks, 
+                    uploads, 
                     views_documents, 
                     views_helpers, 
                     views_plots, 
@@ -127,12 +135,23 @@ def dtafile_quickinfo(dtafile_id):
     if not dtafile_object:
         return jsonify({})
 
+    if dtafile_object.summary is None:
+        # records uploaded before summaries were stored
+        dtafile_object.summary = views_helpers.get_dta_summary(dtafile_object.file_path)
+        db.session.commit()
+
+    if dtafile_object.flags is None:
+        # records uploaded before flags were stored
+        dtafile_object.flags = views_helpers.get_dta_flags(dtafile_object.file_path)
+        db.session.commit()
+
     info_dict = {   'id': dtafile_object.id, 
                     'file_name': dtafile_object.original_filename, 
                     'parent_dbsearch': dtafile_object.dbsearch_id, 
                     'created_time': str(dtafile_object.created_time), 
                     'flags': dtafile_object.flags, 
                     'deleted': dtafile_object.deleted, 
+                    'summary': dtafile_object.summary, 
                     }
 
     return jsonify(info_dict)
@@ -155,6 +174,7 @@ def sqtfile_quickinfo(sqtfile_id):
                     'created_time': str(sqtfile_object.created_time), 
                     'deleted': sqtfile_object.deleted, 
                     'scans': sqtfile_object.scans, 
+                    'summary': sqtfile_object.summary, 
                     }
 
     return jsonify(info_dict)
@@ -164,6 +184,13 @@ def dtafile_json(dtafile_id):
 
     ''' Returns JSON object containing parsed DTASelect-filter.txt file
         (from DTAFile database record with id=dtafile_id)
+
+        Protein groups are streamed (chunked transfer) as they are parsed, so
+        the whole document is never held in memory
+
+        Optional query parameters ?offset=&limit= return one page of protein groups
+        (plus 'offset', 'limit' and 'total' fields). The text file is only read
+        from the first requested protein group on (see cache.dtaselect_index)
     '''
 
     dtafile_object = models.DTAFile.query.get(dtafile_id)
@@ -171,7 +198,294 @@ def dtafile_json(dtafile_id):
     if not dtafile_object:
         return jsonify({})
 
-    parsed = list(parsers.dtaselect_json(dtafile_object.file_path))
+    offset = request.args.get('offset', None, type=int)
+    limit = request.args.get('limit', None, type=int)
+    paged = offset is not None or limit is not None
+
+    start = max(offset or 0, 0)
+    stop = start + max(limit, 0) if limit is not None else None
+    fields = dict()
+
+    # read from the memory-mapped sidecar file if it's there,
+    # otherwise parse the text file while streaming
+    dtaselect_tables = cache.load_tables(dtafile_object.file_path, cache.DTASELECT_SUFFIX)
+    if dtaselect_tables is not None:
+        parsed = parsers.dtaselect_from_columnar(dtaselect_tables, start=start, stop=stop)
+        total = len(dtaselect_tables['proteins']['name'])
+    elif paged:
+        group_offsets = cache.dtaselect_index(dtafile_object.file_path)
+        parsed = parsers.dtaselect_json(dtafile_object.file_path, start=start, stop=stop, group_offsets=group_offsets)
+        total = len(group_offsets)-1
+    else:
+        parsed = parsers.dtaselect_json(dtafile_object.file_path)
+
+    if paged:
+        fields = {'offset': start, 'limit': limit, 'total': total}
+
+    # top-level object (not array)... http://flask.pocoo.org/docs/0.10/security/#json-security
+    return Response(stream_with_context(views_helpers.iter_json_list('data', parsed, **fields)), mimetype='application/json')
+
+@api.route('/dbsearch/<dbsearch_id>/dta.json')
+def dbsearch_dta_json(dbsearch_id):
+
+    ''' Returns JSON object containing the parsed DTASelect-filter.txt files of all
+        DTAFiles of a DBSearch (with id=dbsearch_id): 'data' has the protein groups of
+        all files (streamed), those of DTAFile dtafile_ids[i] are data[file_offsets[i]:file_offsets[i+1]]
+
+        Read from the parsed DTASelect sidecar files. Returns 503 (and queues the job that
+        parses all missing files at once, see views_helpers.cache_dbsearch_dtaselect_files)
+        until they're all built
+    '''
+
+    dbsearch_object = models.DBSearch.query.get(dbsearch_id)
+
+    if not dbsearch_object:
+        return jsonify({})
+
+    dtafile_objects = dbsearch_object.dtafiles.order_by(models.DTAFile.id).all()
+
+    def load_all():
+        return [cache.load_tables(dtafile_object.file_path, cache.DTASELECT_SUFFIX) for dtafile_object in dtafile_objects]
+
+    tables_list = load_all()
+    if any(tables is None for tables in tables_list):
+        if ingest.pending_job(views_helpers.cache_dbsearch_dtaselect_files.__name__, dbsearch_object.id) is None:
+            views_helpers.cache_dbsearch_dtaselect_files(dbsearch_object.id)
+        # (the job already ran if INGEST_WORKERS is 0)
+        tables_list = load_all()
+    if any(tables is None for tables in tables_list):
+        return jsonify({'error': 'The DTASelect files of this search are being parsed, try again later'}), 503
+
+    file_offsets = [0]
+    for tables in tables_list:
+        file_offsets.append(file_offsets[-1] + len(tables['proteins']['name']))
+    parsed = chain.from_iterable(parsers.dtaselect_from_columnar(tables) for tables in tables_list)
+    fields = {'dtafile_ids': [dtafile_object.id for dtafile_object in dtafile_objects], 'file_offsets': file_offsets}
+
+    return Response(stream_with_context(views_helpers.iter_json_list('data', parsed, **fields)), mimetype='application/json')
+
+@api.route('/ms2/<ms2file_id>/scan/<int:scan>')
+def ms2file_scan(ms2file_id, scan):
+
+    ''' Returns JSON object with the peak list (and precursor/charge information)
+        of one scan of an MS2File (see ms2.parse_scan)
+
+        Only the scan's bytes are read (memory-mapped file, offsets from the scan index),
+        so response time doesn't depend on the size of the file. Returns 503 (and queues
+        the job that builds it, if needed) while the scan index isn't built
+    '''
+
+    ms2file_object = models.MS2File.query.get(ms2file_id)
+
+    if not ms2file_object:
+        return jsonify({})
+
+    index = views_helpers.load_sidecar(ms2file_object.file_path, cache.MS2_INDEX_SUFFIX, views_helpers.count_scans_in_file, ms2file_object.id, 'ms2')
+    if index is None:
+        return jsonify({'error': 'The scan index of this file is being built, try again later'}), 503
+
+    parsed_scan, = cache.ms2_scans(ms2file_object.file_path, [scan], index)
+
+    return jsonify(parsed_scan or {})
+
+@api.route('/ms2/<ms2file_id>/scan')
+def ms2file_scans(ms2file_id):
+
+    ''' Returns JSON object with the peak lists of several scans of an MS2File
+        (?scans=1,5,99 -- in the requested order, null for scans that aren't in the file)
+
+        Returns 503 while the scan index isn't built (see ms2file_scan)
+    '''
+
+    ms2file_object = models.MS2File.query.get(ms2file_id)
+
+    if not ms2file_object:
+        return jsonify({})
+
+    try:
+        scans = [int(scan) for scan in request.args.get('scans', '').split(',') if scan.strip()]
+    except ValueError:
+        return jsonify({'error': 'scans must be a comma-separated list of scan numbers'})
+
+    index = views_helpers.load_sidecar(ms2file_object.file_path, cache.MS2_INDEX_SUFFIX, views_helpers.count_scans_in_file, ms2file_object.id, 'ms2')
+    if index is None:
+        return jsonify({'error': 'The scan index of this file is being built, try again later'}), 503
+
+    parsed_scans = cache.ms2_scans(ms2file_object.file_path, scans, index)
+
+    return Response(stream_with_context(views_helpers.iter_json_list('data', parsed_scans)), mimetype='application/json')
+
+@api.route('/ms1/<ms1file_id>/tic')
+def ms1file_tic(ms1file_id):
+
+    ''' Returns JSON object with the TIC and base peak chromatograms of an MS1File
+        (one value per scan, see ms1.chromatograms)
+
+        Served from the sidecar that is computed when the file is uploaded,
+        so the MS1 file itself isn't read. Returns 503 (and queues the job that
+        computes it, if needed) while the sidecar isn't built
+    '''
+
+    ms1file_object = models.MS1File.query.get(ms1file_id)
+
+    if not ms1file_object:
+        return jsonify({})
+
+    chromatograms = views_helpers.load_sidecar(ms1file_object.file_path, cache.MS1_CHROMATOGRAM_SUFFIX, views_helpers.precompute_ms1_chromatograms, ms1file_object.id)
+    if chromatograms is None:
+        return jsonify({'error': 'The chromatograms of this file are being computed, try again later'}), 503
+
+    info_dict = {name: array.tolist() for name, array in chromatograms.items()}
+    # (NaN isn't valid JSON)
+    info_dict['retention_time'] = [None if math.isnan(rt) else rt for rt in info_dict['retention_time']]
+    info_dict['id'] = ms1file_object.id
+
+    return jsonify(info_dict)
+
+@api.route('/ms1/<ms1file_id>/xic')
+def ms1file_xic(ms1file_id):
+
+    ''' Returns JSON object with an extracted ion chromatogram of an MS1File
+        (?mz=&ppm=&rt_start=&rt_end= -- ppm defaults to 10, retention time range to the whole run)
+
+        Served from the file's XIC index (see ms1.xic), so only the scans
+        in the retention time range are searched. The index is built by an ingest job when
+        the file is uploaded; returns 503 (and queues the job again if needed) until it's built
+    '''
+
+    ms1file_object = models.MS1File.query.get(ms1file_id)
+
+    if not ms1file_object:
+        return jsonify({})
+
+    mz = request.args.get('mz', None, type=float)
+    ppm = request.args.get('ppm', 10, type=float)
+    rt_start = request.args.get('rt_start', None, type=float)
+    rt_end = request.args.get('rt_end', None, type=float)
+
+    if mz is None or ppm <= 0:
+        return jsonify({'error': 'mz (and a positive ppm tolerance) must be given'})
+
+    index = views_helpers.load_sidecar(ms1file_object.file_path, cache.MS1_XIC_INDEX_SUFFIX, views_helpers.precompute_ms1_chromatograms, ms1file_object.id)
+    if index is None:
+        return jsonify({'error': 'The XIC index of this file is being built, try again later'}), 503
+
+    chromatogram = ms1.xic(index, mz, ppm=ppm, rt_start=rt_start, rt_end=rt_end)
+
+    info_dict = {name: array.tolist() for name, array in chromatogram.items()}
+    info_dict['retention_time'] = [None if math.isnan(rt) else rt for rt in info_dict['retention_time']]
+    info_dict.update({'id': ms1file_object.id, 'mz': mz, 'ppm': ppm, 'rt_start': rt_start, 'rt_end': rt_end})
+
+    return jsonify(info_dict)
+
+@api.route('/upload', methods=['POST'])
+def upload_start():
+
+    ''' Starts a chunked upload of the files of a new dataset (see biome.uploads)
+
+        POST JSON: {"dataset_name": ..., "dataset_description": ..., "chunk_size": (optional),
+                    "files": [{"filename": "sample.ms2", "size": 123456789}, ...]}
+
+        Returns the upload status (upload_id, and file_id/chunks/missing_chunks of each file).
+        Chunks are then sent with PUT /api/upload/<upload_id>/<file_id>/<chunk number>
+
+        Returns 503 while too many ingest jobs are queued (see ingest.queue_full)
+    '''
+
+    if ingest.queue_full():
+        return jsonify({'error': 'Too many files are being processed, try again later'}), 503
+
+    params = request.get_json(force=True, silent=True) or {}
+
+    try:
+        upload_session = uploads.start_session(params.get('dataset_name'), params.get('dataset_description'), params.get('files'), params.get('chunk_size'))
+    except uploads.UploadError as exc:
+        return jsonify({'error': str(exc)}), 400
+
+    return jsonify(uploads.session_status(upload_session))
+
+@api.route('/upload/<upload_id>')
+def upload_status(upload_id):
+
+    ''' Returns the status of a chunked upload: the missing chunks of each file
+        (to resume an interrupted upload), and the dataset_id once all files are stored
+    '''
+
+    upload_session = models.UploadSession.query.get(upload_id)
+
+    if not upload_session:
+        return jsonify({}), 404
+
+    return jsonify(uploads.session_status(upload_session))
+
+@api.route('/upload/<upload_id>/<file_id>/<int:chunk>', methods=['PUT'])
+def upload_chunk(upload_id, file_id, chunk):
+
+    ''' Receives one chunk of a file (request body: the chunk's bytes, chunk_size bytes
+        except for the last chunk). Chunks can be sent in any order, and sent again
+    '''
+
+    upload_file = models.UploadFile.query.filter_by(id=file_id, session_id=upload_id).first()
+
+    if not upload_file:
+        return jsonify({}), 404
+
+    try:
+        written = uploads.write_chunk(upload_file, chunk, request.stream)
+    except uploads.UploadError as exc:
+        return jsonify({'error': str(exc)}), 400
+
+    return jsonify({'file_id': upload_file.id, 'chunk': chunk, 'size': written})
+
+@api.route('/upload/<upload_id>/<file_id>/finalize', methods=['POST'])
+def upload_finalize(upload_id, file_id):
+
+    ''' Finishes uploading a file once all of its chunks are received: the file is
+        stored in the background (poll /api/upload/<upload_id> for its status; the
+        dataset is created when all files of the upload are stored)
+
+        Returns the file's status (409 with the missing chunks if chunks are missing)
+    '''
+
+    upload_file = models.UploadFile.query.filter_by(id=file_id, session_id=upload_id).first()
+
+    if not upload_file:
+        return jsonify({}), 404
+
+    missing_chunks = uploads.finalize_file(upload_file)
+    if missing_chunks:
+        return jsonify({'error': 'Chunks are missing', 'missing_chunks': missing_chunks}), 409
+
+    return jsonify(uploads.file_status(upload_file)), 202
+
+@api.route('/job/<job_id>')
+def ingest_job_status(job_id):
+
+    ''' Returns the status and progress of a background ingest job (see biome.ingest)
+    '''
+
+    ingest_job = models.IngestJob.query.get(job_id)
+
+    if not ingest_job:
+        return jsonify({}), 404
+
+    return jsonify(ingest.job_status(ingest_job))
+
+@api.route('/jobs')
+def ingest_jobs():
+
+    ''' Returns the 100 most recent ingest jobs (optionally filtered by status and name,
+        e.g. /api/jobs?status=failed), and the number of jobs with each status
+    '''
+
+    query = models.IngestJob.query
+    for field in ('status', 'name'):
+        if request.args.get(field):
+            query = query.filter_by(**{field: request.args.get(field)})
+
+    recent_jobs = query.order_by(models.IngestJob.id.desc()).limit(100).all()
+    counts = db.session.query(models.IngestJob.status, db.func.count(models.IngestJob.id)).group_by(models.IngestJob.status).all()
 
-    # jsonify() allow top-level arrays... http://flask.pocoo.org/docs/0.10/security/#json-security
-    return jsonify({'data':parsed})
\ No newline at end of file
+    return jsonify({'jobs': [ingest.job_status(ingest_job) for ingest_job in recent_jobs],
+                    'counts': dict(counts),
+                    })
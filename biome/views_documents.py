@@ -15,18 +15,19 @@ from werkzeug import secure_filename
 from biome import ( api, 
                     app, 
                     data, 
+                    datastore, 
                     db, 
-                    decorators, 
                     forms, 
+                    ingest, 
                     models, 
                     tasks, 
                     views_helpers, 
                     )
-from tempfile import mkstemp
+from concurrent.futures import ThreadPoolExecutor
 from celery import group, chain, chord
 import re
+import gzip
 import json
-import shutil
 import decimal
 
 file_types = [  ('MS2', 'MS2'),
@@ -35,33 +36,73 @@ file_types = [  ('MS2', 'MS2'),
                 ('MS1', 'MS1')
             ]
 file_extensions = ('ms2', 'sqt', 'txt', 'ms1')
+# MS1/MS2/SQT files can also be uploaded gzip-compressed (e.g. 'sample.ms2.gz')
+COMPRESSED_UPLOAD_SUFFIX = '.gz'
+
+UPLOAD_BLOCK_SIZE = 4*1024*1024
+
+def uploaded_filename(filename):
+
+    ''' Filename of the uncompressed file ('sample.ms2.gz' -> 'sample.ms2')
+    '''
+
+    if filename.lower().endswith(COMPRESSED_UPLOAD_SUFFIX):
+        return filename[:-len(COMPRESSED_UPLOAD_SUFFIX)]
+
+    return filename
 
 def save_new_file(file_obj):
 
     ''' Saves a new file (specified by file_obj) to new_file_path by calculating
         its SHA224 hash and saving as 'SHA224_digest.[file_extension]'
+        in the content-addressed data store (see datastore.put_stream)
+
+        The upload stream is read once, in large blocks, and hashed while it's written.
+        If a file with the same hash is already saved, the existing file is kept.
+
+        Gzip-compressed uploads ('.gz') are decompressed while they're read (hashes are of the
+        uncompressed contents). MS1/MS2/SQT files are stored block-compressed (see datastore.put_stream)
 
         Returns new_file_path for new saved file.
     '''
 
-    uploads_dir = app.config['UPLOAD_FOLDER']+'/'
-    tmp_file_path = mkstemp()[1]
-    file_obj.save(tmp_file_path)
-    hash_val = views_helpers.get_hash(tmp_file_path)
+    original_filename = secure_filename(uploaded_filename(file_obj.filename))
+    extension = original_filename[-4:]
 
-    original_filename = secure_filename(file_obj.filename)
+    stream = file_obj.stream
+    if file_obj.filename.lower().endswith(COMPRESSED_UPLOAD_SUFFIX):
+        stream = gzip.GzipFile(fileobj=stream, mode='rb')
 
-    new_file_path = uploads_dir+hash_val+original_filename[-4:]
-    shutil.move(tmp_file_path, new_file_path)
+    new_file_path, _, _, is_new = datastore.put_stream(stream, extension, block_size=UPLOAD_BLOCK_SIZE, compress=datastore.is_compressed_type(extension))
 
-    app.logger.info('Saved uploaded file {} to {}'.format(file_obj.filename, new_file_path))
+    if is_new:
+        app.logger.info('Saved uploaded file {} to {}'.format(file_obj.filename, new_file_path))
+    else:
+        app.logger.info('Uploaded file {} is already saved as {}'.format(file_obj.filename, new_file_path))
 
     return new_file_path, original_filename
 
+def save_new_files(file_objs):
+
+    ''' Saves several uploaded files at once (see save_new_file), one thread per file
+        (up to app.config['UPLOAD_WORKERS'] threads). Hashing and file I/O release the GIL.
+
+        Returns a list of (new_file_path, original_filename), in the order of file_objs
+    '''
+
+    file_objs = list(file_objs)
+    if len(file_objs) <= 1:
+        return [save_new_file(file_obj) for file_obj in file_objs]
+
+    with ThreadPoolExecutor(max_workers=min(app.config['UPLOAD_WORKERS'], len(file_objs))) as executor:
+        return list(executor.map(save_new_file, file_objs))
+
 def check_file_types(filename_list):
 
     ''' Checks incoming files for correct file extensions
         and file names. Returns True if all OK, False if not.
+
+        MS1/MS2/SQT files may be gzip-compressed ('.gz')
     '''
 
     accepted_file_extensions = {'ms2',
@@ -71,7 +112,11 @@ def check_file_types(filename_list):
                                 }
 
     # check to make sure all filenames end in a correct extension
-    if not all([filename[-3:].lower() in accepted_file_extensions for filename in filename_list]):
+    if not all([uploaded_filename(filename)[-3:].lower() in accepted_file_extensions for filename in filename_list]):
+        return False
+
+    # DTASelect-filter.txt files can't be compressed (they're read with text file offsets)
+    if any([filename.lower().endswith('.txt'+COMPRESSED_UPLOAD_SUFFIX) for filename in filename_list]):
         return False
 
     # check to make sure all '.txt' files also end with 'DTASelect-filter.txt'
@@ -81,6 +126,95 @@ def check_file_types(filename_list):
 
     return True
 
+def save_dataset(dataset_name, dataset_description, saved_files):
+
+    ''' Creates a new Dataset with records for its saved files (MS1/MS2 files,
+        and a DBSearch for SQT/DTASelect files)
+
+        saved_files is a list of (new_file_path, original_filename), as returned by
+        save_new_files (also used for files from chunked uploads, see biome.uploads)
+
+        Returns a dict with the new dataset_id, dbsearch_id and file record IDs
+    '''
+
+    # (original filenames are without '.gz', see save_new_file)
+    ms1_file_paths = [saved for saved in saved_files if saved[1].endswith('.ms1')]
+    ms2_file_paths = [saved for saved in saved_files if saved[1].endswith('.ms2')]
+    sqt_file_paths = [saved for saved in saved_files if saved[1].endswith('.sqt')]
+    dta_file_paths = [saved for saved in saved_files if saved[1].endswith('.txt')]
+
+    dataset_id = None
+    dbsearch_id = None
+    ms1_data_ids = None
+    ms2_data_ids = None
+    sqt_data_ids = None
+    dta_data_ids = None
+
+    # save new dataset in database
+    try:
+        dataset_id = views_helpers.save_new_dataset(dataset_name, dataset_description)
+    except:
+        app.logger.error('Error creating new dataset {}'.format(dataset_name))
+        raise
+        return None
+
+    if ms1_file_paths:
+        try:
+            # save MS1 records to database
+            ms1_data_ids = [views_helpers.save_new_ms1_record(dataset_id, ms1_file_path, original_filename) for ms1_file_path, original_filename in ms1_file_paths]
+        except:
+            # log database error and return
+            app.logger.error('Error saving new MS1 file info to database')
+            raise
+            return None
+
+    if ms2_file_paths:
+        try:
+            # save MS2 records to database
+            ms2_data_ids = [views_helpers.save_new_ms2_record(dataset_id, ms2_file_path, original_filename) for ms2_file_path, original_filename in ms2_file_paths]
+        except:
+            # log database error and return
+            app.logger.error('Error saving new MS2 file info to database')
+            raise
+            return None
+
+    if sqt_file_paths or dta_file_paths:
+        try:
+            dbsearch_id = views_helpers.save_new_dbsearch(dataset_id) # create DBSearch
+        except:
+            # log DB error and return
+            app.logger.error('Error saving new Database Search to database')
+            raise
+            return None
+        if sqt_file_paths:                
+            try:
+                # save SQT records to database
+                sqt_data_ids = [views_helpers.save_new_sqt_record(dbsearch_id, sqt_file_path, original_filename) for sqt_file_path, original_filename in sqt_file_paths]
+                for sqt_data_id in sqt_data_ids:
+                    views_helpers.count_scans_in_file(sqt_data_id, 'sqt')
+            except:
+                app.logger.error('Error saving new SQT file info to database')
+                raise
+                return None
+        if dta_file_paths:
+            try:
+                # save DTA records to database
+                dta_data_ids = [views_helpers.save_new_dta_record(dbsearch_id, dta_file_path, original_filename) for dta_file_path, original_filename in dta_file_paths]
+            except:
+                app.logger.error('Error saving new DTA file info to database')
+                raise
+                return None
+
+    return {'dataset_id': dataset_id, 
+            'dataset_name': dataset_name, 
+            'dataset_description': dataset_description, 
+            'dbsearch_id': dbsearch_id,
+            'ms1_data_ids': ms1_data_ids,
+            'ms2_data_ids': ms2_data_ids, 
+            'sqt_data_ids': sqt_data_ids, 
+            'dta_data_ids': dta_data_ids, 
+            }
+
 @data.route('/', methods=('GET', 'POST'))
 def document_index():
 
@@ -100,89 +234,18 @@ def document_index():
         if not check_file_types(filenames):
             return 'Can\'t upload all of those file types... {}'.format(', '.join(filenames)) # this should return a redirect to a different view/AJAX response
 
+        if ingest.queue_full():
+            app.logger.warning('Too many queued ingest jobs, turning away upload of {}'.format(', '.join(filenames)))
+            return 'Too many files are being processed, try again later', 503
+
         # save new uploaded file data
         try:
-            ms1_file_paths = [save_new_file(file_obj) for file_obj in files if file_obj.filename.endswith('.ms1')]
-            ms2_file_paths = [save_new_file(file_obj) for file_obj in files if file_obj.filename.endswith('.ms2')]
-            sqt_file_paths = [save_new_file(file_obj) for file_obj in files if file_obj.filename.endswith('.sqt')]
-            dta_file_paths = [save_new_file(file_obj) for file_obj in files if file_obj.filename.endswith('.txt')]
+            saved_files = save_new_files(files)
         except:
             app.logger.error('Error saving new files')
             return 'Error saving new files'
 
-        dataset_id = None
-        dbsearch_id = None
-        ms1_data_ids = None
-        ms2_data_ids = None
-        sqt_data_ids = None
-        dta_data_ids = None
-
-        # save new dataset in database
-        dataset_name = upload_form.dataset_name.data
-        dataset_description = upload_form.dataset_desc.data
-        try:
-            dataset_id = views_helpers.save_new_dataset(dataset_name, dataset_description)
-        except:
-            app.logger.error('Error creating new dataset {}'.format(dataset_name))
-            raise
-            return None
-
-        if ms1_file_paths:
-            try:
-                # save MS1 records to database
-                ms1_data_ids = [views_helpers.save_new_ms1_record(dataset_id, ms1_file_path, original_filename) for ms1_file_path, original_filename in ms1_file_paths]
-            except:
-                # log database error and return
-                app.logger.error('Error saving new MS1 file info to database')
-                raise
-                return None
-
-        if ms2_file_paths:
-            try:
-                # save MS2 records to database
-                ms2_data_ids = [views_helpers.save_new_ms2_record(dataset_id, ms2_file_path, original_filename) for ms2_file_path, original_filename in ms2_file_paths]
-            except:
-                # log database error and return
-                app.logger.error('Error saving new MS2 file info to database')
-                raise
-                return None
-
-        if sqt_file_paths or dta_file_paths:
-            try:
-                dbsearch_id = views_helpers.save_new_dbsearch(dataset_id) # create DBSearch
-            except:
-                # log DB error and return
-                app.logger.error('Error saving new Database Search to database')
-                raise
-                return None
-            if sqt_file_paths:                
-                try:
-                    # save SQT records to database
-                    sqt_data_ids = [views_helpers.save_new_sqt_record(dbsearch_id, sqt_file_path, original_filename) for sqt_file_path, original_filename in sqt_file_paths]
-                    for sqt_data_id in sqt_data_ids:
-                        views_helpers.count_scans_in_file(sqt_data_id, 'sqt')
-                except:
-                    app.logger.error('Error saving new SQT file info to database')
-                    raise
-                    return None
-            if dta_file_paths:
-                try:
-                    # save DTA records to database
-                    dta_data_ids = [views_helpers.save_new_dta_record(dbsearch_id, dta_file_path, original_filename) for dta_file_path, original_filename in dta_file_paths]
-                except:
-                    app.logger.error('Error saving new DTA file info to database')
-                    raise
-                    return None
-
-        return jsonify({'dataset_id': dataset_id, 
-                        'dataset_name': dataset_name, 
-                        'dataset_description': dataset_description, 
-                        'dbsearch_id': dbsearch_id,
-                        'ms1_data_ids': ms1_data_ids,
-                        'ms2_data_ids': ms2_data_ids, 
-                        'sqt_data_ids': sqt_data_ids, 
-                        'dta_data_ids': dta_data_ids, 
-                        })
+        return jsonify(save_dataset(upload_form.dataset_name.data, upload_form.dataset_desc.data, saved_files))
 
     return render_template('data/document_index.html', upload_form=upload_form, recent_five_datasets=recent_five_datasets)
 
@@ -272,11 +335,11 @@ def delete_dataset(dataset_pk):
     # "delete" associated MS1 and MS2 files
     for ms1_file_id in dataset_quickinfo_dict['ms1_files']:
         ms1_file = models.MS1File.query.get(ms1_file_id)
-        ms1_file.deleted = new_status
+        datastore.set_deleted(ms1_file, new_status)
 
     for ms2_file_id in dataset_quickinfo_dict['ms2_files']:
         ms2_file = models.MS2File.query.get(ms2_file_id)
-        ms2_file.deleted = new_status
+        datastore.set_deleted(ms2_file, new_status)
 
     # "delete" associated dbsearches
     if dataset_quickinfo_dict['dbsearches']:
@@ -295,10 +358,10 @@ def delete_dataset(dataset_pk):
 
         # "delete" associated SQT and DTA files
         for sqt_file in all_sqt_files:
-            sqt_file.deleted = new_status
+            datastore.set_deleted(sqt_file, new_status)
 
         for dta_file in all_dta_files:
-            dta_file.deleted = new_status
+            datastore.set_deleted(dta_file, new_status)
 
     db.session.commit()
 
@@ -312,7 +375,7 @@ def delete_dtafile(dtafile_pk):
     new_status = not request.args.get('recover', None)
 
     current_dtafile = models.DTAFile.query.get(dtafile_pk)
-    current_dtafile.deleted = new_status
+    datastore.set_deleted(current_dtafile, new_status)
 
     db.session.commit()
 
@@ -5,12 +5,17 @@ from flask import ( current_app,
                     )
 from biome import ( api, 
                     app, 
+                    cache, 
+                    datastore, 
                     db, 
-                    decorators, 
+                    ingest, 
                     models, 
+                    parsers, 
+                    sidecar, 
                     tasks, 
                     )
 from hashlib import sha224
+import json
 
 def get_json_response(view_name, *args, **kwargs):
 
@@ -25,6 +30,34 @@ def get_json_response(view_name, *args, **kwargs):
     
     return json_obj
 
+def json_default(obj):
+
+    ''' default= function for json.dumps: encodes parsed records (parsers.Record) as objects
+    '''
+
+    if isinstance(obj, parsers.Record):
+        return dict(obj)
+    raise TypeError('{!r} is not JSON serializable'.format(obj))
+
+def iter_json_list(key, items, **fields):
+
+    ''' Encodes {key: [item, item, ...], **fields} as JSON, one item at a time (generator function)
+
+        Used to stream large JSON responses: yields the opening bytes (and any
+        other fields) right away, then one encoded item per iteration of the
+        (possibly lazy) items iterable
+    '''
+
+    opening = ''.join('{}: {}, '.format(json.dumps(name), json.dumps(value)) for name, value in sorted(fields.items()))
+    yield '{{{}{}: ['.format(opening, json.dumps(key)).encode('utf-8')
+
+    separator = b''
+    for item in items:
+        yield separator+json.dumps(item, default=json_default).encode('utf-8')
+        separator = b', '
+
+    yield b']}'
+
 def get_hash(filepath):
 
     ''' read filepath and return calculated SHA224 hex digest
@@ -33,13 +66,31 @@ def get_hash(filepath):
     hasher = sha224()
     with open(filepath, 'rb') as f:
         while True:
-            byte = f.read(1)
-            if not byte:
+            block = f.read(sidecar.HASH_BLOCK_SIZE)
+            if not block:
                 break
-            hasher.update(byte)
+            hasher.update(block)
 
     return hasher.hexdigest()
 
+def load_sidecar(file_path, suffix, job, *args):
+
+    ''' Returns memory-mapped tables from the sidecar of file_path (see cache.load_tables),
+        without building it in the request: if it doesn't exist (or is stale), the ingest
+        job that builds it (job(*args)) is submitted, unless it's already queued or running
+
+        Returns None until the sidecar is built (views return 503 then)
+    '''
+
+    tables = cache.load_tables(file_path, suffix)
+    if tables is None:
+        if ingest.pending_job(job.__name__, *args) is None:
+            job(*args)
+        # (the job already ran if INGEST_WORKERS is 0)
+        tables = cache.load_tables(file_path, suffix)
+
+    return tables
+
 def get_recent_records(model_obj, creation_time_field, n=5):
 
     ''' Returns the most recent n records (default of 5) from
@@ -49,14 +100,16 @@ def get_recent_records(model_obj, creation_time_field, n=5):
 
     return model_obj.query.filter_by(deleted=False).order_by(creation_time_field.desc()).limit(n).all()
 
-@decorators.async
+@ingest.job
 def count_scans_in_file(pk, filetype):
 
     ''' Counts scans in a recently uploaded MS2 or SQT file.
 
-        Creates a new thread so that it doesn't hold up page loads.
+        Runs as a background ingest job (see biome.ingest), so it doesn't hold up page loads.
 
-        (in the future, will expand functionality to parse out other information upon file upload)
+        MS2 files are indexed (see cache.ms2_scan_index), and the index summary (with the
+        H line headers) is saved to the MS2File. SQT files are read once (parsers.sqt_summary),
+        and their summary (search engine, database, charge states) is saved to the SQTFile
     '''
 
     if filetype == 'ms2':
@@ -67,14 +120,49 @@ def count_scans_in_file(pk, filetype):
         app.logger.error('Invalid filetype "{}" given to count_scans_in_file()'.format(filetype))
         return
 
-    with open(model_obj.file_path) as f:
-        scan_count = len([line for line in f.readlines() if line.startswith('S\t')])
+    ingest.report_progress(0.0, 'Reading {} file {}'.format(filetype.upper(), model_obj.file_path))
+
+    try:
+        if filetype == 'ms2':
+            model_obj.summary = parsers.ms2_summary(cache.ms2_scan_index(model_obj.file_path), parsers.file_headers(model_obj.file_path))
+        else:
+            model_obj.summary = parsers.sqt_summary(model_obj.file_path)
+        scan_count = model_obj.summary['scans']
+    except:
+        app.logger.error('Could not read scans from {} file {}'.format(filetype.upper(), model_obj.file_path))
+        raise
 
     model_obj.scans = scan_count
 
     db.session.commit()
 
-    app.logger.info('Recorded {} scans in new MS2File ID {}'.format(scan_count, pk))
+    app.logger.info('Recorded {} scans in new {} file ID {}'.format(scan_count, filetype.upper(), pk))
+
+    return
+
+@ingest.job
+def precompute_ms1_chromatograms(pk):
+
+    ''' Builds the XIC index and TIC/base peak chromatogram sidecars of a recently
+        uploaded MS1 file (in one pass over the file, see cache.build_ms1_sidecars), and
+        saves its summary (parsers.ms1_summary, from the chromatograms) to the MS1File
+
+        Runs as a background ingest job (see biome.ingest), so it doesn't hold up page loads.
+    '''
+
+    model_obj = models.MS1File.query.get(pk)
+
+    try:
+        cache.build_ms1_sidecars(model_obj.file_path)
+        model_obj.summary = parsers.ms1_summary(cache.ms1_chromatograms(model_obj.file_path), parsers.file_headers(model_obj.file_path))
+    except:
+        app.logger.error('Could not compute chromatograms of MS1 file {}'.format(model_obj.file_path))
+        raise
+
+    scan_count = model_obj.scans = model_obj.summary['scans']
+    db.session.commit()
+
+    app.logger.info('Computed chromatograms ({} scans) of new MS1 file ID {}'.format(scan_count, pk))
 
     return
 
@@ -111,8 +199,11 @@ def save_new_ms1_record(dataset_id, file_path, original_filename=None):
 
     new_ms1_file = models.MS1File(file_path, dataset_id, original_filename=original_filename)
     db.session.add(new_ms1_file)
+    datastore.add_reference(new_ms1_file)
     db.session.commit()
 
+    precompute_ms1_chromatograms(new_ms1_file.id)
+
     app.logger.info('Saved new MS1 file {} (Dataset ID {}) to database'.format(file_path, dataset_id))
 
     return new_ms1_file.id
@@ -124,6 +215,7 @@ def save_new_ms2_record(dataset_id, file_path, original_filename=None):
 
     new_ms2_file = models.MS2File(file_path, dataset_id, original_filename=original_filename)
     db.session.add(new_ms2_file)
+    datastore.add_reference(new_ms2_file)
     db.session.commit()
 
     count_scans_in_file(new_ms2_file.id, 'ms2')
@@ -139,23 +231,112 @@ def save_new_sqt_record(dbsearch_id, file_path, original_filename=None):
 
     new_sqt_file = models.SQTFile(file_path, dbsearch_id, original_filename=original_filename)
     db.session.add(new_sqt_file)
+    datastore.add_reference(new_sqt_file)
     db.session.commit()
 
     app.logger.info('Saved new SQT file {} (Dataset ID {}) to database'.format(file_path, dbsearch_id))
 
     return new_sqt_file.id
 
+@ingest.job
+def cache_dtaselect_file(file_path):
+
+    ''' Builds the parsed DTASelect and protein group index sidecar files
+        (see cache.dtaselect_tables and cache.dtaselect_index) for
+        a recently uploaded DTASelect-filter.txt file
+
+        Runs as a background ingest job (see biome.ingest), so it doesn't hold up page loads.
+    '''
+
+    cache.dtaselect_index(file_path)
+    ingest.report_progress(0.5, 'Indexed protein groups')
+    cache.dtaselect_tables(file_path)
+
+    return
+
+def parse_dta_records(dtafile_objects, columnar=False, **kwargs):
+
+    ''' Parses the DTASelect-filter.txt files of several DTAFile records at once
+        (e.g. all DTAFiles of a DBSearch or Dataset), using a process pool of
+        app.config['DTASELECT_POOL_SIZE'] processes (see parsers.dtaselect_files)
+
+        Returns merged tables (columnar=True) or a list of protein lists (one per record)
+    '''
+
+    file_paths = [dtafile_object.file_path for dtafile_object in dtafile_objects]
+
+    return parsers.dtaselect_files(file_paths, columnar=columnar, processes=app.config['DTASELECT_POOL_SIZE'], **kwargs)
+
+@ingest.job
+def cache_dbsearch_dtaselect_files(dbsearch_id):
+
+    ''' Builds the parsed DTASelect sidecar files (see cache.dtaselect_tables) of all
+        DTAFiles of a DBSearch that don't have a current one, parsing the files
+        at once in a process pool (see parse_dta_records)
+
+        Runs as a background ingest job (see biome.ingest), so it doesn't hold up page loads.
+    '''
+
+    dtafile_objects = [dtafile_object for dtafile_object in models.DBSearch.query.get(dbsearch_id).dtafiles.all()
+                       if cache.load_tables(dtafile_object.file_path, cache.DTASELECT_SUFFIX) is None]
+    if not dtafile_objects:
+        return
+
+    # (signatures of the contents that are parsed)
+    sources = [cache.source_signature(dtafile_object.file_path) for dtafile_object in dtafile_objects]
+    tables_list = parse_dta_records(dtafile_objects, columnar=True, merge=False)
+    ingest.report_progress(0.9, 'Parsed {} DTASelect files'.format(len(dtafile_objects)))
+
+    for dtafile_object, tables, source in zip(dtafile_objects, tables_list, sources):
+        cache.write_tables(dtafile_object.file_path+cache.DTASELECT_SUFFIX, tables, source)
+        app.logger.info('Wrote {} sidecar for {}'.format(cache.DTASELECT_SUFFIX, dtafile_object.file_path))
+
+    return
+
+def get_dta_summary(file_path):
+
+    ''' Reads the summary table at the end of a DTASelect-filter.txt file
+        (protein/peptide/spectrum counts). Only reads the end of the file.
+
+        Returns None if the summary can't be read
+    '''
+
+    try:
+        return parsers.dtaselect_summary(file_path)
+    except:
+        app.logger.error('Could not read DTASelect summary from {}'.format(file_path))
+        return None
+
+def get_dta_flags(file_path):
+
+    ''' Reads the DTASelect flags (e.g. '-p 2 -m 0 --trypstat') from the header
+        of a DTASelect-filter.txt file. Only reads the header.
+
+        Returns None if the header can't be read
+    '''
+
+    try:
+        flags = parsers.dtaselect_header_info(file_path)['flags']
+    except:
+        app.logger.error('Could not read DTASelect flags from {}'.format(file_path))
+        return None
+
+    return flags[:100] if flags else None # (length of the flags column)
+
 def save_new_dta_record(dbsearch_id, file_path, original_filename=None):
 
     ''' Creates a new row in the dta_file db table
     '''
 
-    # parse DTA file for 'flags' field... (something like '-p 2 -m 0 --trypstat')
-
     new_dta_file = models.DTAFile(file_path, dbsearch_id, original_filename=original_filename)
+    new_dta_file.flags = get_dta_flags(file_path)
+    new_dta_file.summary = get_dta_summary(file_path)
     db.session.add(new_dta_file)
+    datastore.add_reference(new_dta_file)
     db.session.commit()
 
+    cache_dtaselect_file(file_path)
+
     app.logger.info('Saved new DTA file {} (Dataset ID {}) to database'.format(file_path, dbsearch_id))
 
     return new_dta_file.id
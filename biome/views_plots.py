@@ -8,13 +8,12 @@ from flask import ( render_template, jsonify,
                     )
 from biome import ( app, 
                     api, 
+                    cache, 
                     data, 
                     models, 
                     views_helpers, 
                     )
 
-from collections import Counter
-
 from bokeh.embed import components
 from bokeh.plotting import figure
 from bokeh.resources import INLINE
@@ -73,11 +72,34 @@ def polynomial():
     return encode_utf8(html)
 
 
+def count_psms_per_lc_step(peptides):
+
+    ''' Counts distinct PSMs (LC step, scan, charge state) per chromatography step
+        from the 'peptides' table of parsers.dtaselect_columnar()
+        (or its memory-mapped copy from cache.dtaselect_tables())
+
+        Returns (lc_steps, counts) arrays. Peptides without an LC step in their
+        file name (lc_step -1 in the table) aren't counted
+    '''
+
+    known = peptides['lc_step'] >= 0
+    keys = np.vstack((peptides['lc_step'][known], peptides['scan'][known], peptides['charge_state'][known]))
+    keys = keys[:, np.lexsort(keys[::-1])]
+
+    # the same PSM can be listed under more than one protein group
+    distinct = np.ones(keys.shape[1], dtype=bool)
+    distinct[1:] = np.any(np.diff(keys, axis=1) != 0, axis=0)
+
+    return np.unique(keys[0][distinct], return_counts=True)
+
 @data.route('/dta/<dtafile_pk>/saltstep')
 def salt_step_peptide_analysis(dtafile_pk):
 
     ''' Determines how many filtered peptides are present 
         per chromatography step and draws a plot
+
+        Counted from the parsed DTASelect sidecar (see cache.dtaselect_tables), which
+        is built by an ingest job, not in this request (503 until it's built)
     '''
 
     current_dtafile = models.DTAFile.query.get_or_404(dtafile_pk)
@@ -85,33 +107,15 @@ def salt_step_peptide_analysis(dtafile_pk):
     dtafile_quickinfo_dict = views_helpers.get_json_response('api.dtafile_quickinfo', dtafile_pk)
     dtafile_quickinfo_dict = json.loads(dtafile_quickinfo_dict)
 
-    dtafile_json = views_helpers.get_json_response('api.dtafile_json', dtafile_pk)
-    dtafile_json = json.loads(dtafile_json)
+    dtaselect_tables = views_helpers.load_sidecar(current_dtafile.file_path, cache.DTASELECT_SUFFIX, views_helpers.cache_dtaselect_file, current_dtafile.file_path)
+    if dtaselect_tables is None:
+        return 'This DTASelect file is still being processed, try again later', 503
 
     parent_dbsearch = models.DBSearch.query.get_or_404(dtafile_quickinfo_dict['parent_dbsearch'])
     sqt_files = parent_dbsearch.sqtfiles.all()
     parent_dataset = models.Dataset.query.get_or_404(parent_dbsearch.dataset_id)
 
-    def get_distinct_psm_ids(dtaselect_parser):
-        psms = set()
-        for locus in dtaselect_parser:
-            for peptide in locus['peptides']:
-                psm_id = str(peptide['LCStep'])+'_'+str(peptide['Scan'])+'_'+str(peptide['ChargeState'])
-                psms.add(psm_id)
-        return psms
-
-    def make_LCStep_histogram(psm_ids_set):
-        full_lcstep_count = []
-        for psm in psm_ids_set:
-            full_lcstep_count.append(psm.split('_')[0])
-
-        return Counter(full_lcstep_count)
-
-    psm_ids = get_distinct_psm_ids(dtafile_json['data'])
-    hist = make_LCStep_histogram(psm_ids)
-    labels, values = zip(*sorted(hist.items(), key=lambda x: int(x[0])))
-    labels = np.array(labels)
-    values = np.array(values)
+    labels, values = count_psms_per_lc_step(dtaselect_tables['peptides'])
 
     fig = figure(title="Peptides per LC Step", y_range=[0, max(values)*1.25], plot_height=400, plot_width=700)
     fig.rect(x=labels, y=values/2, width=0.8, height=values)
@@ -14,10 +14,10 @@ from flask import ( abort,
 from werkzeug import secure_filename
 from biome import ( api, 
                     app, 
+                    cache, 
                     celery, 
                     data, 
                     db, 
-                    decorators, 
                     forms, 
                     models, 
                     search, 
@@ -27,6 +27,7 @@ from biome import ( api,
 from tempfile import mkstemp
 from celery import group, chain, chord
 from uuid import uuid4
+import os
 import re
 import json
 import shutil
@@ -59,6 +60,8 @@ def new_search(dataset_pk):
 
         remote_host = 'admin@wolanlab'
         remote_filepaths = [ms2file.file_path for ms2file in ms2_files]
+        # (with their scan index sidecars, so the worker splits them without reading them first)
+        remote_filepaths += [file_path+cache.MS2_INDEX_SUFFIX for file_path in remote_filepaths if os.path.exists(file_path+cache.MS2_INDEX_SUFFIX)]
 
 
         # hard-coded for now... remove later! (once on production server)
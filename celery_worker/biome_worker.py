@@ -28,12 +28,22 @@ except RuntimeError as exc:
 
 try:
     import pymongo
-except ImportError as exc
+except ImportError as exc:
     print("Couldn't import pymongo... some tasks not functional")
     print(exc)
 
 ex_path = os.path.split(os.path.abspath(__file__))[0] # the directory in which this script lives
 
+try:
+    # ms2.py, sidecar.py and bgzf.py from biome/, copied next to this script
+    import ms2
+    import sidecar
+except ImportError:
+    # (in a checkout of the whole repository)
+    sys.path.append(os.path.join(ex_path, os.pardir, 'biome'))
+    import ms2
+    import sidecar
+
 app = Celery('biome')
 app.config_from_object('celeryconfig')
 
@@ -77,15 +87,53 @@ def rsync_file(self, remote_host, remote_filepaths, new_local_directory=None):
     print(stdout)
     return new_local_directory
 
+def ms2_files_in(directory):
+
+    ''' MS2 files in directory, plain or block-compressed ('.ms2.gz', as stored by biome)
+    '''
+
+    return sorted(glob.glob(os.path.join(directory, '*.ms2'))+glob.glob(os.path.join(directory, '*.ms2.gz')))
+
+def uncompressed_name(file_name):
+
+    ''' 'sample.ms2.gz' -> 'sample.ms2' (other names are unchanged)
+    '''
+
+    return file_name[:-len('.gz')] if file_name.endswith('.gz') else file_name
+
+def indexed_scan_offsets(ms2_file_path):
+
+    ''' Scan offsets of an MS2 file (see ms2.index_offsets) from the scan index sidecar
+        that biome keeps next to it (ms2_file_path+ms2.INDEX_SUFFIX, transferred with the file)
+
+        Returns None if there's no sidecar, or it wasn't made from the contents of this file
+    '''
+
+    sidecar_path = ms2_file_path+ms2.INDEX_SUFFIX
+    if not os.path.exists(sidecar_path):
+        return None
+
+    try:
+        source, arrays = sidecar.read_arrays(sidecar_path)
+        if not sidecar.is_current(source, ms2_file_path):
+            print('Ignoring scan index of another version of {}'.format(ms2_file_path))
+            return None
+        return ms2.index_offsets({'offset': arrays['scans/offset'], 'length': arrays['scans/length']})
+    except (ValueError, KeyError) as exc:
+        print('Ignoring invalid scan index {}: {}'.format(sidecar_path, exc))
+        return None
+
 def split_ms2_file(ms2_file_path, params_dict):
 
     ''' Splits an MS2 file (ms2_file_path) into split_n subfiles 
-        by scan (lines that match '^S\t')
+        by scan (see ms2.split_file: the scans are found in its scan index sidecar
+        if there's a current one, otherwise in one pass over the file; then
+        each subfile is copied as one byte range, with the H lines of the file)
 
-        Returns a list of new subfile absolute paths
+        ms2_file_path can be gzip/BGZF-compressed; subfiles are always uncompressed,
+        and named like sample_1.ms2, sample_2.ms2, ... (in scan order)
 
-        ** Requires GNU grep to be available as `grep` on worker **
-        ** Requires GNU parallel to be available as `parallel` on worker **
+        Returns a list of new subfile absolute paths
     '''
 
     split_n = params_dict['split_n']
@@ -93,23 +141,13 @@ def split_ms2_file(ms2_file_path, params_dict):
 
     print('Splitting: ' + ms2_file_path)
     dir_name = os.path.dirname(ms2_file_path)
-    base_name = os.path.basename(ms2_file_path)
+    base_name = uncompressed_name(os.path.basename(ms2_file_path))
     temp_dir_path = os.path.join(dir_name, temp_folder)
-    out_path = os.path.join(temp_dir_path, base_name.replace('.ms2','_{#}.ms2'))
+    out_path = os.path.join(temp_dir_path, base_name.replace('.ms2', '_{}.ms2'))
     if not os.path.exists(temp_dir_path):
         os.makedirs(temp_dir_path)
 
-    num_scans = int(subprocess.check_output(['grep', '-c', '^S', ms2_file_path]))
-    block_size = round(num_scans / split_n) + 1
-    
-    command = "cat {ms2_file_path} | parallel --pipe -N {block_size} --recstart 'S\\t' \"cat > {out_path} && echo {out_path}\"".format(
-    **{'ms2_file_path': ms2_file_path, 'block_size': block_size, 'out_path': out_path})
-    
-    p = subprocess.Popen(command, shell=True, stdout=subprocess.PIPE)
-    stdout, stderr = p.communicate()
-    if p.returncode != 0:
-         raise ValueError(stderr)
-    return stdout.decode('utf-8').splitlines()
+    return ms2.split_file(ms2_file_path, split_n, out_path, offsets=indexed_scan_offsets(ms2_file_path))
 
 def make_job_file(ms2_chunk_file, params_dict):
 
@@ -189,7 +227,7 @@ def split_ms2_and_make_jobs(new_local_directory, params_dict):
         (one job file per MS2 chunk)
     '''
 
-    MS2_files = glob.glob(new_local_directory+'/*.ms2')
+    MS2_files = ms2_files_in(new_local_directory)
     temp_dir_path = os.path.join(new_local_directory, params_dict['temp'])
 
     print('Splitting MS2 files: {}'.format(', '.join(MS2_files)))
@@ -362,14 +400,15 @@ def combine_sqt_parts(base_directory_name, params):
 
     # get parent MS2 filenames
     # i.e., 121614_SC_sampleH1sol_25ug_pepstd_HCD_FTMS_MS2_07.ms2
-    base_ms2_files = [os.path.basename(filepath) for filepath in glob.glob(os.path.join(base_directory, '*.ms2'))]
+    base_ms2_files = [uncompressed_name(os.path.basename(filepath)) for filepath in ms2_files_in(base_directory)]
 
     # extract base names
     # i.e., '121614_SC_sampleH1sol_25ug_pepstd_HCD_FTMS_MS2_07'
     base_filenames = [filename.replace('.ms2', '') for filename in base_ms2_files]
 
     for base_filename in base_filenames:
-        child_files = glob.glob(os.path.join(temp_directory, base_filename+'*.sqt'))
+        # (chunk numbers are zero-padded, so sorted names are in scan order -- see ms2.split_file)
+        child_files = sorted(glob.glob(os.path.join(temp_directory, base_filename+'_*.sqt')))
 
         if child_files:
 
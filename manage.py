@@ -14,4 +14,53 @@ if __name__ == '__main__':
     manager.add_command('runserver', server)
     manager.add_command('db', MigrateCommand)
 
+    @manager.command
+    def compact():
+
+        ''' Removes stored files that are only used by deleted records (see biome.datastore.compact)
+        '''
+
+        from biome import datastore
+        for hash_val, size in datastore.compact():
+            print('Reclaimed {} ({} bytes)'.format(hash_val, size))
+
+    @manager.command
+    def backfill_store():
+
+        ''' Moves files of records saved before the data store existed into the store (see biome.datastore.backfill_blobs)
+        '''
+
+        from biome import datastore
+        for old_path, new_path in datastore.backfill_blobs():
+            print('Registered {} as {}'.format(old_path, new_path))
+
+    @manager.command
+    def compress_store():
+
+        ''' Compresses stored MS1/MS2/SQT files that aren't compressed yet (see biome.datastore.compress_blobs)
+        '''
+
+        from biome import datastore
+        for hash_val, size_before, size_after in datastore.compress_blobs():
+            print('Compressed {} ({} bytes -> {} bytes)'.format(hash_val, size_before, size_after))
+
+    @manager.command
+    def requeue_jobs():
+
+        ''' Queues ingest jobs again that were running in processes that have exited (see biome.ingest.requeue_stale_jobs)
+        '''
+
+        from biome import ingest
+        print('Queued {} ingest jobs again'.format(ingest.requeue_stale_jobs()))
+
+    @manager.command
+    def expire_uploads():
+
+        ''' Removes the part files of upload sessions that stopped receiving chunks (see biome.uploads.expire_sessions)
+        '''
+
+        from biome import uploads
+        for session_id in uploads.expire_sessions():
+            print('Expired upload session {}'.format(session_id))
+
     manager.run()